@@ -0,0 +1,152 @@
+"""Кэш синтезированной речи с адресацией по содержимому.
+
+Два уровня: LRU в памяти и необязательный каталог на диске.
+Оба уровня ограничены по суммарному размеру и вытесняют
+давно не использованные записи.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+# Временные файлы старше этого оставлены прерванной записью и удаляются
+STALE_TMP_SECONDS = 600
+
+
+def normalize_text(text):
+    """Нормализация текста: Unicode NFC и схлопывание пробелов"""
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def audio_cache_key(text, lang):
+    """Ключ кэша: хэш нормализованного текста и языка озвучки"""
+    payload = f"{lang}\0{normalize_text(text)}".encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()
+
+
+class AudioCache:
+    """Двухуровневый кэш аудио (память + диск)"""
+
+    def __init__(self, memory_bytes, disk_dir=None, disk_bytes=0):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir or None
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    def _scan_disk(self):
+        """Загрузка индекса дискового кэша, старые файлы - первые на вытеснение"""
+        entries = []
+        stale_before = time.time() - STALE_TMP_SECONDS
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if name.endswith('.tmp'):
+                # Свежий файл может еще записываться другим процессом
+                try:
+                    if os.stat(path).st_mtime < stale_before:
+                        os.unlink(path)
+                except OSError as e:
+                    logger.debug(f"Не удалось удалить временный файл кэша {name}: {e}")
+                continue
+            if not name.endswith('.mp3'):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._evict_disk()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.mp3")
+
+    def get(self, key):
+        """Возвращает аудио из кэша или None"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+            if not self.disk_dir or key not in self._disk:
+                return None
+            self._disk.move_to_end(key)
+        try:
+            path = self._disk_path(key)
+            with open(path, 'rb') as audio_file:
+                data = audio_file.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                size = self._disk.pop(key, None)
+                if size is not None:
+                    self._disk_size -= size
+            return None
+        with self._lock:
+            self._put_memory(key, data)
+        return data
+
+    def put(self, key, data):
+        """Сохраняет аудио в кэш"""
+        with self._lock:
+            self._put_memory(key, data)
+            if not self.disk_dir or key in self._disk or len(data) > self.disk_bytes:
+                return
+        # У каждого писателя свой временный файл: одинаковый ключ могут
+        # записывать несколько потоков сразу
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as audio_file:
+                audio_file.write(data)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError as e:
+            logger.warning(f"Не удалось записать аудио в дисковый кэш: {e}")
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+            return
+        with self._lock:
+            # Другой писатель мог успеть учесть этот ключ
+            if key in self._disk:
+                self._disk.move_to_end(key)
+                return
+            self._disk[key] = len(data)
+            self._disk_size += len(data)
+            self._evict_disk()
+
+    def _put_memory(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old)
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_bytes:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.unlink(self._disk_path(key))
+            except OSError:
+                pass
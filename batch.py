@@ -0,0 +1,186 @@
+"""Пакетный анализ корпуса текстов без Telegram.
+
+Пример:
+    python batch.py texts/ -o results.json --workers 8 --charts charts/ --format webp
+
+Каждый файл анализируется потоково в отдельном процессе, метрики
+документов сводятся в матрицу NumPy и агрегируются по корпусу.
+Результат сохраняется в JSON или CSV (по расширению файла).
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from image_encoder import FORMATS, ImageEncoder
+from reports import METRIC_FIELDS, REPORTS, build_report, summarize
+from text_analysis import analyze_file
+
+logger = logging.getLogger(__name__)
+
+
+def find_texts(root, pattern_ext='.txt'):
+    """Все текстовые файлы каталога (рекурсивно) в стабильном порядке"""
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.lower().endswith(pattern_ext):
+                paths.append(os.path.join(dirpath, name))
+    paths.sort()
+    return paths
+
+
+def process_document(path, root, charts_dir=None, viz_types=(), encoder=None):
+    """Анализ одного документа (выполняется в процессе-воркере)"""
+    relative = os.path.relpath(path, root)
+    try:
+        analysis = analyze_file(path)
+    except OSError as e:
+        return {'path': relative, 'error': str(e)}
+
+    result = summarize(analysis)
+    result['path'] = relative
+
+    if charts_dir:
+        from charts import render_chart
+
+        base = os.path.join(charts_dir, os.path.splitext(relative)[0])
+        os.makedirs(os.path.dirname(base) or '.', exist_ok=True)
+        for viz_type in viz_types:
+            report = build_report(viz_type, analysis)
+            if report is None:
+                continue
+            image = render_chart(viz_type, report.data, encoder)
+            extension = encoder.extension if encoder else 'png'
+            with open(f"{base}.{viz_type}.{extension}", 'wb') as chart_file:
+                chart_file.write(image)
+    return result
+
+
+def _process_star(args):
+    return process_document(*args)
+
+
+def aggregate(documents):
+    """Сводка по корпусу: векторные статистики по матрице метрик"""
+    rows = [doc for doc in documents if 'error' not in doc]
+    if not rows:
+        return {'documents': 0}
+
+    matrix = np.array([[doc[field] for field in METRIC_FIELDS] for doc in rows], dtype=np.float64)
+    totals = matrix.sum(axis=0)
+    percentiles = np.percentile(matrix, [50, 90], axis=0)
+
+    # Частые слова корпуса считаются по топ-словам каждого документа
+    top_words = Counter()
+    for doc in rows:
+        top_words.update(dict(doc['top_words']))
+
+    corpus = {
+        'documents': len(rows),
+        'errors': len(documents) - len(rows),
+        'total': {},
+        'mean': {},
+        'median': {},
+        'p90': {},
+        'min': {},
+        'max': {},
+    }
+    for i, field in enumerate(METRIC_FIELDS):
+        if not field.startswith('avg_'):
+            corpus['total'][field] = int(totals[i])
+        corpus['mean'][field] = round(float(matrix[:, i].mean()), 3)
+        corpus['median'][field] = round(float(percentiles[0, i]), 3)
+        corpus['p90'][field] = round(float(percentiles[1, i]), 3)
+        corpus['min'][field] = round(float(matrix[:, i].min()), 3)
+        corpus['max'][field] = round(float(matrix[:, i].max()), 3)
+    # Среднее по всему корпусу, а не среднее средних по документам
+    sentences = totals[METRIC_FIELDS.index('sentences')]
+    if sentences:
+        corpus['words_per_sentence'] = round(float(totals[METRIC_FIELDS.index('words')] / sentences), 3)
+    corpus['top_words'] = top_words.most_common(20)
+    return corpus
+
+
+def write_json(path, documents, corpus):
+    with open(path, 'w', encoding='utf-8') as out:
+        json.dump({'corpus': corpus, 'documents': documents}, out, ensure_ascii=False, indent=2)
+
+
+def write_csv(path, documents):
+    with open(path, 'w', encoding='utf-8', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(['path'] + METRIC_FIELDS + ['top_words', 'error'])
+        for doc in documents:
+            if 'error' in doc:
+                writer.writerow([doc['path']] + [''] * len(METRIC_FIELDS) + ['', doc['error']])
+                continue
+            top = ' '.join(f"{word}:{count}" for word, count in doc['top_words'])
+            writer.writerow([doc['path']] + [doc[field] for field in METRIC_FIELDS] + [top, ''])
+
+
+def run_batch(root, workers=None, charts_dir=None, viz_types=(), encoder=None):
+    """Анализ всех текстов каталога, возвращает (документы, сводка)"""
+    paths = find_texts(root)
+    workers = workers or os.cpu_count() or 1
+    tasks = [(path, root, charts_dir, tuple(viz_types), encoder) for path in paths]
+    # Крупные пачки задач уменьшают накладные расходы на передачу между процессами
+    chunksize = max(1, len(tasks) // (workers * 8))
+
+    if workers == 1:
+        documents = [_process_star(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            documents = list(executor.map(_process_star, tasks, chunksize=chunksize))
+    return documents, aggregate(documents)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный анализ корпуса текстов")
+    parser.add_argument('corpus', help="каталог с файлами .txt")
+    parser.add_argument('-o', '--output', default='results.json',
+                        help="файл результатов: .json или .csv (по умолчанию results.json)")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="число процессов (по умолчанию - число ядер)")
+    parser.add_argument('--charts', metavar='DIR', default=None,
+                        help="каталог для PNG-графиков каждого документа")
+    parser.add_argument('--viz', default=','.join(REPORTS),
+                        help="типы графиков через запятую (freq,stats,pie,structure,cloud)")
+    parser.add_argument('--format', choices=sorted(FORMATS), default='png24',
+                        help="формат графиков (по умолчанию полноцветный PNG)")
+    parser.add_argument('--max-kb', type=int, default=0,
+                        help="бюджет размера графика в КБ (0 - без ограничения)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    viz_types = [v for v in args.viz.split(',') if v]
+    unknown = [v for v in viz_types if v not in REPORTS]
+    if unknown:
+        parser.error(f"неизвестные типы графиков: {', '.join(unknown)}")
+
+    encoder = ImageEncoder(args.format, args.max_kb * 1024)
+    started = time.perf_counter()
+    documents, corpus = run_batch(args.corpus, args.workers, args.charts, viz_types, encoder)
+    elapsed = time.perf_counter() - started
+
+    if args.output.lower().endswith('.csv'):
+        write_csv(args.output, documents)
+    else:
+        write_json(args.output, documents, corpus)
+
+    rate = len(documents) / elapsed if elapsed else 0
+    logger.info(f"Обработано документов: {len(documents)} за {elapsed:.1f} с ({rate:.0f} док/с), "
+                f"результат: {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
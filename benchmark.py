@@ -0,0 +1,447 @@
+"""Замеры производительности бота без Telegram и Google.
+
+Пример:
+    python benchmark.py --concurrency 1,8,32 --sizes 200,1000,2000 -o bench.json
+    python benchmark.py --compare bench_old.json bench.json
+
+Обновления (нажатия кнопок и сообщения) создаются синтетически и
+проходят через обычные обработчики бота (handle_button,
+handle_text_message) и его обработчик обновлений. Вызовы Bot API
+обслуживает FakeRequest из fake_telegram.py, gTTS заменен
+детерминированной заглушкой с задержкой, пропорциональной длине
+текста (--tts-slow-percent делает часть вызовов медленнее, чтобы
+проверить дублирование запросов). Графики строятся по-настоящему,
+в пуле рендеринга.
+
+Для каждого сценария (тип инфографики или озвучка), размера текста и
+уровня параллельности выводятся p50/p95/p99 задержки обработки
+сообщения и пропускная способность; результаты сохраняются в JSON
+для сравнения версий.
+
+Режим --flashcards замеряет движок карточек: задержку выбора следующей
+карточки в зависимости от размера колоды и числа учеников (в столбцах
+size и concurrency), а также первую загрузку сессии из базы и запись
+ответа:
+
+    python benchmark.py --flashcards --deck-sizes 100,1000,10000 --users 10,100,1000
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+SCENARIOS = ['freq', 'stats', 'pie', 'structure', 'cloud', 'full', 'tts']
+# Предел длины текста, который визуализируется из сообщения
+VIZ_MAX_CHARS = 2000
+
+WORDS = (
+    'текст слово предложение абзац анализ ученик урок школа книга язык история '
+    'природа город река время работа задача пример ответ вопрос знание память '
+    'и в на с по к из за от для не что как это он она они мы было будет очень '
+    'быстро медленно интересно важно новый старый большой маленький первый '
+    'последний читать писать думать говорить слушать понимать учиться'
+).split()
+
+
+def make_text(size, seed):
+    """Детерминированный текст примерно из size символов"""
+    rng = random.Random(seed)
+    paragraphs = []
+    length = 0
+    while length < size:
+        sentences = []
+        for _ in range(rng.randint(2, 5)):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(4, 14))]
+            sentences.append(' '.join(words).capitalize() + rng.choice('..!?'))
+        paragraph = ' '.join(sentences)
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return '\n\n'.join(paragraphs)[:size].strip()
+
+
+def make_stub_synthesize(ms_per_100_chars, slow_percent=0.0, slow_factor=10.0, seed='bench'):
+    """Заглушка gTTS: задержка как у запросов по 100 символов, байты зависят только от текста.
+
+    slow_percent процентов вызовов отвечают в slow_factor раз медленнее.
+    """
+    rng = random.Random(seed)
+
+    def synthesize(text, lang='ru', timeout=None):
+        delay = ms_per_100_chars / 1000 * math.ceil(len(text) / 100)
+        if rng.random() * 100 < slow_percent:
+            delay *= slow_factor
+        time.sleep(delay)
+        digest = hashlib.sha256(f'{lang}:{text}'.encode()).digest()
+        return digest * (len(text) // 3 + 1)
+    return synthesize
+
+
+def percentile(values, p):
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+class Bench:
+    """Бот с заглушкой Bot API и прогон сценариев"""
+
+    def __init__(self, render_workers, api_latency):
+        import bot
+        from fake_telegram import FakeRequest
+
+        self.request = FakeRequest(api_latency)
+        self.bot = bot.EducationalBot('1:BENCH', render_workers=render_workers, prewarm=False)
+        self.application = self.bot.build_application(request=self.request)
+        self._update_ids = itertools.count(1)
+        self._user_ids = itertools.count(1)
+
+    async def __aenter__(self):
+        await self.application.initialize()
+        await self.bot.renderer.warm_up()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.application.shutdown()
+        await self.bot.post_shutdown(self.application)
+
+    async def send(self, payload):
+        """Обработка обновления так же, как при получении от Telegram, возвращает время, с"""
+        from telegram import Update
+
+        update = Update.de_json(payload, self.application.bot)
+        started = time.perf_counter()
+        await self.application.update_processor.process_update(
+            update, self.application.process_update(update)
+        )
+        return time.perf_counter() - started
+
+    async def user_session(self, scenario, text):
+        """Сценарий одного пользователя: две кнопки и сообщение с текстом"""
+        from fake_telegram import make_callback_update, make_message_update
+
+        user_id = next(self._user_ids)
+        buttons = ['tts', 'lang_ru'] if scenario == 'tts' else ['visualize', f'viz_{scenario}']
+        button_times = []
+        for data in buttons:
+            button_times.append(await self.send(make_callback_update(next(self._update_ids), user_id, data)))
+        message_time = await self.send(make_message_update(next(self._update_ids), user_id, text))
+        return message_time, button_times
+
+    def _failures(self):
+        import metrics
+        return metrics.ERRORS.total() + metrics.JOBS_REJECTED.total()
+
+    async def run_cell(self, scenario, size, concurrency, requests, seed):
+        """Прогон одного сочетания параметров, возвращает строку результатов"""
+        # Разные тексты, чтобы замерять путь без кэшей
+        texts = [make_text(size, f'{seed}:{scenario}:{size}:{concurrency}:{i}') for i in range(requests)]
+        semaphore = asyncio.Semaphore(concurrency)
+        message_times = []
+        button_times = []
+
+        async def run_one(text):
+            async with semaphore:
+                message_time, buttons = await self.user_session(scenario, text)
+            message_times.append(message_time)
+            button_times.extend(buttons)
+
+        failures = self._failures()
+        started = time.perf_counter()
+        await asyncio.gather(*(run_one(text) for text in texts))
+        elapsed = time.perf_counter() - started
+
+        message_times.sort()
+        button_times.sort()
+        return {
+            'scenario': scenario,
+            'size': size,
+            'concurrency': concurrency,
+            'requests': requests,
+            'p50_ms': round(percentile(message_times, 50) * 1000, 2),
+            'p95_ms': round(percentile(message_times, 95) * 1000, 2),
+            'p99_ms': round(percentile(message_times, 99) * 1000, 2),
+            'mean_ms': round(sum(message_times) / len(message_times) * 1000, 2),
+            'button_p95_ms': round(percentile(button_times, 95) * 1000, 2),
+            'messages_per_sec': round(requests / elapsed, 2) if elapsed else 0.0,
+            'errors': self._failures() - failures,
+        }
+
+
+async def run_benchmark(scenarios, sizes, concurrency_levels, requests, render_workers,
+                        api_latency, seed):
+    rows = []
+    async with Bench(render_workers, api_latency) as bench:
+        for scenario in scenarios:
+            for size in sizes:
+                if scenario != 'tts' and size > VIZ_MAX_CHARS:
+                    continue
+                for concurrency in concurrency_levels:
+                    row = await bench.run_cell(scenario, size, concurrency, requests, seed)
+                    rows.append(row)
+                    print_rows([row], header=not rows[:-1])
+        api_calls = dict(bench.request.calls)
+        tts_backends = bench.bot.tts.stats()
+    return rows, api_calls, tts_backends
+
+
+# Предел числа строк истории остальных (незамеряемых) учеников в одной ячейке замера карточек
+FLASHCARD_MAX_ROWS = 2_000_000
+
+
+async def run_flashcards_cell(deck_size, users, samples, reviews, seed, db_path):
+    """Замер карточек: колода deck_size карточек, users учеников.
+
+    Замеряемые ученики видели половину колоды; у остальных история
+    короче, если иначе строк будет больше FLASHCARD_MAX_ROWS.
+    """
+    from flashcards import DAY, DeckStore, FlashcardEngine
+
+    rng = random.Random(f'{seed}:{deck_size}:{users}')
+    store = DeckStore(db_path)
+    name = f'bench{deck_size}'
+    started = time.perf_counter()
+    store.import_deck(name, name, [(f'вопрос {i}', f'ответ {i}') for i in range(deck_size)])
+    import_ms = (time.perf_counter() - started) * 1000
+
+    # История: часть карточек уже пора повторить
+    now = time.time()
+    seen = deck_size // 2
+    sampled = rng.sample(range(users), min(samples, users))
+    measured = set(sampled)
+    background_seen = min(seen, FLASHCARD_MAX_ROWS // users)
+    history_rows = 0
+    with store.connection as connection:
+        connection.execute('DELETE FROM reviews')
+        for user_id in range(users):
+            user_seen = seen if user_id in measured else background_seen
+            connection.executemany(
+                'INSERT INTO reviews (user_id, deck, card, due, interval, ease, reps, lapses, added) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                ((user_id, name, card, now + rng.uniform(-DAY, 30 * DAY), DAY, 2.5, 2, 0, 0)
+                 for card in range(user_seen))
+            )
+            history_rows += user_seen
+
+    engine = FlashcardEngine(store, new_per_day=deck_size)
+    cold, next_times, answer_times = [], [], []
+    started = time.perf_counter()
+    for user_id in sampled:
+        began = time.perf_counter()
+        await engine.session(user_id, name)
+        cold.append(time.perf_counter() - began)
+        for _ in range(reviews):
+            began = time.perf_counter()
+            session, card = await engine.next_card(user_id, name)
+            next_times.append(time.perf_counter() - began)
+            if card is None:
+                break
+            began = time.perf_counter()
+            await engine.answer(user_id, name, card, rng.randrange(4))
+            answer_times.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - started
+    engine.close()
+
+    for values in (cold, next_times, answer_times):
+        values.sort()
+    return {
+        'scenario': 'flashcards',
+        'size': deck_size,
+        'concurrency': users,
+        'requests': len(next_times),
+        'p50_ms': round(percentile(next_times, 50) * 1000, 4),
+        'p95_ms': round(percentile(next_times, 95) * 1000, 4),
+        'p99_ms': round(percentile(next_times, 99) * 1000, 4),
+        'mean_ms': round(sum(next_times) / len(next_times) * 1000, 4) if next_times else 0.0,
+        'answer_p95_ms': round(percentile(answer_times, 95) * 1000, 3),
+        'cold_p95_ms': round(percentile(cold, 95) * 1000, 3),
+        'import_ms': round(import_ms, 1),
+        'history_rows': history_rows,
+        'background_seen': background_seen,
+        'messages_per_sec': round((len(next_times) + len(answer_times)) / elapsed, 1) if elapsed else 0.0,
+        'errors': 0,
+    }
+
+
+async def run_flashcards(deck_sizes, user_counts, samples, reviews, seed, tmp_dir):
+    rows = []
+    for deck_size in deck_sizes:
+        for users in user_counts:
+            db_path = os.path.join(tmp_dir, f'flashcards_{deck_size}_{users}.sqlite3')
+            row = await run_flashcards_cell(deck_size, users, samples, reviews, seed, db_path)
+            rows.append(row)
+            print_rows([row], header=len(rows) == 1)
+    return rows
+
+
+def print_rows(rows, header=True):
+    columns = ['scenario', 'size', 'concurrency', 'p50_ms', 'p95_ms', 'p99_ms', 'messages_per_sec', 'errors']
+    if header:
+        print(' '.join(f'{c:>16}' for c in columns))
+    for row in rows:
+        print(' '.join(f'{row[c]:>16}' for c in columns))
+
+
+def compare(base_path, new_path):
+    """Сравнение двух файлов результатов по p95 и пропускной способности"""
+    with open(base_path, encoding='utf-8') as f:
+        base = {(r['scenario'], r['size'], r['concurrency']): r for r in json.load(f)['results']}
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)['results']
+
+    print(f"{'scenario':>10} {'size':>6} {'conc':>5} {'p95 было':>10} {'p95 стало':>10} "
+          f"{'p95':>8} {'msg/s было':>11} {'msg/s стало':>12} {'msg/s':>8}")
+    for row in new:
+        old = base.get((row['scenario'], row['size'], row['concurrency']))
+        if old is None:
+            continue
+        p95_change = (row['p95_ms'] / old['p95_ms'] - 1) * 100 if old['p95_ms'] else 0.0
+        rate_change = (row['messages_per_sec'] / old['messages_per_sec'] - 1) * 100 if old['messages_per_sec'] else 0.0
+        print(f"{row['scenario']:>10} {row['size']:>6} {row['concurrency']:>5} {old['p95_ms']:>10} "
+              f"{row['p95_ms']:>10} {p95_change:>+7.1f}% {old['messages_per_sec']:>11} "
+              f"{row['messages_per_sec']:>12} {rate_change:>+7.1f}%")
+
+
+def write_results(path, meta, rows, elapsed):
+    with open(path, 'w', encoding='utf-8') as out:
+        json.dump({'meta': meta, 'results': rows}, out, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены: {path} ({elapsed:.1f} с)")
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры производительности бота без сети")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help="сценарии через запятую (freq,stats,pie,structure,cloud,full,tts)")
+    parser.add_argument('--sizes', type=_int_list, default=[200, 1000, 2000],
+                        help="размеры текста в символах через запятую")
+    parser.add_argument('--concurrency', type=_int_list, default=[1, 8, 32],
+                        help="уровни параллельности через запятую")
+    parser.add_argument('--requests', type=int, default=40, help="сообщений на каждое сочетание")
+    parser.add_argument('--render-workers', type=int, default=None,
+                        help="процессов рендеринга (по умолчанию RENDER_WORKERS)")
+    parser.add_argument('--tts-ms', type=float, default=60.0,
+                        help="задержка заглушки gTTS на каждые 100 символов, мс")
+    parser.add_argument('--tts-slow-percent', type=float, default=0.0,
+                        help="доля медленных вызовов заглушки gTTS, %%")
+    parser.add_argument('--tts-slow-factor', type=float, default=10.0,
+                        help="во сколько раз медленные вызовы дольше обычных")
+    parser.add_argument('--api-ms', type=float, default=0.0,
+                        help="задержка заглушки Bot API на вызов, мс")
+    parser.add_argument('--state', choices=['memory', 'sqlite'], default='memory',
+                        help="хранилище состояния пользователей")
+    parser.add_argument('--seed', default='bench')
+    parser.add_argument('-o', '--output', default='bench_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help="сравнить два файла результатов и выйти")
+    parser.add_argument('--flashcards', action='store_true',
+                        help="замер движка карточек вместо обработчиков бота")
+    parser.add_argument('--deck-sizes', type=_int_list, default=[100, 1000, 10000],
+                        help="размеры колод для --flashcards")
+    parser.add_argument('--users', type=_int_list, default=[10, 100, 1000],
+                        help="числа учеников для --flashcards")
+    parser.add_argument('--reviews', type=int, default=50,
+                        help="ответов на каждого замеряемого ученика для --flashcards")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    if args.flashcards:
+        logging.getLogger().setLevel(logging.WARNING)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            started = time.perf_counter()
+            rows = asyncio.run(run_flashcards(
+                args.deck_sizes, args.users, args.requests, args.reviews, args.seed, tmp_dir
+            ))
+            elapsed = time.perf_counter() - started
+        write_results(args.output, {
+            'mode': 'flashcards',
+            'revision': _git_revision(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'samples': args.requests,
+            'reviews': args.reviews,
+            'duration_sec': round(elapsed, 1),
+        }, rows, elapsed)
+        return 0
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(unknown)}")
+
+    import config
+    import tts
+
+    # Логи обработчиков не должны влиять на замеры
+    logging.getLogger().setLevel(logging.WARNING)
+    tts.synthesize = make_stub_synthesize(
+        args.tts_ms, args.tts_slow_percent, args.tts_slow_factor, args.seed
+    )
+    # Байты заглушки - не MP3, перекодировать их в Opus нечего
+    config.TTS_VOICE_FORMAT = 'mp3'
+    render_workers = args.render_workers or config.RENDER_WORKERS
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config.STATE_BACKEND = args.state
+        config.STATE_DB_PATH = os.path.join(tmp_dir, 'state.sqlite3')
+        config.FLASHCARDS_DB_PATH = os.path.join(tmp_dir, 'flashcards.sqlite3')
+        config.TTS_CACHE_DIR = ''
+
+        started = time.perf_counter()
+        rows, api_calls, tts_backends = asyncio.run(run_benchmark(
+            scenarios, args.sizes, args.concurrency, args.requests, render_workers,
+            args.api_ms / 1000, args.seed
+        ))
+        elapsed = time.perf_counter() - started
+
+    write_results(args.output, {
+        'revision': _git_revision(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'render_workers': render_workers,
+        'tts_ms_per_100_chars': args.tts_ms,
+        'tts_slow_percent': args.tts_slow_percent,
+        'tts_slow_factor': args.tts_slow_factor,
+        'api_ms': args.api_ms,
+        'state': args.state,
+        'requests': args.requests,
+        'duration_sec': round(elapsed, 1),
+        'api_calls': api_calls,
+        'tts_backends': tts_backends,
+    }, rows, elapsed)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,35 @@
+import time
+_STARTED = time.perf_counter()
+
 import os
 import logging
 import tempfile
 import asyncio
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from contextlib import ExitStack
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, InputMediaPhoto
+from telegram.constants import MessageLimit
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
-from gtts import gTTS
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')
-from io import BytesIO
+from telegram.error import BadRequest, TelegramError
 import textwrap
-from collections import Counter
-import numpy as np
-import re
+
+import config
+import flashcards
+import metrics
+import tts_backends
+from audio_cache import AudioCache, audio_cache_key
+from file_ids import FileIdRegistry, content_key
+from jobs import JobScheduler, QueueFull
+from rendering import ChartRenderer
+from reports import (
+    FULL_REPORT, REPORTS, build_report, cloud_report, frequency_report, pie_report,
+    statistics_report, structure_report
+)
+from singleflight import SingleFlight
+from startup import StartupReport
+from state_store import create_persistence
+from tts import TranscodeError, find_ffmpeg, split_into_chunks, to_opus
+from tts_backends import Speech, TTSUnavailable, join_speech
+from update_processor import ChatOrderedUpdateProcessor
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -20,9 +37,67 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+_IMPORTED = time.perf_counter()
+
 class EducationalBot:
-    def __init__(self, token):
+    def __init__(self, token, render_workers=config.RENDER_WORKERS, prewarm=config.PREWARM):
         self.token = token
+        self.prewarm = prewarm
+        self._prewarm_task = None
+        self.startup = StartupReport(_STARTED)
+        self.startup.add('импорт модулей', _IMPORTED - _STARTED)
+        self.renderer = ChartRenderer(render_workers)
+        self.audio_cache = AudioCache(
+            memory_bytes=config.TTS_CACHE_MEMORY_MB * 1024 * 1024,
+            disk_dir=config.TTS_CACHE_DIR,
+            disk_bytes=config.TTS_CACHE_DISK_MB * 1024 * 1024
+        )
+        self.file_ids = FileIdRegistry(
+            max_entries=config.FILE_ID_CACHE_SIZE,
+            ttl=config.FILE_ID_TTL_HOURS * 3600
+        )
+        # Очереди тяжелых задач: синтез речи и построение графиков
+        self.tts_jobs = JobScheduler(
+            'tts', config.TTS_MAX_JOBS, config.JOB_QUEUE_SIZE, user_jobs=config.USER_MAX_JOBS
+        )
+        self.render_jobs = JobScheduler(
+            'render', config.RENDER_MAX_JOBS, config.JOB_QUEUE_SIZE, user_jobs=config.USER_MAX_JOBS
+        )
+        # Голосовые сообщения в OGG/Opus, если есть ffmpeg, иначе в MP3
+        self.ffmpeg = None
+        if config.TTS_VOICE_FORMAT == 'opus':
+            self.ffmpeg = find_ffmpeg(config.FFMPEG_PATH)
+            if self.ffmpeg is None:
+                logger.warning(f"ffmpeg не найден ({config.FFMPEG_PATH}), голосовые сообщения отправляются в MP3")
+        # Движки синтеза речи: gTTS и локальный резервный
+        self.tts = tts_backends.create_tts()
+        # Одинаковые синтезы и графики, запрошенные одновременно, выполняются один раз
+        self.tts_flight = SingleFlight('tts')
+        self.render_flight = SingleFlight('chart')
+        self.flashcards = flashcards.create_engine()
+        self._metrics_server = None
+        metrics.CallbackGauge(
+            'bot_jobs_running', 'Выполняемые задачи по очередям', ['queue'],
+            lambda: {('tts',): self.tts_jobs.running, ('render',): self.render_jobs.running}
+        )
+        metrics.CallbackGauge(
+            'bot_jobs_waiting', 'Задачи в очереди', ['queue'],
+            lambda: {('tts',): self.tts_jobs.waiting, ('render',): self.render_jobs.waiting}
+        )
+        metrics.CallbackGauge(
+            'bot_tts_latency_per_100_chars_seconds',
+            'Перцентили времени синтеза 100 символов по движкам', ['backend', 'quantile'],
+            lambda: {
+                (name, quantile): stats[key]
+                for name, stats in self.tts.stats().items()
+                for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99'))
+                if stats[key] is not None
+            }
+        )
+        metrics.CallbackGauge(
+            'bot_tts_breaker_open', 'Выключатель движка синтеза речи разомкнут', ['backend'],
+            lambda: {(name,): int(stats['breaker'] != 'closed') for name, stats in self.tts.stats().items()}
+        )
         self.supported_languages = {
             'ru': 'Русский',
             'en': 'Английский', 
@@ -60,28 +135,44 @@ class EducationalBot:
     async def handle_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка нажатий кнопок"""
         query = update.callback_query
-        await query.answer()
-        
-        if query.data == "tts":
-            await self.show_tts_menu(query, context)
+        # Время обработки по типу кнопки (tts, lang, viz, ...)
+        with metrics.CALLBACK_LATENCY.time(self.callback_action(query.data)):
+            await query.answer()
+            
+            if query.data == "tts":
+                await self.show_tts_menu(query, context)
             
-        elif query.data.startswith("lang_"):
-            await self.handle_language_selection(query, context)
+            elif query.data.startswith("lang_"):
+                await self.handle_language_selection(query, context)
             
-        elif query.data == "visualize":
-            await self.show_visualization_menu(query, context)
+            elif query.data == "visualize":
+                await self.show_visualization_menu(query, context)
             
-        elif query.data.startswith("viz_"):
-            await self.handle_visualization_selection(query, context)
+            elif query.data.startswith("viz_"):
+                await self.handle_visualization_selection(query, context)
             
-        elif query.data == "interactive":
-            await self.show_interactive_menu(query, context)
+            elif query.data == "interactive":
+                await self.show_interactive_menu(query, context)
             
-        elif query.data == "help":
-            await self.show_help(query, context)
+            elif query.data == "flashcards":
+                await self.show_flashcard_decks(query, context)
             
-        elif query.data == "back":
-            await self.show_main_menu(query, context)
+            elif query.data.startswith("fc_"):
+                await self.handle_flashcard_button(query, context)
+            
+            elif query.data == "help":
+                await self.show_help(query, context)
+            
+            elif query.data == "back":
+                await self.show_main_menu(query, context)
+
+    @staticmethod
+    def callback_action(data):
+        """Тип кнопки для метрик (число значений метки ограничено)"""
+        action = (data or '').split('_')[0]
+        if action in ('tts', 'lang', 'visualize', 'viz', 'interactive', 'help', 'back', 'flashcards', 'fc'):
+            return action
+        return 'other'
 
     async def show_tts_menu(self, query, context):
         """Меню текста в речь"""
@@ -111,7 +202,8 @@ class EducationalBot:
         
         await query.edit_message_text(
             f"🎧 Выбран язык: {self.supported_languages[lang]}\n\n"
-            f"Отправьте текст для преобразования в речь (максимум 1000 символов):"
+            f"Отправьте текст для преобразования в речь (максимум {config.TTS_LONG_MAX_CHARS} символов, "
+            f"длинные тексты озвучиваются по частям):"
         )
 
     async def show_visualization_menu(self, query, context):
@@ -122,10 +214,12 @@ class EducationalBot:
         context.user_data['mode'] = 'viz_choosing_type'
         
         keyboard = [
+            [InlineKeyboardButton("🗂 Полный отчет", callback_data="viz_full")],
             [InlineKeyboardButton("📈 Частотный анализ", callback_data="viz_freq")],
             [InlineKeyboardButton("📊 Статистика текста", callback_data="viz_stats")],
             [InlineKeyboardButton("🎯 Круговая диаграмма", callback_data="viz_pie")],
             [InlineKeyboardButton("📋 Структура текста", callback_data="viz_structure")],
+            [InlineKeyboardButton("☁️ Облако слов", callback_data="viz_cloud")],
             [InlineKeyboardButton("🔙 Назад", callback_data="back")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -135,10 +229,12 @@ class EducationalBot:
 
 Выберите тип инфографики:
 
+🗂 **Полный отчет** - четыре графика ниже одним сообщением
 📈 **Частотный анализ** - топ слов в тексте
 📊 **Статистика текста** - основные метрики
 🎯 **Круговая диаграмма** - распределение частей речи
 📋 **Структура текста** - визуальное представление
+☁️ **Облако слов** - самые частые слова крупнее
 
 Выберите вариант ниже 👇
         """
@@ -151,10 +247,13 @@ class EducationalBot:
         context.user_data['mode'] = 'viz_waiting_text'
         
         prompts = {
+            'full': "🗂 **Полный отчет**\n\nОтправьте текст: пришлю частотный анализ, статистику, "
+                    "части речи и структуру одним сообщением:",
             'freq': "📈 **Частотный анализ слов**\n\nОтправьте текст для анализа частоты слов:",
             'stats': "📊 **Статистика текста**\n\nОтправьте текст для анализа статистики:",
             'pie': "🎯 **Круговая диаграмма**\n\nОтправьте текст для анализа распределения слов:",
-            'structure': "📋 **Структура текста**\n\nОтправьте текст для визуализации структуры:"
+            'structure': "📋 **Структура текста**\n\nОтправьте текст для визуализации структуры:",
+            'cloud': "☁️ **Облако слов**\n\nОтправьте текст для построения облака слов:"
         }
         
         await query.edit_message_text(prompts.get(viz_type, "Отправьте текст для анализа:"))
@@ -170,7 +269,10 @@ class EducationalBot:
         # Определяем режим работы на основе состояния
         current_mode = context.user_data.get('mode')
         
-        logger.info(f"Current mode: {current_mode}, User data: {context.user_data}")
+        metrics.sample_log(
+            'text_message', config.LOG_SAMPLE_RATE,
+            user=update.effective_user.id, mode=current_mode, chars=len(text)
+        )
         
         if current_mode == 'tts_waiting_text':
             await self.text_to_speech(update, context, text)
@@ -182,29 +284,43 @@ class EducationalBot:
 
     async def text_to_speech(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
         """Преобразование текста в речь"""
-        if len(text) > 1000:
-            await update.message.reply_text("❌ Текст слишком длинный. Максимум 1000 символов.")
+        if len(text) > config.TTS_LONG_MAX_CHARS:
+            await update.message.reply_text(
+                f"❌ Текст слишком длинный. Максимум {config.TTS_LONG_MAX_CHARS} символов."
+            )
             return
             
         user_lang = context.user_data.get('tts_lang', 'ru')
         
         try:
             # Показываем статус обработки
-            status_msg = await update.message.reply_text("🔊 Синтезирую речь...")
+            status_text = "🔊 Синтезирую речь..."
+            status_msg = await update.message.reply_text(status_text)
             
-            # Создаем аудио файл
-            with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
-                tts = gTTS(text=text, lang=user_lang, slow=False)
-                tts.save(temp_file.name)
-                
-                # Отправляем аудио
-                await update.message.reply_voice(
-                    voice=open(temp_file.name, 'rb'),
-                    caption=f"🎧 Озвучка текста ({self.supported_languages[user_lang]})"
+            # Отправляем аудио
+            caption = f"🎧 Озвучка текста ({self.supported_languages[user_lang]})"
+            
+            async def speak():
+                if len(text) > config.TTS_MAX_CHARS:
+                    await self.send_long_voice(update, text, user_lang, caption)
+                else:
+                    await self.send_voice(
+                        update,
+                        audio_cache_key(text, user_lang),
+                        lambda: self.synthesize_cached(text, user_lang),
+                        caption=caption
+                    )
+            
+            # Такой же текст уже синтезируется - ждем его без места в очереди
+            keys = [self.tts_flight_key(text, user_lang)] if len(text) <= config.TTS_MAX_CHARS else []
+            try:
+                await self.run_job(
+                    self.tts_jobs, self.tts_flight, keys,
+                    update.effective_user.id, speak, self.queue_status(status_msg, status_text)
                 )
-                
-                # Удаляем временный файл
-                os.unlink(temp_file.name)
+            except QueueFull as e:
+                await status_msg.edit_text(self.queue_full_text(e))
+                return
                 
             await status_msg.delete()
             
@@ -221,32 +337,339 @@ class EducationalBot:
                 reply_markup=reply_markup
             )
             
+        except TTSUnavailable as e:
+            metrics.ERRORS.inc('tts')
+            logger.error(f"TTS недоступен: {e}")
+            await update.message.reply_text(
+                "❌ Сервис озвучки сейчас недоступен. Попробуйте через пару минут."
+            )
+        except TelegramError as e:
+            # Речь синтезирована, но Telegram не принял сообщение
+            logger.error(f"Не удалось отправить голосовое сообщение: {e}")
+            await update.message.reply_text("❌ Не удалось отправить голосовое сообщение. Попробуйте еще раз.")
         except Exception as e:
+            metrics.ERRORS.inc('tts')
             logger.error(f"TTS error: {e}")
             await update.message.reply_text("❌ Ошибка при преобразовании текста в речь.")
 
+    @staticmethod
+    async def run_job(scheduler, flight, keys, user_id, job, on_position):
+        """Выполнение job() через очередь задач.
+
+        keys - ключи single-flight результатов, которые вычисляет job().
+        Если все они уже вычисляются (или ждут очереди) для других
+        запросов, задача не занимает место в очереди: она только дождется
+        общих результатов и отправит их. Остальные ключи занимаются до
+        постановки в очередь, чтобы повторные запросы ждали их так же.
+        """
+        with ExitStack() as stack:
+            held = [stack.enter_context(flight.hold(key)) for key in keys]
+            if keys and all(held):
+                return await job()
+            for key, in_flight in zip(keys, held):
+                if not in_flight:
+                    stack.enter_context(flight.claim(key))
+            return await scheduler.submit(user_id, job, on_position)
+
+    @staticmethod
+    def tts_flight_key(text, lang):
+        return ('tts', lang, audio_cache_key(text, lang))
+
+    @staticmethod
+    def chart_flight_key(viz_type, source):
+        return ('chart', viz_type, content_key('chart', viz_type, source))
+
+    @staticmethod
+    def queue_status(status_msg, status_text):
+        """Показ позиции в очереди в сообщении о статусе"""
+        async def show(position):
+            if position:
+                await status_msg.edit_text(f"⏳ Ваш запрос в очереди: {position}-й. Пожалуйста, подождите...")
+            else:
+                await status_msg.edit_text(status_text)
+        return show
+
+    @staticmethod
+    def queue_full_text(error: QueueFull):
+        if error.user_limit:
+            return "⏳ Дождитесь результата предыдущего запроса, затем отправьте следующий."
+        return "⏳ Сейчас слишком много запросов. Попробуйте через минуту."
+
+    async def synthesize_cached(self, text: str, lang: str):
+        """Синтез речи с кэшированием по содержимому, возвращает Speech"""
+        # Одинаковые тексты не синтезируем повторно
+        cache_key = audio_cache_key(text, lang)
+        audio = await asyncio.to_thread(self.audio_cache.get, cache_key)
+        if audio is not None:
+            metrics.CACHE_REQUESTS.inc('audio', 'hit')
+            return Speech(audio, 'cache', False)
+        metrics.CACHE_REQUESTS.inc('audio', 'miss')
+        
+        async def synthesize_and_cache():
+            with metrics.stage('tts_synthesis'):
+                speech = await self.tts.synthesize(text, lang)
+            # Резервный голос не кэшируем: при следующем запросе попробуем основной
+            if not speech.fallback:
+                await asyncio.to_thread(self.audio_cache.put, cache_key, speech.audio)
+            return speech
+        
+        return await self.tts_flight.do(self.tts_flight_key(text, lang), synthesize_and_cache)
+
+    async def send_long_voice(self, update: Update, text: str, lang: str, caption: str):
+        """Озвучка длинного текста по частям.
+
+        Части синтезируются параллельно (не более TTS_CHUNK_WORKERS сразу).
+        Первая часть отправляется, как только готова, остальные
+        склеиваются по порядку и отправляются вторым сообщением.
+        Сообщения, которые уже загружались (есть file_id), не синтезируются.
+        """
+        chunks = split_into_chunks(
+            text, config.TTS_CHUNK_CHARS, first_chunk_chars=config.TTS_CHUNK_CHARS // 2
+        )
+        if len(chunks) == 1:
+            return await self.send_voice(
+                update, audio_cache_key(text, lang),
+                lambda: self.synthesize_cached(text, lang), caption=caption
+            )
+        
+        semaphore = asyncio.Semaphore(config.TTS_CHUNK_WORKERS)
+        rest_key = audio_cache_key(' '.join(chunks[1:]), lang)
+        # Задачи синтеза создаются только для частей, которых нет в реестре file_id
+        tasks = {}
+        
+        async def synthesize_chunk(chunk):
+            async with semaphore:
+                return await self.synthesize_cached(chunk, lang)
+        
+        def start(indexes):
+            for index in indexes:
+                if index not in tasks:
+                    tasks[index] = asyncio.create_task(synthesize_chunk(chunks[index]))
+            return [tasks[index] for index in indexes]
+        
+        def produce_first():
+            first = start([0])[0]
+            # Остальные части синтезируются, пока отправляется первая,
+            # если вторую часть не придется загружать заново
+            if content_key('voice', rest_key) not in self.file_ids:
+                start(range(1, len(chunks)))
+            return first
+        
+        async def stitch_rest():
+            return join_speech(await asyncio.gather(*start(range(1, len(chunks)))))
+        
+        try:
+            await self.send_voice(
+                update, audio_cache_key(chunks[0], lang), produce_first,
+                caption=f"{caption}, часть 1 из 2"
+            )
+            await self.send_voice(
+                update, rest_key, stitch_rest,
+                caption=f"{caption}, часть 2 из 2"
+            )
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    async def send_voice(self, update: Update, key: str, produce, caption: str):
+        """Отправка голосового сообщения, по file_id если файл уже загружался"""
+        registry_key = content_key('voice', key)
+        file_id = self.file_ids.get(registry_key)
+        if file_id is not None:
+            metrics.CACHE_REQUESTS.inc('file_id', 'hit')
+            try:
+                with metrics.stage('send_file_id'):
+                    return await update.message.reply_voice(voice=file_id, caption=caption)
+            except BadRequest as e:
+                logger.warning(f"file_id отклонен, загружаю заново: {e}")
+                self.file_ids.discard(registry_key)
+        else:
+            metrics.CACHE_REQUESTS.inc('file_id', 'miss')
+        
+        speech = await produce()
+        voice = await self.encode_voice(speech.audio)
+        if speech.fallback:
+            caption = f"{caption}\n⚙️ Резервный голос: основной сервис озвучки недоступен"
+        with metrics.stage('upload_voice'):
+            message = await update.message.reply_voice(voice=voice, caption=caption)
+        if message.voice and not speech.fallback:
+            self.file_ids.put(registry_key, message.voice.file_id)
+        return message
+
+    async def encode_voice(self, audio: bytes):
+        """Файл голосового сообщения из MP3 в памяти: OGG/Opus или, если перекодировать нечем, MP3"""
+        if self.ffmpeg is not None:
+            try:
+                with metrics.stage('opus_encode'):
+                    opus = await asyncio.to_thread(
+                        to_opus, audio, self.ffmpeg, config.TTS_OPUS_BITRATE_KBPS
+                    )
+                return InputFile(opus, filename='voice.ogg')
+            except TranscodeError as e:
+                logger.warning(f"Не удалось перекодировать в Opus, отправляю MP3: {e}")
+        return InputFile(audio, filename='voice.mp3')
+
+    async def send_chart(self, update: Update, viz_type: str, source: str, data: dict, caption: str):
+        """Отправка графика, по file_id если такой график уже загружался"""
+        registry_key = content_key('chart', viz_type, source)
+        file_id = self.file_ids.get(registry_key)
+        if file_id is not None:
+            metrics.CACHE_REQUESTS.inc('file_id', 'hit')
+            try:
+                with metrics.stage('send_file_id'):
+                    return await update.message.reply_photo(
+                        photo=file_id, caption=caption, parse_mode='Markdown'
+                    )
+            except BadRequest as e:
+                logger.warning(f"file_id отклонен, загружаю заново: {e}")
+                self.file_ids.discard(registry_key)
+        else:
+            metrics.CACHE_REQUESTS.inc('file_id', 'miss')
+        
+        png = await self.render_chart(viz_type, source, data)
+        with metrics.stage('upload_photo'):
+            message = await update.message.reply_photo(
+                photo=png, caption=caption, parse_mode='Markdown'
+            )
+        if message.photo:
+            self.file_ids.put(registry_key, message.photo[-1].file_id)
+        return message
+
+    async def render_chart(self, viz_type: str, source: str, data: dict):
+        """Построение графика в пуле процессов; одинаковые графики строятся один раз"""
+        return await self.render_flight.do(
+            self.chart_flight_key(viz_type, source), lambda: self.renderer.render(viz_type, data)
+        )
+
+    async def send_chart_album(self, update: Update, source: str, reports: list):
+        """Отправка нескольких графиков одним альбомом (один вызов sendMediaGroup).
+
+        reports - список пар (тип графика, Report). Графики строятся
+        параллельно; уже загруженные отправляются по file_id.
+        """
+        keys = [content_key('chart', viz_type, source) for viz_type, _ in reports]
+        caption = '\n\n'.join(report.caption for _, report in reports)
+        # Общая подпись не помещается: подпись каждого графика - под ним
+        separate = len(caption) > MessageLimit.CAPTION_LENGTH
+        
+        async def media(use_file_ids):
+            async def item(key, viz_type, report):
+                file_id = self.file_ids.get(key) if use_file_ids else None
+                metrics.CACHE_REQUESTS.inc('file_id', 'miss' if file_id is None else 'hit')
+                photo = file_id or await self.render_chart(viz_type, source, report.data)
+                if separate:
+                    return InputMediaPhoto(photo, caption=report.caption, parse_mode='Markdown')
+                return InputMediaPhoto(photo)
+            return await asyncio.gather(*(
+                item(key, viz_type, report) for key, (viz_type, report) in zip(keys, reports)
+            ))
+        
+        async def send(items):
+            with metrics.stage('upload_album'):
+                return await update.message.reply_media_group(
+                    media=items, caption=None if separate else caption, parse_mode='Markdown'
+                )
+        
+        items = await media(use_file_ids=True)
+        try:
+            messages = await send(items)
+        except BadRequest as e:
+            if all(isinstance(item.media, InputFile) for item in items):
+                raise
+            logger.warning(f"file_id в альбоме отклонен, загружаю заново: {e}")
+            for key in keys:
+                self.file_ids.discard(key)
+            messages = await send(await media(use_file_ids=False))
+        for key, message in zip(keys, messages):
+            if message.photo:
+                self.file_ids.put(key, message.photo[-1].file_id)
+        return messages
+
     async def handle_visualization(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
         """Обработка визуализации текста"""
         if len(text) > 2000:
-            await update.message.reply_text("❌ Текст слишком длинный для анализа. Максимум 2000 символов.")
+            await update.message.reply_text(
+                "❌ Текст слишком длинный для анализа. Максимум 2000 символов.\n"
+                "Большой текст можно отправить файлом .txt"
+            )
             return
             
         viz_type = context.user_data.get('viz_type', 'stats')
         
+        async def get_analysis():
+            from text_analysis import analyze
+            return analyze(text)
+        
+        await self.visualize(update, viz_type, get_analysis, text)
+
+    async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработка текстовых документов (.txt) для визуализации"""
+        if context.user_data.get('mode') != 'viz_waiting_text':
+            await update.message.reply_text(
+                "📄 Чтобы проанализировать документ, откройте «📊 Визуализация текста», "
+                "выберите тип инфографики и отправьте файл .txt"
+            )
+            return
+        
+        document = update.message.document
+        if document.file_size and document.file_size > config.DOCUMENT_MAX_MB * 1024 * 1024:
+            await update.message.reply_text(
+                f"❌ Файл слишком большой. Максимум {config.DOCUMENT_MAX_MB} МБ."
+            )
+            return
+        
+        viz_type = context.user_data.get('viz_type', 'stats')
+        
+        async def get_analysis():
+            from text_analysis import analyze_file
+            telegram_file = await document.get_file()
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = await telegram_file.download_to_drive(os.path.join(tmp_dir, 'document.txt'))
+                # Файл читается и анализируется частями вне цикла событий
+                return await asyncio.to_thread(analyze_file, path)
+        
+        await self.visualize(update, viz_type, get_analysis, f"document:{document.file_unique_id}")
+
+    async def visualize(self, update: Update, viz_type: str, get_analysis, source: str):
+        """Построение инфографики выбранного типа.
+
+        source - строка, по которой узнается повторный запрос того же
+        графика (текст сообщения или идентификатор документа).
+        """
+        metrics.VIZ_REQUESTS.inc(viz_type if viz_type in REPORTS or viz_type == 'full' else 'other')
         try:
             # Показываем статус обработки
-            status_msg = await update.message.reply_text("📊 Создаю инфографику...")
+            status_text = "📊 Создаю инфографику..."
+            status_msg = await update.message.reply_text(status_text)
             
-            if viz_type == 'freq':
-                await self.create_frequency_analysis(update, text)
-            elif viz_type == 'stats':
-                await self.create_text_statistics(update, text)
-            elif viz_type == 'pie':
-                await self.create_pie_chart(update, text)
-            elif viz_type == 'structure':
-                await self.create_text_structure(update, text)
-            else:
-                await self.create_text_statistics(update, text)
+            async def render():
+                analysis = await get_analysis()
+                if viz_type == 'full':
+                    await self.create_full_report(update, analysis, source)
+                elif viz_type == 'freq':
+                    await self.create_frequency_analysis(update, analysis, source)
+                elif viz_type == 'stats':
+                    await self.create_text_statistics(update, analysis, source)
+                elif viz_type == 'pie':
+                    await self.create_pie_chart(update, analysis, source)
+                elif viz_type == 'structure':
+                    await self.create_text_structure(update, analysis, source)
+                elif viz_type == 'cloud':
+                    await self.create_word_cloud(update, analysis, source)
+                else:
+                    await self.create_text_statistics(update, analysis, source)
+            
+            # Такие же графики уже строятся - ждем их без места в очереди
+            chart_types = FULL_REPORT if viz_type == 'full' else [viz_type]
+            try:
+                await self.run_job(
+                    self.render_jobs, self.render_flight,
+                    [self.chart_flight_key(chart_type, source) for chart_type in chart_types],
+                    update.effective_user.id, render, self.queue_status(status_msg, status_text)
+                )
+            except QueueFull as e:
+                await status_msg.edit_text(self.queue_full_text(e))
+                return
                 
             await status_msg.delete()
             
@@ -264,239 +687,62 @@ class EducationalBot:
             )
             
         except Exception as e:
+            metrics.ERRORS.inc('visualization')
             logger.error(f"Visualization error: {e}")
             await update.message.reply_text(f"❌ Ошибка при создании визуализации: {str(e)}")
 
-    async def create_frequency_analysis(self, update: Update, text: str):
-        """Создание частотного анализа"""
-        words = re.findall(r'\b[а-яa-z]{3,}\b', text.lower())
-        word_freq = Counter(words)
+    async def create_full_report(self, update: Update, analysis, source: str):
+        """Полный отчет: текст анализируется один раз, графики строятся параллельно"""
+        reports = [(viz_type, build_report(viz_type, analysis)) for viz_type in FULL_REPORT]
+        reports = [(viz_type, report) for viz_type, report in reports if report is not None]
+        
+        # В альбоме должно быть не меньше двух файлов
+        if len(reports) == 1:
+            viz_type, report = reports[0]
+            await self.send_chart(update, viz_type, source, report.data, report.caption)
+            return
         
-        top_words = word_freq.most_common(10)
+        await self.send_chart_album(update, source, reports)
+
+    async def create_frequency_analysis(self, update: Update, analysis, source: str):
+        """Создание частотного анализа"""
+        report = frequency_report(analysis)
         
-        if not top_words:
+        if report is None:
             await update.message.reply_text("❌ Не удалось найти достаточно слов для анализа.")
             return
         
-        # Создаем график
-        fig, ax = plt.subplots(figsize=(12, 8))
-        
-        words_list = [word[0] for word in top_words]
-        counts = [word[1] for word in top_words]
-        
-        colors = plt.cm.viridis(np.linspace(0, 1, len(words_list)))
-        bars = ax.barh(words_list, counts, color=colors)
-        
-        ax.set_xlabel('Частота встречаемости', fontsize=12)
-        ax.set_title('Топ-10 самых частых слов в тексте', fontsize=14, pad=20)
-        ax.grid(axis='x', alpha=0.3)
-        
-        for bar, count in zip(bars, counts):
-            width = bar.get_width()
-            ax.text(width + 0.1, bar.get_y() + bar.get_height()/2, 
-                   f'{count}', ha='left', va='center', fontweight='bold')
-        
-        plt.tight_layout()
-        
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png', dpi=120, bbox_inches='tight')
-        plt.close()
-        buffer.seek(0)
-        
-        freq_text = "📊 **Топ-5 самых частых слов:**\n"
-        for i, (word, count) in enumerate(top_words[:5], 1):
-            freq_text += f"{i}. **{word}** - {count} раз\n"
-        freq_text += f"\nВсего уникальных слов: {len(word_freq)}"
-        
-        await update.message.reply_photo(
-            photo=buffer,
-            caption=freq_text,
-            parse_mode='Markdown'
-        )
+        await self.send_chart(update, 'freq', source, report.data, report.caption)
 
-    async def create_text_statistics(self, update: Update, text: str):
+    async def create_text_statistics(self, update: Update, analysis, source: str):
         """Создание статистики текста"""
-        words = text.split()
-        sentences = re.split(r'[.!?]+', text)
-        sentences = [s.strip() for s in sentences if s.strip()]
-        
-        chars_total = len(text)
-        chars_no_spaces = len(text.replace(' ', ''))
-        word_count = len(words)
-        sentence_count = len(sentences)
-        paragraph_count = text.count('\n\n') + 1
-        avg_word_len = sum(len(word) for word in words) / word_count if words else 0
-        avg_sentence_len = word_count / sentence_count if sentence_count else 0
-        
-        # Создаем инфографику
-        fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(15, 10))
-        
-        # Основная статистика
-        categories = ['Символы', 'Слова', 'Предложения', 'Абзацы']
-        values = [chars_total, word_count, sentence_count, paragraph_count]
-        colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4']
-        
-        bars1 = ax1.bar(categories, values, color=colors, alpha=0.8)
-        ax1.set_title('Основная статистика текста', fontsize=12, fontweight='bold')
-        ax1.grid(axis='y', alpha=0.3)
-        
-        for bar, value in zip(bars1, values):
-            ax1.text(bar.get_x() + bar.get_width()/2, bar.get_height() + max(values)*0.01,
-                   f'{value}', ha='center', va='bottom', fontweight='bold')
-        
-        # Распределение длины слов
-        word_lengths = [len(word) for word in words]
-        if word_lengths:
-            ax2.hist(word_lengths, bins=range(1, max(word_lengths) + 2), 
-                    color='#FFD166', alpha=0.7, edgecolor='black')
-            ax2.set_title('Распределение длины слов', fontsize=12, fontweight='bold')
-            ax2.set_xlabel('Длина слова')
-            ax2.set_ylabel('Количество')
-            ax2.grid(alpha=0.3)
-        
-        # Сравнение символов
-        char_categories = ['Всего символов', 'Без пробелов']
-        char_values = [chars_total, chars_no_spaces]
-        bars3 = ax3.bar(char_categories, char_values, color=['#EF476F', '#06D6A0'], alpha=0.8)
-        ax3.set_title('Анализ символов', fontsize=12, fontweight='bold')
-        ax3.grid(axis='y', alpha=0.3)
-        
-        for bar, value in zip(bars3, char_values):
-            ax3.text(bar.get_x() + bar.get_width()/2, bar.get_height() + max(char_values)*0.01,
-                   f'{value}', ha='center', va='bottom', fontweight='bold')
-        
-        # Средние значения
-        avg_categories = ['Ср. длина слова', 'Ср. слов в предложении']
-        avg_values = [round(avg_word_len, 1), round(avg_sentence_len, 1)]
-        bars4 = ax4.bar(avg_categories, avg_values, color=['#118AB2', '#073B4C'], alpha=0.8)
-        ax4.set_title('Средние значения', fontsize=12, fontweight='bold')
-        ax4.grid(axis='y', alpha=0.3)
-        
-        for bar, value in zip(bars4, avg_values):
-            ax4.text(bar.get_x() + bar.get_width()/2, bar.get_height() + max(avg_values)*0.1,
-                   f'{value}', ha='center', va='bottom', fontweight='bold')
-        
-        plt.tight_layout(pad=3.0)
-        
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png', dpi=120, bbox_inches='tight')
-        plt.close()
-        buffer.seek(0)
-        
-        stats_text = (
-            f"📈 **Детальная статистика текста:**\n\n"
-            f"• 📝 **Символы:** {chars_total} (без пробелов: {chars_no_spaces})\n"
-            f"• 🔤 **Слова:** {word_count}\n"
-            f"• 📖 **Предложения:** {sentence_count}\n"
-            f"• 📑 **Абзацы:** {paragraph_count}\n"
-            f"• 📏 **Средняя длина слова:** {avg_word_len:.1f} симв.\n"
-            f"• 💬 **Слов в предложении:** {avg_sentence_len:.1f}"
-        )
-        
-        await update.message.reply_photo(
-            photo=buffer,
-            caption=stats_text,
-            parse_mode='Markdown'
-        )
+        report = statistics_report(analysis)
+        await self.send_chart(update, 'stats', source, report.data, report.caption)
 
-    async def create_pie_chart(self, update: Update, text: str):
+    async def create_pie_chart(self, update: Update, analysis, source: str):
         """Создание круговой диаграммы"""
-        words = re.findall(r'\b[а-яa-z]+\b', text.lower())
-        
-        short_words = [w for w in words if len(w) <= 3]
-        medium_words = [w for w in words if 4 <= len(w) <= 6]
-        long_words = [w for w in words if len(w) >= 7]
+        report = pie_report(analysis)
         
-        categories = ['Короткие слова (1-3 симв)', 'Средние слова (4-6 симв)', 'Длинные слова (7+ симв)']
-        sizes = [len(short_words), len(medium_words), len(long_words)]
-        colors = ['#FF9999', '#66B2FF', '#99FF99']
-        
-        if sum(sizes) == 0:
+        if report is None:
             await update.message.reply_text("❌ Не удалось проанализировать слова в тексте.")
             return
         
-        fig, ax = plt.subplots(figsize=(10, 8))
-        wedges, texts, autotexts = ax.pie(
-            sizes, 
-            labels=categories, 
-            colors=colors,
-            autopct='%1.1f%%',
-            startangle=90
-        )
-        
-        for autotext in autotexts:
-            autotext.set_color('white')
-            autotext.set_fontweight('bold')
-        
-        ax.set_title('Распределение слов по длине', fontsize=14, fontweight='bold')
-        plt.tight_layout()
-        
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png', dpi=120, bbox_inches='tight')
-        plt.close()
-        buffer.seek(0)
-        
-        pie_text = (
-            f"🎯 **Распределение слов по длине:**\n\n"
-            f"• Короткие (1-3 симв): {len(short_words)} слов\n"
-            f"• Средние (4-6 симв): {len(medium_words)} слов\n"
-            f"• Длинные (7+ симв): {len(long_words)} слов\n"
-            f"• Всего слов: {len(words)}"
-        )
-        
-        await update.message.reply_photo(
-            photo=buffer,
-            caption=pie_text,
-            parse_mode='Markdown'
-        )
+        await self.send_chart(update, 'pie', source, report.data, report.caption)
 
-    async def create_text_structure(self, update: Update, text: str):
+    async def create_text_structure(self, update: Update, analysis, source: str):
         """Создание визуализации структуры текста"""
-        paragraphs = [p for p in text.split('\n\n') if p.strip()]
-        sentences = [s for s in re.split(r'[.!?]+', text) if s.strip()]
-        
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 6))
-        
-        if paragraphs:
-            para_lengths = [len(p.split()) for p in paragraphs]
-            ax1.bar(range(1, len(paragraphs) + 1), para_lengths, 
-                   color=plt.cm.Set3(np.linspace(0, 1, len(paragraphs))), 
-                   alpha=0.7)
-            ax1.set_title('Количество слов в абзацах', fontweight='bold')
-            ax1.set_xlabel('Номер абзаца')
-            ax1.set_ylabel('Количество слов')
-            ax1.grid(axis='y', alpha=0.3)
-        
-        if sentences:
-            sent_lengths = [len(s.split()) for s in sentences[:15]]
-            ax2.bar(range(1, len(sent_lengths) + 1), sent_lengths,
-                   color=plt.cm.Pastel1(np.linspace(0, 1, len(sent_lengths))),
-                   alpha=0.7)
-            ax2.set_title('Длина предложений (первые 15)', fontweight='bold')
-            ax2.set_xlabel('Номер предложения')
-            ax2.set_ylabel('Количество слов')
-            ax2.grid(axis='y', alpha=0.3)
-        
-        plt.tight_layout()
-        
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png', dpi=120, bbox_inches='tight')
-        plt.close()
-        buffer.seek(0)
-        
-        structure_text = (
-            f"📋 **Структура текста:**\n\n"
-            f"• Абзацы: {len(paragraphs)}\n"
-            f"• Предложения: {len(sentences)}\n"
-            f"• Средняя длина абзаца: {len(paragraphs) and sum(len(p.split()) for p in paragraphs) / len(paragraphs):.1f} слов\n"
-            f"• Средняя длина предложения: {len(sentences) and sum(len(s.split()) for s in sentences) / len(sentences):.1f} слов"
-        )
+        report = structure_report(analysis)
+        await self.send_chart(update, 'structure', source, report.data, report.caption)
+
+    async def create_word_cloud(self, update: Update, analysis, source: str):
+        """Создание облака слов"""
+        report = cloud_report(analysis)
         
-        await update.message.reply_photo(
-            photo=buffer,
-            caption=structure_text,
-            parse_mode='Markdown'
-        )
+        if report is None:
+            await update.message.reply_text("❌ Не удалось найти достаточно слов для облака.")
+            return
+        
+        await self.send_chart(update, 'cloud', source, report.data, report.caption)
 
     async def show_interactive_menu(self, query, context):
         """Показ меню интерактивных заданий"""
@@ -512,14 +758,133 @@ class EducationalBot:
         text = """
 🎮 **Интерактивные задания**
 
-В разработке:
+📚 **Образовательные карточки** - изучение новых понятий с интервальным повторением: карточки, которые вы помните хуже, показываются чаще
 
-📚 **Образовательные карточки** - изучение новых понятий
-
-Скоро появятся новые функции!
+Выберите задание ниже 👇
         """
         await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
+    async def show_flashcard_decks(self, query, context):
+        """Выбор колоды карточек (если колода одна, сразу первая карточка)"""
+        decks = await self.flashcards.decks()
+        back = [InlineKeyboardButton("🔙 Назад", callback_data="interactive")]
+        if not decks:
+            await query.edit_message_text(
+                "❌ Колоды карточек пока не загружены.", reply_markup=InlineKeyboardMarkup([back])
+            )
+            return
+        if len(decks) == 1:
+            await self.show_next_card(query, context, decks[0][0])
+            return
+        
+        keyboard = [
+            [InlineKeyboardButton(f"📚 {title} ({size})", callback_data=f"fc_deck_{name}")]
+            for name, title, size in decks
+        ]
+        keyboard.append(back)
+        await query.edit_message_text(
+            "📚 **Образовательные карточки**\n\nВыберите колоду:",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
+
+    async def handle_flashcard_button(self, query, context):
+        """Кнопки карточек: fc_deck_<колода>, fc_show_<карточка>, fc_grade_<карточка>_<оценка>.
+
+        Нажатия с неверными данными (подделанные или устаревшие кнопки) игнорируются.
+        """
+        parts = query.data.split('_', 2)
+        if len(parts) != 3:
+            return
+        _, action, argument = parts
+        if action == 'deck':
+            await self.show_next_card(query, context, argument)
+            return
+        
+        deck_name = context.user_data.get('fc_deck')
+        if deck_name is None:
+            await self.show_flashcard_decks(query, context)
+        elif action == 'show':
+            numbers = self.parse_numbers(argument, 1)
+            if numbers is not None:
+                await self.show_card_answer(query, deck_name, numbers[0])
+        elif action == 'grade':
+            numbers = self.parse_numbers(argument, 2)
+            if numbers is None or numbers[1] not in flashcards.GRADE_NAMES:
+                return
+            card, grade = numbers
+            # На карточку уже ответили (повторное нажатие): сообщение уже показывает следующую
+            if await self.flashcards.answer(query.from_user.id, deck_name, card, grade) is None:
+                return
+            await self.show_next_card(query, context, deck_name)
+
+    @staticmethod
+    def parse_numbers(argument, count):
+        """Числа из данных кнопки ("3_1"); None, если их не count или это не числа"""
+        values = argument.split('_')
+        if len(values) != count or not all(value.isascii() and value.isdigit() for value in values):
+            return None
+        return [int(value) for value in values]
+
+    async def show_next_card(self, query, context, deck_name):
+        """Показ вопроса следующей карточки или сообщения, что на сейчас все повторено"""
+        session, card = await self.flashcards.next_card(query.from_user.id, deck_name)
+        if session is None:
+            await self.show_flashcard_decks(query, context)
+            return
+        context.user_data['mode'] = 'flashcards'
+        context.user_data['fc_deck'] = deck_name
+        
+        deck = session.deck
+        progress = f"Изучено: {session.learned} из {len(deck)}"
+        if card is None:
+            text = f"🎉 {deck.title}\n\nНа сейчас все карточки повторены!\n{progress}"
+            next_due = session.next_due()
+            if next_due is not None:
+                text += f"\nСледующее повторение: {self.format_wait(next_due - time.time())}"
+            keyboard = [
+                [InlineKeyboardButton("📚 Другая колода", callback_data="flashcards")],
+                [InlineKeyboardButton("🏠 Главное меню", callback_data="back")]
+            ]
+        else:
+            text = f"📚 {deck.title}\n\n❓ {deck.fronts[card]}\n\n{progress}"
+            keyboard = [
+                [InlineKeyboardButton("👀 Показать ответ", callback_data=f"fc_show_{card}")],
+                [InlineKeyboardButton("🔙 Назад", callback_data="interactive")]
+            ]
+        # Без Markdown: текст карточек может содержать служебные символы
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+    async def show_card_answer(self, query, deck_name, card):
+        """Ответ карточки и кнопки оценки"""
+        deck = await self.flashcards.deck(deck_name)
+        if deck is None or not 0 <= card < len(deck):
+            return
+        grades = flashcards.GRADE_NAMES
+        keyboard = [
+            [InlineKeyboardButton(f"❌ {grades[flashcards.AGAIN]}", callback_data=f"fc_grade_{card}_{flashcards.AGAIN}"),
+             InlineKeyboardButton(f"😐 {grades[flashcards.HARD]}", callback_data=f"fc_grade_{card}_{flashcards.HARD}")],
+            [InlineKeyboardButton(f"✅ {grades[flashcards.GOOD]}", callback_data=f"fc_grade_{card}_{flashcards.GOOD}"),
+             InlineKeyboardButton(f"🚀 {grades[flashcards.EASY]}", callback_data=f"fc_grade_{card}_{flashcards.EASY}")],
+            [InlineKeyboardButton("🔙 Назад", callback_data="interactive")]
+        ]
+        await query.edit_message_text(
+            f"📚 {deck.title}\n\n❓ {deck.fronts[card]}\n\n💡 {deck.backs[card]}\n\n"
+            f"Насколько хорошо вы помнили ответ?",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+
+    @staticmethod
+    def format_wait(seconds):
+        """Время до повторения: "через 5 мин", "через 3 ч", "через 2 дн." """
+        if seconds < 60:
+            return "сейчас"
+        if seconds < 3600:
+            return f"через {int(seconds // 60)} мин"
+        if seconds < 86400:
+            return f"через {int(seconds // 3600)} ч"
+        return f"через {int(seconds // 86400)} дн."
+
     async def show_help(self, query, context):
         """Показ справки"""
         context.user_data.clear()
@@ -533,15 +898,22 @@ class EducationalBot:
 🎧 **Текст в речь:**
 1. Нажмите "Текст в речь"
 2. Выберите язык
-3. Отправьте текст (до 1000 символов)
+3. Отправьте текст (длинный текст будет озвучен по частям)
 4. Получите озвученный вариант
 
 📊 **Визуализация текста:**
 1. Нажмите "Визуализация текста"
-2. Выберите тип инфографики
+2. Выберите тип инфографики ("Полный отчет" - все основные графики сразу)
 3. Отправьте текст для анализа
 4. Получите график и статистику
 
+Большие тексты можно отправить файлом .txt
+
+📚 **Образовательные карточки:**
+1. Нажмите "Интерактивные задания" → "Образовательные карточки"
+2. Вспомните ответ и нажмите "Показать ответ"
+3. Оцените, насколько хорошо вы его помнили
+
         """
         keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -566,23 +938,137 @@ class EducationalBot:
             parse_mode='Markdown'
         )
 
-    def run(self):
-        """Запуск бота"""
-        application = Application.builder().token(self.token).build()
-        
-        application.add_handler(CommandHandler("start", self.start))
-        application.add_handler(CallbackQueryHandler(self.handle_button))
+    async def post_init(self, application: Application):
+        """Подготовка ресурсов перед началом обработки сообщений"""
+        self.startup.log("Время запуска по этапам:")
+        if config.METRICS_PORT:
+            try:
+                self._metrics_server = metrics.start_http_server(config.METRICS_HOST, config.METRICS_PORT)
+            except OSError as e:
+                logger.warning(f"Не удалось запустить сервер метрик: {e}")
+        if self.prewarm:
+            # Тяжелые модули грузятся в фоне, бот уже принимает сообщения
+            self._prewarm_task = asyncio.create_task(self.prewarm_resources())
+
+    async def prewarm_resources(self):
+        """Фоновый прогрев: импорт тяжелых модулей, кэш шрифтов, пул рендеринга"""
+        report = StartupReport(self.startup.started)
+        try:
+            await asyncio.to_thread(self._prewarm_imports, report)
+            with report.phase('прогрев: пул рендеринга'):
+                await self.renderer.warm_up()
+            with report.phase('прогрев: колоды карточек'):
+                await self.flashcards.decks()
+        except Exception as e:
+            logger.warning(f"Ошибка фонового прогрева: {e}")
+        report.log("Фоновый прогрев завершен:")
+
+    @staticmethod
+    def _prewarm_imports(report: StartupReport):
+        with report.phase('прогрев: numpy и анализ текста'):
+            import text_analysis  # noqa: F401
+        with report.phase('прогрев: словари'):
+            import lexicon
+            for lang in lexicon.LANGUAGES:
+                lexicon.get_lexicon(lang)
+        with report.phase('прогрев: gTTS'):
+            import gtts  # noqa: F401
+        with report.phase('прогрев: matplotlib и шрифты'):
+            from matplotlib import font_manager
+            # Загружает (или создает) кэш шрифтов, воркеры затем читают готовый
+            font_manager.findfont('DejaVu Sans')
+
+    async def post_shutdown(self, application: Application):
+        """Освобождение ресурсов после остановки бота"""
+        self.renderer.shutdown()
+        self.flashcards.close()
+        self.tts.close()
+        if self._metrics_server is not None:
+            self._metrics_server.shutdown()
+            self._metrics_server = None
+
+    def build_application(self, request=None):
+        """Создание Application с зарегистрированными обработчиками.
+
+        request - замена запросов к Bot API (например, FakeRequest для замеров).
+        """
+        with self.startup.phase('сборка Application'):
+            builder = (
+                Application.builder()
+                .token(self.token)
+                .base_url(config.BOT_API_BASE_URL)
+                .post_init(self.post_init)
+                .post_shutdown(self.post_shutdown)
+                # Чаты обрабатываются параллельно, обновления одного чата - по очереди
+                .concurrent_updates(ChatOrderedUpdateProcessor(
+                    config.MAX_CONCURRENT_UPDATES, config.CHAT_MAX_PENDING
+                ))
+            )
+            # Состояние пользователей (режим, язык, тип графика) переживает
+            # перезапуск и доступно всем репликам с общей базой
+            persistence = create_persistence(
+                config.STATE_BACKEND,
+                config.STATE_DB_PATH,
+                session_ttl=config.STATE_SESSION_TTL_HOURS * 3600,
+                cache_ttl=config.STATE_CACHE_SECONDS,
+                flush_interval=config.STATE_FLUSH_SECONDS
+            )
+            if persistence is not None:
+                builder = builder.persistence(persistence)
+            if request is not None:
+                builder = builder.request(request).get_updates_request(request)
+            application = builder.build()
+        
+        with self.startup.phase('регистрация обработчиков'):
+            application.add_handler(CommandHandler("start", self.start))
+            application.add_handler(CallbackQueryHandler(self.handle_button))
+            
+            application.add_handler(MessageHandler(
+                filters.TEXT & ~filters.COMMAND, 
+                self.handle_text_message
+            ))
+            application.add_handler(MessageHandler(
+                filters.Document.FileExtension('txt') | filters.Document.MimeType('text/plain'),
+                self.handle_document
+            ))
+        
+        return application
+
+    def run(self, mode=config.BOT_MODE):
+        """Запуск бота в режиме polling или webhook"""
+        application = self.build_application()
         
-        application.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND, 
-            self.handle_text_message
-        ))
+        if mode == 'webhook':
+            self.run_webhook(application)
+        else:
+            logger.info("Бот запущен...")
+            application.run_polling()
+
+    def run_webhook(self, application: Application):
+        """Запуск webhook-сервера.
+
+        Реплики за балансировщиком запускаются с одинаковыми WEBHOOK_URL и
+        WEBHOOK_SECRET: каждая регистрирует один и тот же адрес, а Telegram
+        доставляет обновления на балансировщик.
+        """
+        if not config.WEBHOOK_SECRET:
+            logger.warning("WEBHOOK_SECRET не задан: webhook примет запросы от кого угодно")
         
-        logger.info("Бот запущен...")
-        application.run_polling()
+        logger.info(
+            f"Бот запущен в режиме webhook на {config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT}"
+            f"/{config.WEBHOOK_PATH}"
+        )
+        application.run_webhook(
+            listen=config.WEBHOOK_LISTEN,
+            port=config.WEBHOOK_PORT,
+            url_path=config.WEBHOOK_PATH,
+            webhook_url=config.WEBHOOK_URL or None,
+            secret_token=config.WEBHOOK_SECRET or None,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS
+        )
 
 if __name__ == '__main__':
-    BOT_TOKEN = ""
+    BOT_TOKEN = os.environ.get("BOT_TOKEN", "")
     
     if BOT_TOKEN == "":
         print("Пожалуйста, установите ваш токен бота!")
@@ -0,0 +1,436 @@
+"""Построение графиков на шаблонах без глобального состояния pyplot.
+
+Для каждого типа графика один раз создается шаблон: Figure и
+FigureCanvasAgg с уже рассчитанной разметкой и заготовленными
+столбцами и подписями. На запрос шаблон только меняет высоты
+столбцов, подписи и текст, после чего холст рисуется и кодируется
+(image_encoder.py: PNG с палитрой, WebP или JPEG в пределах бюджета
+размера). Шаблоны хранятся отдельно для каждого потока, поэтому
+рендер из нескольких потоков безопасен.
+"""
+import threading
+import time
+from random import Random
+
+import numpy as np
+from matplotlib import cm
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import ImageFont
+
+from image_encoder import ImageEncoder
+
+DPI = 120
+# Длины слов больше этой попадают в последний столбец гистограммы
+HIST_MAX_LEN = 30
+# Подписи слов длиннее этого обрезаются, чтобы не выйти за разметку
+MAX_LABEL_CHARS = 20
+# Облако слов: размер холста в пикселях и число слов ограничены,
+# чтобы раскладка укладывалась в постоянное время
+CLOUD_WIDTH = 900
+CLOUD_HEIGHT = 500
+CLOUD_MAX_WORDS = 100
+CLOUD_SEED = 42
+
+_local = threading.local()
+_default_encoder = None
+
+
+def _shorten(label):
+    return label if len(label) <= MAX_LABEL_CHARS else label[:MAX_LABEL_CHARS - 1] + '…'
+
+
+def _value_labels(ax, count, **kwargs):
+    return [ax.text(0, 0, '', ha='center', va='bottom', fontweight='bold', **kwargs)
+            for _ in range(count)]
+
+
+def _update_value_labels(bars, labels, values, offset):
+    for bar, label, value in zip(bars, labels, values):
+        label.set_position((bar.get_x() + bar.get_width()/2, bar.get_height() + offset))
+        label.set_text(f'{value}')
+
+
+class ChartTemplate:
+    """Базовый шаблон: фигура, холст и однократная разметка"""
+
+    figsize = (12, 8)
+
+    def __init__(self):
+        # DPI, с которого начинается следующий рендер (снижается под бюджет размера)
+        self.dpi = DPI
+        self.figure = Figure(figsize=self.figsize, dpi=DPI)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.build()
+        # Разметка считается один раз на заглушках с самыми длинными подписями
+        self.figure.tight_layout(pad=self.layout_pad)
+        self.figure.set_layout_engine('none')
+
+    layout_pad = 1.08
+
+    def build(self):
+        raise NotImplementedError
+
+    def update(self, data):
+        raise NotImplementedError
+
+    def render(self, data, encoder=None):
+        """Обновление шаблона данными и кодирование в изображение"""
+        return self.render_timed(data, encoder)[0]
+
+    def render_timed(self, data, encoder=None):
+        """Изображение и время этапов: (байты, построение фигуры, кодирование), секунд"""
+        encoder = encoder or default_encoder()
+        build_time = encode_time = 0.0
+        started = time.perf_counter()
+        self.update(data)
+        dpi = self.dpi
+        while True:
+            self.figure.set_dpi(dpi)
+            self.canvas.draw()
+            drawn = time.perf_counter()
+            image = encoder.encode(self.canvas)
+            encoded = time.perf_counter()
+            build_time += drawn - started
+            encode_time += encoded - drawn
+            started = encoded
+            if encoder.fits(len(image)) or dpi <= encoder.min_dpi:
+                break
+            # Не уложились в бюджет: перерисовываем с меньшим разрешением
+            dpi = encoder.next_dpi(dpi, len(image))
+
+        # Следующий график того же типа начинаем с подобранного DPI,
+        # а если запас большой - пробуем вернуться к исходному
+        if encoder.max_bytes and len(image) < encoder.max_bytes // 2:
+            dpi = min(DPI, int(dpi * 1.2))
+        self.dpi = dpi
+        return image, build_time, encode_time
+
+
+class BarPool:
+    """Заготовленные столбцы, лишние скрываются, недостающие добавляются"""
+
+    def __init__(self, ax, size, horizontal=False, **style):
+        self.ax = ax
+        self.horizontal = horizontal
+        self.style = style
+        self.bars = []
+        self._grow(size)
+
+    def _grow(self, size):
+        start = len(self.bars)
+        positions = range(start, size)
+        zeros = [0] * len(positions)
+        if self.horizontal:
+            container = self.ax.barh(positions, zeros, **self.style)
+        else:
+            container = self.ax.bar([p + 1 for p in positions], zeros, **self.style)
+        self.bars.extend(container.patches)
+
+    def update(self, values, colors=None):
+        if len(values) > len(self.bars):
+            self._grow(len(values))
+        for i, bar in enumerate(self.bars):
+            visible = i < len(values)
+            bar.set_visible(visible)
+            if not visible:
+                continue
+            if self.horizontal:
+                bar.set_width(values[i])
+            else:
+                bar.set_height(values[i])
+            if colors is not None:
+                bar.set_facecolor(colors[i])
+        return self.bars[:len(values)]
+
+
+class FrequencyTemplate(ChartTemplate):
+    """Столбчатая диаграмма топ-10 слов"""
+
+    figsize = (12, 8)
+    size = 10
+
+    def build(self):
+        ax = self.ax = self.figure.add_subplot()
+        self.bars = BarPool(ax, self.size, horizontal=True)
+        self.labels = [ax.text(0, 0, '', ha='left', va='center', fontweight='bold')
+                       for _ in range(self.size)]
+        ax.set_xlabel('Частота встречаемости', fontsize=12)
+        ax.set_title('Топ-10 самых частых слов в тексте', fontsize=14, pad=20)
+        ax.grid(axis='x', alpha=0.3)
+        ax.set_yticks(range(self.size), ['ш' * MAX_LABEL_CHARS] * self.size)
+        ax.set_xlim(0, 100000)
+
+    def update(self, data):
+        words = [_shorten(w) for w in data['words']]
+        counts = data['counts']
+        n = len(words)
+        ax = self.ax
+
+        bars = self.bars.update(counts, cm.viridis(np.linspace(0, 1, n)))
+        for i, label in enumerate(self.labels):
+            if i < n:
+                bar = bars[i]
+                label.set_position((bar.get_width() + 0.1, bar.get_y() + bar.get_height()/2))
+                label.set_text(f'{counts[i]}')
+            else:
+                label.set_text('')
+
+        ax.set_yticks(range(n), words)
+        ax.set_ylim(-0.4 - 0.05 * n, n - 0.6 + 0.05 * n)
+        ax.set_xlim(0, max(counts) * 1.1)
+
+
+class StatisticsTemplate(ChartTemplate):
+    """Инфографика основной статистики текста"""
+
+    figsize = (15, 10)
+    layout_pad = 3.0
+
+    def build(self):
+        axes = self.figure.subplots(2, 2)
+        (self.ax1, self.ax2), (self.ax3, self.ax4) = axes
+
+        # Основная статистика
+        self.bars1 = self.ax1.bar(['Символы', 'Слова', 'Предложения', 'Абзацы'], [0] * 4,
+                                  color=['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4'], alpha=0.8)
+        self.ax1.set_title('Основная статистика текста', fontsize=12, fontweight='bold')
+        self.ax1.grid(axis='y', alpha=0.3)
+        self.labels1 = _value_labels(self.ax1, 4)
+
+        # Распределение длины слов
+        self.hist = BarPool(self.ax2, HIST_MAX_LEN, color='#FFD166', alpha=0.7,
+                            edgecolor='black', width=1, align='edge')
+        self.ax2.set_title('Распределение длины слов', fontsize=12, fontweight='bold')
+        self.ax2.set_xlabel('Длина слова')
+        self.ax2.set_ylabel('Количество')
+        self.ax2.grid(alpha=0.3)
+
+        # Сравнение символов
+        self.bars3 = self.ax3.bar(['Всего символов', 'Без пробелов'], [0, 0],
+                                  color=['#EF476F', '#06D6A0'], alpha=0.8)
+        self.ax3.set_title('Анализ символов', fontsize=12, fontweight='bold')
+        self.ax3.grid(axis='y', alpha=0.3)
+        self.labels3 = _value_labels(self.ax3, 2)
+
+        # Средние значения
+        self.bars4 = self.ax4.bar(['Ср. длина слова', 'Ср. слов в предложении'], [0, 0],
+                                  color=['#118AB2', '#073B4C'], alpha=0.8)
+        self.ax4.set_title('Средние значения', fontsize=12, fontweight='bold')
+        self.ax4.grid(axis='y', alpha=0.3)
+        self.labels4 = _value_labels(self.ax4, 2)
+
+        # Заглушки с самыми широкими числами для расчета разметки
+        for ax in (self.ax1, self.ax2, self.ax3):
+            ax.set_ylim(0, 10000000)
+
+    @staticmethod
+    def _set_bars(ax, bars, labels, values, offset_ratio):
+        for bar, value in zip(bars, values):
+            bar.set_height(value)
+        top = max(values) or 1
+        _update_value_labels(bars, labels, values, top * offset_ratio)
+        ax.set_ylim(0, top * (1.1 + offset_ratio))
+
+    def update(self, data):
+        chars_total = data['chars_total']
+        values = [chars_total, data['word_count'], data['sentence_count'], data['paragraph_count']]
+        self._set_bars(self.ax1, self.bars1, self.labels1, values, 0.01)
+
+        # Гистограмма: индекс - длина слова, значение - количество
+        hist = np.asarray(data['word_length_hist'])[1:]
+        if len(hist) > HIST_MAX_LEN:
+            hist = np.append(hist[:HIST_MAX_LEN - 1], hist[HIST_MAX_LEN - 1:].sum())
+        self.hist.update(hist)
+        n = max(len(hist), 1)
+        self.ax2.set_xlim(1 - 0.05 * n, n + 1 + 0.05 * n)
+        self.ax2.set_ylim(0, (hist.max() if len(hist) else 1) * 1.05 or 1)
+
+        self._set_bars(self.ax3, self.bars3, self.labels3,
+                       [chars_total, data['chars_no_spaces']], 0.01)
+        avg_values = [round(data['avg_word_len'], 1), round(data['avg_sentence_len'], 1)]
+        self._set_bars(self.ax4, self.bars4, self.labels4, avg_values, 0.1)
+
+
+class PieTemplate(ChartTemplate):
+    """Круговая диаграмма.
+
+    Секторы и подписи круговой диаграммы зависят от долей, поэтому
+    перестраивается только сама ось, фигура и разметка переиспользуются.
+    """
+
+    figsize = (10, 8)
+
+    def build(self):
+        self.ax = self.figure.add_subplot()
+        self.ax.set_title('Заглушка', fontsize=14, fontweight='bold')
+
+    def update(self, data):
+        ax = self.ax
+        ax.clear()
+        wedges, texts, autotexts = ax.pie(
+            data['sizes'],
+            labels=data['categories'],
+            colors=data['colors'],
+            # Подписи узких секторов налезают друг на друга
+            autopct=lambda pct: f'{pct:.1f}%' if pct >= 3 else '',
+            startangle=90
+        )
+        for autotext in autotexts:
+            autotext.set_color('white')
+            autotext.set_fontweight('bold')
+        ax.set_title(data['title'], fontsize=14, fontweight='bold')
+
+
+class StructureTemplate(ChartTemplate):
+    """Диаграммы длины абзацев и предложений"""
+
+    figsize = (15, 6)
+    size = 50
+
+    def build(self):
+        self.ax1, self.ax2 = self.figure.subplots(1, 2)
+        self.para_bars = BarPool(self.ax1, self.size, alpha=0.7)
+        self.sent_bars = BarPool(self.ax2, self.size, alpha=0.7)
+        for ax in (self.ax1, self.ax2):
+            ax.set_title('Заглушка', fontweight='bold')
+            ax.set_xlabel('Заглушка')
+            ax.set_ylabel('Количество слов')
+            ax.grid(axis='y', alpha=0.3)
+            ax.set_ylim(0, 100000)
+
+    @staticmethod
+    def _set_series(ax, pool, values, colormap, title, xlabel):
+        n = len(values)
+        pool.update(values, colormap(np.linspace(0, 1, n)) if n else None)
+        ax.set_visible(bool(n))
+        if not n:
+            return
+        ax.set_title(title, fontweight='bold')
+        ax.set_xlabel(xlabel)
+        ax.set_xlim(0.6 - 0.05 * n, n + 0.4 + 0.05 * n)
+        ax.set_ylim(0, (max(values) or 1) * 1.05)
+
+    def update(self, data):
+        self._set_series(self.ax1, self.para_bars, data['para_lengths'], cm.Set3,
+                         data['para_title'], data['para_xlabel'])
+        self._set_series(self.ax2, self.sent_bars, data['sent_lengths'], cm.Pastel1,
+                         data['sent_title'], data['sent_xlabel'])
+
+
+class _FontCache:
+    """Замена ImageFont для wordcloud: каждый размер шрифта загружается один раз.
+
+    wordcloud открывает файл шрифта заново на каждую попытку размещения
+    слова, а таких попыток сотни на одно облако.
+    """
+
+    TransposedFont = ImageFont.TransposedFont
+
+    def __init__(self):
+        self._fonts = {}
+        self._lock = threading.Lock()
+
+    def truetype(self, path, size):
+        key = (path, size)
+        font = self._fonts.get(key)
+        if font is None:
+            font = ImageFont.truetype(path, size)
+            with self._lock:
+                self._fonts[key] = font
+        return font
+
+
+_font_cache = _FontCache()
+
+
+def _ellipse_mask(width, height):
+    """Маска облака: 255 - за пределами эллипса (туда слова не ставятся)"""
+    y, x = np.ogrid[:height, :width]
+    inside = ((x - width / 2) / (width / 2)) ** 2 + ((y - height / 2) / (height / 2)) ** 2 <= 1
+    return np.where(inside, 0, 255).astype(np.uint8)
+
+
+class CloudTemplate(ChartTemplate):
+    """Облако слов: раскладка wordcloud, показанная на фигуре matplotlib"""
+
+    figsize = (10, 6)
+
+    def build(self):
+        from matplotlib import font_manager
+        from wordcloud import WordCloud
+        from wordcloud import wordcloud as wordcloud_module
+
+        wordcloud_module.ImageFont = _font_cache
+        self.cloud = WordCloud(
+            font_path=font_manager.findfont('DejaVu Sans'),
+            mask=_ellipse_mask(CLOUD_WIDTH, CLOUD_HEIGHT),
+            max_words=CLOUD_MAX_WORDS,
+            # Явный максимальный размер избавляет от пробной раскладки двух слов
+            max_font_size=CLOUD_HEIGHT // 4,
+            min_font_size=8,
+            font_step=2,
+            relative_scaling=0.5,
+            background_color='white',
+            colormap='viridis',
+            collocations=False,
+            normalize_plurals=False,
+        )
+        ax = self.ax = self.figure.add_subplot()
+        blank = np.full((CLOUD_HEIGHT, CLOUD_WIDTH, 3), 255, dtype=np.uint8)
+        self.image = ax.imshow(blank, interpolation='bilinear')
+        ax.axis('off')
+        ax.set_title('Облако слов', fontsize=14, fontweight='bold')
+
+    def update(self, data):
+        # Один и тот же текст всегда дает одинаковое облако
+        self.cloud.random_state = Random(CLOUD_SEED)
+        self.cloud.generate_from_frequencies(data['frequencies'])
+        self.image.set_data(self.cloud.to_array())
+
+
+TEMPLATES = {
+    'freq': FrequencyTemplate,
+    'stats': StatisticsTemplate,
+    'pie': PieTemplate,
+    'structure': StructureTemplate,
+    'cloud': CloudTemplate,
+}
+
+
+def default_encoder():
+    """Кодер по настройкам IMAGE_* из config"""
+    global _default_encoder
+    if _default_encoder is None:
+        import config
+        _default_encoder = ImageEncoder(
+            config.IMAGE_FORMAT, config.IMAGE_MAX_KB * 1024, config.IMAGE_QUALITY, config.IMAGE_MIN_DPI
+        )
+    return _default_encoder
+
+
+def get_template(kind):
+    """Шаблон графика для текущего потока (создается при первом обращении)"""
+    templates = getattr(_local, 'templates', None)
+    if templates is None:
+        templates = _local.templates = {}
+    template = templates.get(kind)
+    if template is None:
+        template = templates[kind] = TEMPLATES[kind]()
+    return template
+
+
+def render_chart(kind, data, encoder=None):
+    """Построение графика, возвращает изображение в байтах"""
+    return get_template(kind).render(data, encoder)
+
+
+def render_chart_timed(kind, data, encoder=None):
+    """Построение графика: (изображение, время построения фигуры, время кодирования)"""
+    return get_template(kind).render_timed(data, encoder)
+
+
+def warm_up():
+    """Создание всех шаблонов заранее (загружает шрифты и считает разметку)"""
+    for kind in TEMPLATES:
+        get_template(kind)
@@ -0,0 +1,109 @@
+"""Настройки бота, читаются из переменных окружения"""
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+# Фоновый прогрев тяжелых модулей и пула рендеринга после запуска (0 - выключить)
+PREWARM = _env_int('PREWARM', 1) == 1
+
+# Количество процессов для рендеринга графиков
+RENDER_WORKERS = _env_int('RENDER_WORKERS', min(4, os.cpu_count() or 1))
+
+# Кэш синтезированной речи: память и (необязательно) диск
+TTS_CACHE_MEMORY_MB = _env_int('TTS_CACHE_MEMORY_MB', 32)
+TTS_CACHE_DIR = os.environ.get('TTS_CACHE_DIR', '')
+TTS_CACHE_DISK_MB = _env_int('TTS_CACHE_DISK_MB', 512)
+
+# Реестр file_id уже загруженных в Telegram файлов
+FILE_ID_CACHE_SIZE = _env_int('FILE_ID_CACHE_SIZE', 10000)
+FILE_ID_TTL_HOURS = _env_int('FILE_ID_TTL_HOURS', 24)
+
+# Длинные тексты для озвучки: разбиваются на части и синтезируются параллельно
+TTS_MAX_CHARS = _env_int('TTS_MAX_CHARS', 1000)
+# 4096 - предел длины сообщения в Telegram
+TTS_LONG_MAX_CHARS = _env_int('TTS_LONG_MAX_CHARS', 4096)
+TTS_CHUNK_CHARS = _env_int('TTS_CHUNK_CHARS', 500)
+TTS_CHUNK_WORKERS = _env_int('TTS_CHUNK_WORKERS', 4)
+# Формат голосовых сообщений: opus (OGG/Opus через ffmpeg, родной для Telegram) или mp3
+TTS_VOICE_FORMAT = os.environ.get('TTS_VOICE_FORMAT', 'opus')
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+TTS_OPUS_BITRATE_KBPS = _env_int('TTS_OPUS_BITRATE_KBPS', 32)
+# Движки синтеза речи по порядку: gtts (сеть) и local (eSpeak NG и ffmpeg, без сети)
+TTS_BACKENDS = os.environ.get('TTS_BACKENDS', 'gtts,local')
+TTS_LOCAL_ENGINE = os.environ.get('TTS_LOCAL_ENGINE', 'espeak-ng')
+# Срок синтеза одним движком, с; медленный запрос дублируется после p95 недавних вызовов
+TTS_TIMEOUT_SECONDS = _env_int('TTS_TIMEOUT_SECONDS', 20)
+TTS_HEDGE_ATTEMPTS = _env_int('TTS_HEDGE_ATTEMPTS', 2)
+# После стольких сбоев подряд движок пропускается на TTS_BREAKER_RESET_SECONDS
+TTS_BREAKER_FAILURES = _env_int('TTS_BREAKER_FAILURES', 5)
+TTS_BREAKER_RESET_SECONDS = _env_int('TTS_BREAKER_RESET_SECONDS', 30)
+
+# Максимальный размер текстового документа (предел скачивания Bot API - 20 МБ)
+DOCUMENT_MAX_MB = _env_int('DOCUMENT_MAX_MB', 20)
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+# Адрес Bot API (можно указать локальную заглушку, см. fake_telegram.py)
+BOT_API_BASE_URL = os.environ.get('BOT_API_BASE_URL', 'https://api.telegram.org/bot')
+
+# Настройки webhook: адрес и порт сервера, путь, публичный URL и секрет
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = _env_int('WEBHOOK_PORT', 8443)
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', 'telegram')
+# Публичный URL за балансировщиком, например https://bot.example.org/telegram
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+# Сколько одновременных соединений Telegram может открыть к webhook (1-100)
+WEBHOOK_MAX_CONNECTIONS = _env_int('WEBHOOK_MAX_CONNECTIONS', 100)
+
+# Хранилище состояния пользователей: sqlite (общая база для всех реплик) или memory
+STATE_BACKEND = os.environ.get('STATE_BACKEND', 'sqlite')
+STATE_DB_PATH = os.environ.get('STATE_DB_PATH', 'bot_state.sqlite3')
+# Сессия сбрасывается, если пользователь неактивен дольше этого времени
+STATE_SESSION_TTL_HOURS = _env_int('STATE_SESSION_TTL_HOURS', 24)
+# Как долго данные активного пользователя берутся из кэша без обращения к базе
+STATE_CACHE_SECONDS = _env_int('STATE_CACHE_SECONDS', 2)
+# Как часто изменения записываются в базу
+STATE_FLUSH_SECONDS = _env_int('STATE_FLUSH_SECONDS', 1)
+
+# Очереди тяжелых задач: сколько выполняется одновременно и сколько может ждать
+TTS_MAX_JOBS = _env_int('TTS_MAX_JOBS', 8)
+RENDER_MAX_JOBS = _env_int('RENDER_MAX_JOBS', RENDER_WORKERS * 2)
+JOB_QUEUE_SIZE = _env_int('JOB_QUEUE_SIZE', 100)
+# Сколько задач одного пользователя может выполняться и ждать одновременно
+USER_MAX_JOBS = _env_int('USER_MAX_JOBS', 2)
+
+# Сколько обновлений обрабатывается одновременно (обновления одного чата - всегда по очереди)
+MAX_CONCURRENT_UPDATES = _env_int('MAX_CONCURRENT_UPDATES', 64)
+# Сколько обновлений одного чата может ждать обработки, лишние отбрасываются
+CHAT_MAX_PENDING = _env_int('CHAT_MAX_PENDING', 20)
+
+# HTTP-сервер метрик Prometheus (0 - выключить)
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = _env_int('METRICS_PORT', 9108)
+# Доля сообщений, попадающих в лог (в процентах)
+LOG_SAMPLE_RATE = _env_int('LOG_SAMPLE_PERCENT', 1) / 100
+
+# Формат графиков: png (с палитрой), png24 (полноцветный), webp или jpeg
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'png')
+# Бюджет размера графика: при превышении он перерисовывается с меньшим DPI (0 - без ограничения)
+IMAGE_MAX_KB = _env_int('IMAGE_MAX_KB', 150)
+IMAGE_QUALITY = _env_int('IMAGE_QUALITY', 85)
+IMAGE_MIN_DPI = _env_int('IMAGE_MIN_DPI', 72)
+
+# Каталог словарей (lexicon/*.txt и собранные индексы *.lex); пусто - lexicon рядом с кодом
+LEXICON_DIR = os.environ.get('LEXICON_DIR', '')
+# Каталог собранных индексов словарей; пусто - там же, где исходники
+LEXICON_INDEX_DIR = os.environ.get('LEXICON_INDEX_DIR', '')
+
+# Образовательные карточки: колоды и история ответов в SQLite
+FLASHCARDS_DB_PATH = os.environ.get('FLASHCARDS_DB_PATH', 'flashcards.sqlite3')
+# Каталог файлов колод (*.tsv); пусто - decks рядом с кодом
+FLASHCARDS_DECK_DIR = os.environ.get('FLASHCARDS_DECK_DIR', '')
+FLASHCARDS_NEW_PER_DAY = _env_int('FLASHCARDS_NEW_PER_DAY', 20)
+# Сколько сессий учеников держать в памяти (остальные читаются из базы)
+FLASHCARDS_SESSIONS = _env_int('FLASHCARDS_SESSIONS', 10000)
@@ -0,0 +1,286 @@
+"""Локальная заглушка Telegram для проверки бота без сети.
+
+Два режима:
+
+    # Заглушка Bot API: отвечает на sendMessage, sendPhoto, setWebhook и т.д.
+    python fake_telegram.py api --port 8081
+
+    # Отправка поддельных обновлений на webhook бота
+    python fake_telegram.py send http://127.0.0.1:8443/telegram --secret SECRET --users 50
+
+Бот направляется на заглушку переменной окружения
+BOT_API_BASE_URL=http://127.0.0.1:8081/bot
+
+Для замеров без сети FakeRequest отвечает на вызовы Bot API прямо
+в процессе бота (см. benchmark.py).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram.request import BaseRequest
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {
+    'id': 1000,
+    'is_bot': True,
+    'first_name': 'FakeBot',
+    'username': 'fake_bot',
+    'can_join_groups': False,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False,
+}
+
+_message_ids = itertools.count(1)
+_file_ids = itertools.count(1)
+
+
+def make_user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'Ученик {user_id}'}
+
+
+def make_chat(chat_id):
+    return {'id': chat_id, 'type': 'private'}
+
+
+def make_message(chat_id, text=None, from_user=None, **extra):
+    message = {
+        'message_id': next(_message_ids),
+        'date': int(time.time()),
+        'chat': make_chat(chat_id),
+    }
+    if from_user is not None:
+        message['from'] = from_user
+    if text is not None:
+        message['text'] = text
+    message.update(extra)
+    return message
+
+
+def make_message_update(update_id, user_id, text):
+    """Обновление с текстовым сообщением пользователя"""
+    return {
+        'update_id': update_id,
+        'message': make_message(user_id, text, from_user=make_user(user_id)),
+    }
+
+
+def make_callback_update(update_id, user_id, data):
+    """Обновление с нажатием inline-кнопки"""
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': make_user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': make_message(user_id, 'меню', from_user=BOT_USER),
+        },
+    }
+
+
+def _file(prefix, **extra):
+    number = next(_file_ids)
+    return dict({'file_id': f'{prefix}{number}', 'file_unique_id': f'u{prefix}{number}'}, **extra)
+
+
+def api_result(method, params):
+    """Ответ заглушки Bot API на вызов метода"""
+    chat_id = params.get('chat_id', 1)
+    try:
+        chat_id = int(chat_id)
+    except (TypeError, ValueError):
+        chat_id = 1
+    method = method.lower()
+
+    if method == 'getme':
+        return BOT_USER
+    if method == 'getupdates':
+        return []
+    if method == 'getwebhookinfo':
+        return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+    if method in ('sendmessage', 'editmessagetext'):
+        return make_message(chat_id, params.get('text', ''), from_user=BOT_USER)
+    if method == 'sendphoto':
+        return make_message(chat_id, from_user=BOT_USER,
+                            photo=[_file('photo', width=1200, height=800)])
+    if method == 'sendvoice':
+        return make_message(chat_id, from_user=BOT_USER, voice=_file('voice', duration=1))
+    if method == 'sendaudio':
+        return make_message(chat_id, from_user=BOT_USER, audio=_file('audio', duration=1))
+    if method == 'senddocument':
+        return make_message(chat_id, from_user=BOT_USER, document=_file('document'))
+    if method == 'sendmediagroup':
+        media = params.get('media') or []
+        if isinstance(media, str):
+            media = json.loads(media)
+        return [make_message(chat_id, from_user=BOT_USER,
+                             photo=[_file('photo', width=1200, height=800)])
+                for _ in media or [None]]
+    if method == 'getfile':
+        return _file('file', file_size=0, file_path='documents/file.txt')
+    # setWebhook, deleteWebhook, answerCallbackQuery, deleteMessage и прочие
+    return True
+
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов вида /bot<token>/<method>"""
+
+    calls = Counter()
+    lock = threading.Lock()
+
+    def do_POST(self):
+        method = self.path.rstrip('/').rsplit('/', 1)[-1]
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        params = {}
+        if self.headers.get('Content-Type', '').startswith('application/json') and body:
+            params = json.loads(body)
+
+        with self.lock:
+            self.calls[method] += 1
+        payload = json.dumps({'ok': True, 'result': api_result(method, params)}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class FakeRequest(BaseRequest):
+    """Запросы к Bot API без сети: ответы формирует api_result.
+
+    latency - искусственная задержка каждого вызова, секунд.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rstrip('/').rsplit('/', 1)[-1]
+        self.calls[api_method] += 1
+        params = request_data.parameters if request_data is not None else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return 200, json.dumps({'ok': True, 'result': api_result(api_method, params)}).encode()
+
+
+def serve_api(host, port):
+    server = ThreadingHTTPServer((host, port), FakeBotAPIHandler)
+    logger.info(f"Заглушка Bot API: http://{host}:{port}/bot")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info(f"Вызовы методов: {dict(FakeBotAPIHandler.calls)}")
+
+
+def post_update(url, update, secret=None):
+    """Отправка одного обновления на webhook, возвращает (HTTP-статус, задержку)"""
+    request = urllib.request.Request(
+        url, data=json.dumps(update).encode(), headers={'Content-Type': 'application/json'}
+    )
+    if secret:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', secret)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - started
+
+
+def classroom_updates(users, text, viz_type='stats', first_update_id=1):
+    """Сценарий урока: каждый ученик открывает визуализацию и отправляет текст"""
+    update_ids = itertools.count(first_update_id)
+    scripts = []
+    for user_id in range(1, users + 1):
+        scripts.append([
+            make_callback_update(next(update_ids), user_id, 'visualize'),
+            make_callback_update(next(update_ids), user_id, f'viz_{viz_type}'),
+            make_message_update(next(update_ids), user_id, text),
+        ])
+    return scripts
+
+
+def send_updates(url, secret, users, text, viz_type, concurrency):
+    scripts = classroom_updates(users, text, viz_type)
+    statuses = Counter()
+    latencies = []
+
+    def run_script(script):
+        # Обновления одного ученика идут по порядку, ученики - параллельно
+        for update in script:
+            status, latency = post_update(url, update, secret)
+            statuses[status] += 1
+            latencies.append(latency)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run_script, scripts))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    logger.info(f"Отправлено обновлений: {len(latencies)} за {elapsed:.2f} с, "
+                f"статусы: {dict(statuses)}, p95 ответа webhook: {p95 * 1000:.1f} мс")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальная заглушка Telegram")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    api = sub.add_parser('api', help="запустить заглушку Bot API")
+    api.add_argument('--host', default='127.0.0.1')
+    api.add_argument('--port', type=int, default=8081)
+
+    send = sub.add_parser('send', help="отправить поддельные обновления на webhook")
+    send.add_argument('url', help="адрес webhook бота")
+    send.add_argument('--secret', default='', help="WEBHOOK_SECRET бота")
+    send.add_argument('--users', type=int, default=30, help="число учеников")
+    send.add_argument('--viz', default='stats', help="тип инфографики")
+    send.add_argument('--text', default="Пример текста для анализа. Второе предложение!")
+    send.add_argument('--concurrency', type=int, default=30)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    if args.command == 'api':
+        serve_api(args.host, args.port)
+    else:
+        send_updates(args.url, args.secret, args.users, args.text, args.viz, args.concurrency)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
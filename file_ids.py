@@ -0,0 +1,60 @@
+"""Реестр file_id для повторной отправки файлов без загрузки.
+
+Telegram возвращает file_id для каждого загруженного файла. Если тот же
+график или та же озвучка понадобятся снова, достаточно отправить file_id.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+
+
+def content_key(*parts):
+    """Хэш содержимого по частям (тип, язык/вид графика, текст)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class FileIdRegistry:
+    """LRU-реестр file_id с ограничением времени жизни"""
+
+    def __init__(self, max_entries=10000, ttl=24 * 3600, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Возвращает file_id или None, если записи нет или она устарела"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            file_id, expires_at = entry
+            if expires_at > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return file_id
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def __contains__(self, key):
+        """Есть ли действующая запись (без учета в статистике и порядке LRU)"""
+        entry = self._entries.get(key)
+        return entry is not None and entry[1] > self.clock()
+
+    def put(self, key, file_id):
+        self._entries[key] = (file_id, self.clock() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, key):
+        """Удаляет запись, например если Telegram отклонил file_id"""
+        self._entries.pop(key, None)
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,514 @@
+"""Образовательные карточки с интервальным повторением.
+
+Колоды загружаются из файлов decks/*.tsv (строка - карточка:
+"вопрос<TAB>ответ") в SQLite одной транзакцией и хранятся там же, где
+история ответов учеников. В памяти процесса колода одна на всех: два
+списка строк, карточка - номер в колоде.
+
+Состояние ученика по колоде (StudySession) - карточки, которые он уже
+видел (CardState со __slots__), и куча (время повторения, номер
+карточки). Следующая карточка берется с вершины кучи за O(log n),
+независимо от размера колоды и числа учеников; новые карточки выдаются
+по порядку, не больше new_per_day в день. Каждый ответ сразу
+записывается в базу, поэтому сессии в памяти можно вытеснять.
+
+База общая для всех реплик бота (webhook): у колоды и у прогресса
+ученика по колоде есть версии, кэш в памяти сверяется с ними при каждом
+обращении, а ответ записывается, только если прогресс не изменился на
+другой реплике.
+
+Загрузка колоды:
+
+    python flashcards.py import terms.tsv --name terms --title "Термины"
+"""
+import argparse
+import asyncio
+import heapq
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Оценки ответа
+AGAIN, HARD, GOOD, EASY = range(4)
+GRADE_NAMES = {AGAIN: 'Не помню', HARD: 'Трудно', GOOD: 'Помню', EASY: 'Легко'}
+
+DAY = 86400
+# Интервалы: повтор забытой карточки, первые повторения, границы коэффициента
+RELEARN_INTERVAL = 60
+FIRST_INTERVALS = {HARD: 600, GOOD: DAY, EASY: 4 * DAY}
+SECOND_INTERVAL = 6 * DAY
+START_EASE = 2.5
+MIN_EASE = 1.3
+# Сколько раз повторять запись ответа, если прогресс изменили на другой реплике
+ANSWER_ATTEMPTS = 3
+
+
+class Deck:
+    """Колода в памяти: вопросы и ответы по номерам карточек"""
+
+    __slots__ = ('name', 'title', 'fronts', 'backs', 'version')
+
+    def __init__(self, name, title, fronts, backs, version=0):
+        self.name = name
+        self.title = title
+        self.fronts = fronts
+        self.backs = backs
+        self.version = version
+
+    def __len__(self):
+        return len(self.fronts)
+
+
+class CardState:
+    """Состояние карточки у ученика"""
+
+    __slots__ = ('card', 'due', 'interval', 'ease', 'reps', 'lapses', 'added')
+
+    def __init__(self, card, due, interval=0, ease=START_EASE, reps=0, lapses=0, added=0):
+        self.card = card
+        self.due = due
+        self.interval = interval
+        self.ease = ease
+        self.reps = reps
+        self.lapses = lapses
+        self.added = added
+
+    def row(self):
+        return (self.card, self.due, self.interval, self.ease, self.reps, self.lapses, self.added)
+
+
+def schedule(state, grade, now):
+    """Новый интервал после ответа (упрощенный SM-2)"""
+    if grade == AGAIN:
+        state.reps = 0
+        state.lapses += 1
+        state.interval = RELEARN_INTERVAL
+        state.ease = max(MIN_EASE, state.ease - 0.2)
+    else:
+        if state.reps == 0:
+            state.interval = FIRST_INTERVALS[grade]
+        elif state.reps == 1:
+            state.interval = SECOND_INTERVAL
+        else:
+            state.interval = int(state.interval * (1.2 if grade == HARD else state.ease))
+        if grade == HARD:
+            state.ease = max(MIN_EASE, state.ease - 0.15)
+        elif grade == EASY:
+            state.ease += 0.15
+            state.interval = int(state.interval * 1.3)
+        state.reps += 1
+    state.due = now + state.interval
+
+
+class StudySession:
+    """Очередь карточек одного ученика по одной колоде.
+
+    В куче могут оставаться устаревшие записи (время не совпадает с
+    состоянием карточки): они пропускаются при чтении вершины.
+    """
+
+    __slots__ = ('deck', 'states', 'heap', 'next_new', 'day', 'new_today', 'version')
+
+    def __init__(self, deck, states, now, version=0):
+        self.deck = deck
+        # Ответы на карточки, которых уже нет в укороченной колоде, не учитываются
+        self.states = {card: state for card, state in states.items() if card < len(deck)}  # номер -> CardState
+        self.version = version  # версия прогресса в базе
+        self._rebuild()
+        self.next_new = 0
+        self._skip_seen()
+        self.day = int(now // DAY)
+        self.new_today = sum(1 for state in self.states.values() if state.added == self.day)
+
+    def _rebuild(self):
+        self.heap = [(state.due, state.card) for state in self.states.values()]
+        heapq.heapify(self.heap)
+
+    def _top(self):
+        """Актуальная вершина кучи (время, карточка) или None"""
+        heap = self.heap
+        while heap and self.states[heap[0][1]].due != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def _skip_seen(self):
+        while self.next_new < len(self.deck) and self.next_new in self.states:
+            self.next_new += 1
+
+    def next_card(self, now, new_per_day):
+        """Номер карточки для показа или None, если на сейчас все повторено"""
+        top = self._top()
+        if top is not None and top[0] <= now:
+            return top[1]
+        day = int(now // DAY)
+        if day != self.day:
+            self.day = day
+            self.new_today = 0
+        if self.next_new < len(self.deck) and self.new_today < new_per_day:
+            return self.next_new
+        return None
+
+    def next_due(self):
+        """Время ближайшего повторения или None"""
+        top = self._top()
+        return top[0] if top is not None else None
+
+    def can_answer(self, card, now):
+        """Можно ли оценить показанную карточку: новая или уже подошло время повторения.
+
+        Иначе на нее уже ответили (повторное нажатие старой кнопки).
+        """
+        state = self.states.get(card)
+        if state is None:
+            return 0 <= card < len(self.deck)
+        return state.due <= now
+
+    def answer(self, card, grade, now):
+        """Учет ответа на карточку (проверенную can_answer); возвращает ее состояние.
+
+        Карточка не обязательно на вершине кучи: пока ученик вспоминал
+        ответ, время повторения могло подойти и у других карточек.
+        """
+        state = self.states.get(card)
+        if state is None:
+            state = self.states[card] = CardState(card, now, added=int(now // DAY))
+            self.new_today += 1
+            self._skip_seen()
+        schedule(state, grade, now)
+        # Старая запись карточки в куче становится устаревшей
+        heapq.heappush(self.heap, (state.due, card))
+        if len(self.heap) > 2 * len(self.states):
+            self._rebuild()
+        return state
+
+    @property
+    def learned(self):
+        return len(self.states)
+
+
+def read_deck_file(path):
+    """Чтение колоды из TSV: (название, [(вопрос, ответ), ...]).
+
+    Название - из строки "# title: ..." или по имени файла.
+    """
+    title = os.path.splitext(os.path.basename(path))[0]
+    cards = []
+    with open(path, encoding='utf-8') as deck_file:
+        for line_number, line in enumerate(deck_file, 1):
+            line = line.rstrip('\n')
+            if line.startswith('#'):
+                key, _, value = line[1:].partition(':')
+                if key.strip() == 'title' and value.strip():
+                    title = value.strip()
+                continue
+            if not line.strip():
+                continue
+            front, sep, back = line.partition('\t')
+            if not sep or not front.strip() or not back.strip():
+                raise ValueError(f"{path}:{line_number}: ожидается 'вопрос<TAB>ответ'")
+            cards.append((front.strip(), back.strip().replace('\\n', '\n')))
+    return title, cards
+
+
+class DeckStore:
+    """Колоды и история ответов в SQLite. Методы вызываются из одного потока"""
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+
+    @property
+    def connection(self):
+        # Файл создается при первом обращении, а не при запуске бота
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(
+                'CREATE TABLE IF NOT EXISTS decks ('
+                '  name TEXT PRIMARY KEY, title TEXT NOT NULL, size INTEGER NOT NULL,'
+                '  source_mtime REAL NOT NULL DEFAULT 0, version INTEGER NOT NULL DEFAULT 1);'
+                'CREATE TABLE IF NOT EXISTS cards ('
+                '  deck TEXT NOT NULL, position INTEGER NOT NULL, front TEXT NOT NULL, back TEXT NOT NULL,'
+                '  PRIMARY KEY (deck, position)) WITHOUT ROWID;'
+                'CREATE TABLE IF NOT EXISTS reviews ('
+                '  user_id INTEGER NOT NULL, deck TEXT NOT NULL, card INTEGER NOT NULL,'
+                '  due REAL NOT NULL, interval INTEGER NOT NULL, ease REAL NOT NULL,'
+                '  reps INTEGER NOT NULL, lapses INTEGER NOT NULL, added INTEGER NOT NULL,'
+                '  PRIMARY KEY (user_id, deck, card)) WITHOUT ROWID;'
+                'CREATE TABLE IF NOT EXISTS progress ('
+                '  user_id INTEGER NOT NULL, deck TEXT NOT NULL, version INTEGER NOT NULL,'
+                '  PRIMARY KEY (user_id, deck)) WITHOUT ROWID;'
+            )
+            self._connection = connection
+        return self._connection
+
+    def import_deck(self, name, title, cards, source_mtime=0):
+        """Замена колоды одной транзакцией.
+
+        История ответов привязана к номерам карточек, поэтому новые
+        карточки нужно добавлять в конец файла. Ответы на карточки,
+        которых больше нет, удаляются.
+        """
+        with self.connection as connection:
+            connection.execute('DELETE FROM cards WHERE deck = ?', (name,))
+            connection.executemany(
+                'INSERT INTO cards (deck, position, front, back) VALUES (?, ?, ?, ?)',
+                ((name, position, front, back) for position, (front, back) in enumerate(cards))
+            )
+            connection.execute('DELETE FROM reviews WHERE deck = ? AND card >= ?', (name, len(cards)))
+            connection.execute(
+                'INSERT INTO decks (name, title, size, source_mtime) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET title = excluded.title, size = excluded.size, '
+                'source_mtime = excluded.source_mtime, version = decks.version + 1',
+                (name, title, len(cards), source_mtime)
+            )
+
+    def list_decks(self):
+        """[(имя, название, число карточек, время изменения исходника)]"""
+        return self.connection.execute(
+            'SELECT name, title, size, source_mtime FROM decks ORDER BY name'
+        ).fetchall()
+
+    def deck_version(self, name):
+        row = self.connection.execute('SELECT version FROM decks WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def versions(self, user_id, deck):
+        """(версия колоды, версия прогресса ученика по ней) или None, если колоды нет"""
+        row = self.connection.execute(
+            'SELECT version, (SELECT version FROM progress WHERE user_id = ? AND deck = ?) '
+            'FROM decks WHERE name = ?', (user_id, deck, deck)
+        ).fetchone()
+        return None if row is None else (row[0], row[1] or 0)
+
+    def load_deck(self, name):
+        row = self.connection.execute('SELECT title, version FROM decks WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        cards = self.connection.execute(
+            'SELECT front, back FROM cards WHERE deck = ? ORDER BY position', (name,)
+        ).fetchall()
+        return Deck(name, row[0], [card[0] for card in cards], [card[1] for card in cards], row[1])
+
+    def load_states(self, user_id, deck):
+        rows = self.connection.execute(
+            'SELECT card, due, interval, ease, reps, lapses, added FROM reviews '
+            'WHERE user_id = ? AND deck = ?', (user_id, deck)
+        )
+        return {row[0]: CardState(*row) for row in rows}
+
+    def save_state(self, user_id, deck, state, version):
+        """Запись ответа, если версия прогресса в базе все еще version; иначе False"""
+        with self.connection as connection:
+            if version:
+                cursor = connection.execute(
+                    'UPDATE progress SET version = version + 1 WHERE user_id = ? AND deck = ? AND version = ?',
+                    (user_id, deck, version)
+                )
+            else:
+                cursor = connection.execute(
+                    'INSERT OR IGNORE INTO progress (user_id, deck, version) VALUES (?, ?, 1)', (user_id, deck)
+                )
+            if not cursor.rowcount:
+                return False
+            connection.execute(
+                'INSERT OR REPLACE INTO reviews (user_id, deck, card, due, interval, ease, reps, lapses, added) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (user_id, deck) + state.row()
+            )
+        return True
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def deck_dir():
+    return config.FLASHCARDS_DECK_DIR or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'decks')
+
+
+def sync_deck_files(store, directory):
+    """Загрузка в базу файлов колод, которые новее загруженных; возвращает их имена"""
+    if not os.path.isdir(directory):
+        return []
+    loaded = {name: mtime for name, _, _, mtime in store.list_decks()}
+    imported = []
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith('.tsv'):
+            continue
+        path = os.path.join(directory, file_name)
+        name = file_name[:-4]
+        mtime = os.path.getmtime(path)
+        if loaded.get(name, -1) >= mtime:
+            continue
+        title, cards = read_deck_file(path)
+        store.import_deck(name, title, cards, mtime)
+        imported.append(name)
+        logger.info(f"Колода {name} загружена: {len(cards)} карточек")
+    return imported
+
+
+class FlashcardEngine:
+    """Карточки для бота: колоды и сессии учеников в памяти, запись в базу в отдельном потоке.
+
+    Методы-корутины вызываются из цикла событий; сессии меняются только
+    в нем, а база - только в потоке хранилища. Перед использованием
+    колода и сессия сверяются с версиями в базе: их могла изменить
+    загрузка колоды или ответ ученика на другой реплике.
+    """
+
+    def __init__(self, store, directory=None, new_per_day=20, max_sessions=10000):
+        self.store = store
+        self.directory = directory
+        self.new_per_day = new_per_day
+        self.max_sessions = max_sessions
+        self._decks = {}
+        self._sessions = OrderedDict()  # (user_id, колода) -> StudySession
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='flashcards')
+        self._sync_lock = threading.Lock()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _sync(self):
+        with self._sync_lock:
+            if self.directory:
+                sync_deck_files(self.store, self.directory)
+            return self.store.list_decks()
+
+    async def decks(self):
+        """[(имя, название, число карточек)] доступных колод (с загрузкой измененных файлов)"""
+        return [row[:3] for row in await self._run(self._sync)]
+
+    async def _deck(self, name, version):
+        deck = self._decks.get(name)
+        if deck is None or deck.version != version:
+            deck = await self._run(self.store.load_deck, name)
+            if deck is None:
+                self._decks.pop(name, None)
+                return None
+            self._decks[name] = deck
+        return deck
+
+    async def deck(self, name):
+        version = await self._run(self.store.deck_version, name)
+        if version is None:
+            return None
+        return await self._deck(name, version)
+
+    async def session(self, user_id, deck_name, now=None):
+        """Сессия ученика (загружается из базы, если ее там изменили) или None"""
+        key = (user_id, deck_name)
+        versions = await self._run(self.store.versions, user_id, deck_name)
+        if versions is None:
+            self._sessions.pop(key, None)
+            return None
+        deck_version, version = versions
+        session = self._sessions.get(key)
+        if session is not None and session.version == version and session.deck.version == deck_version:
+            self._sessions.move_to_end(key)
+            return session
+        deck = await self._deck(deck_name, deck_version)
+        if deck is None:
+            return None
+        # Версия прочитана раньше ответов: если их успели изменить, сессия
+        # перечитается при следующем обращении
+        states = await self._run(self.store.load_states, user_id, deck_name)
+        # Пока шла загрузка, другой запрос мог загрузить сессию не старее этой
+        session = self._sessions.get(key)
+        if session is None or (session.deck.version, session.version) < (deck.version, version):
+            session = self._sessions[key] = StudySession(deck, states, time.time() if now is None else now, version)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(key)
+        return session
+
+    async def next_card(self, user_id, deck_name, now=None):
+        """(сессия, номер карточки или None); сессия None - колоды нет"""
+        session = await self.session(user_id, deck_name, now)
+        if session is None:
+            return None, None
+        return session, session.next_card(time.time() if now is None else now, self.new_per_day)
+
+    async def answer(self, user_id, deck_name, card, grade, now=None):
+        """Учет ответа на показанную карточку и запись в базу, возвращает CardState.
+
+        None - на карточку уже ответили (повторное нажатие старой кнопки,
+        в том числе на другой реплике) или оценка неизвестна.
+        """
+        if grade not in GRADE_NAMES:
+            return None
+        now = time.time() if now is None else now
+        key = (user_id, deck_name)
+        for _ in range(ANSWER_ATTEMPTS):
+            session = await self.session(user_id, deck_name, now)
+            if session is None or not session.can_answer(card, now):
+                return None
+            state = session.answer(card, grade, now)
+            # Версия увеличивается сразу: следующий запрос не перечитает сессию зря
+            version = session.version
+            session.version += 1
+            saved = False
+            try:
+                saved = await self._run(self.store.save_state, user_id, deck_name, state, version)
+            finally:
+                # Ответ не записан: сессия в памяти уже не совпадает с базой
+                if not saved and self._sessions.get(key) is session:
+                    del self._sessions[key]
+            if saved:
+                return state
+        logger.warning(f"Ответ ученика {user_id} по колоде {deck_name} не записан: прогресс меняется на другой реплике")
+        return None
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.store.close()
+
+
+def create_engine():
+    return FlashcardEngine(
+        DeckStore(config.FLASHCARDS_DB_PATH), deck_dir(),
+        new_per_day=config.FLASHCARDS_NEW_PER_DAY, max_sessions=config.FLASHCARDS_SESSIONS
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Загрузка колод карточек")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help="загрузить колоду из TSV (вопрос<TAB>ответ)")
+    import_parser.add_argument('path')
+    import_parser.add_argument('--name', help="имя колоды (по умолчанию - имя файла)")
+    import_parser.add_argument('--title', help="название для меню")
+    subparsers.add_parser('sync', help="загрузить новые и измененные файлы из каталога колод")
+    subparsers.add_parser('list', help="список колод")
+    parser.add_argument('--db', default=config.FLASHCARDS_DB_PATH)
+    args = parser.parse_args(argv)
+
+    store = DeckStore(args.db)
+    try:
+        if args.command == 'import':
+            title, cards = read_deck_file(args.path)
+            name = args.name or os.path.splitext(os.path.basename(args.path))[0]
+            store.import_deck(name, args.title or title, cards)
+            print(f"{name}: {len(cards)} карточек")
+        elif args.command == 'sync':
+            print(', '.join(sync_deck_files(store, deck_dir())) or "изменений нет")
+        for name, title, size, _ in store.list_decks():
+            print(f"{name:<20} {size:>6}  {title}")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""Кодирование отрисованного холста matplotlib в компактное изображение.
+
+Форматы:
+    png   - PNG с палитрой до 256 цветов (графики почти без потерь, в 3-5 раз меньше)
+    png24 - полноцветный PNG, как раньше
+    webp  - WebP с потерями, самый компактный
+    jpeg  - JPEG, самый совместимый
+
+Холст кодируется прямо из буфера Agg: Image.frombuffer не копирует
+пиксели, копию создает только сам кодер (и квантование для png).
+"""
+from io import BytesIO
+
+from PIL import Image
+
+FORMATS = {
+    'png': ('png', 'image/png'),
+    'png24': ('png', 'image/png'),
+    'webp': ('webp', 'image/webp'),
+    'jpeg': ('jpg', 'image/jpeg'),
+}
+
+
+def _quantize(image):
+    """Палитра до 256 цветов без альфа-канала (фигура непрозрачна)"""
+    quantized = image.quantize(256, method=Image.Quantize.FASTOCTREE)
+    palette = quantized.getpalette('RGBA')
+    rgb = []
+    for i in range(0, len(palette), 4):
+        color = palette[i:i + 3]
+        # Квантование усредняет белый фон до 254, возвращаем чистый белый
+        rgb.extend((255, 255, 255) if min(color) >= 252 else color)
+    quantized.putpalette(rgb, 'RGB')
+    return quantized
+
+
+class ImageEncoder:
+    """Кодер изображений с ограничением размера.
+
+    max_bytes - бюджет на изображение (0 - без ограничения): если
+    результат больше, график перерисовывается с меньшим DPI, но не
+    ниже min_dpi.
+    """
+
+    def __init__(self, fmt='png', max_bytes=0, quality=85, min_dpi=72):
+        if fmt not in FORMATS:
+            raise ValueError(f"Неизвестный формат изображения: {fmt}")
+        self.format = fmt
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.min_dpi = min_dpi
+
+    @property
+    def extension(self):
+        return FORMATS[self.format][0]
+
+    @property
+    def mime_type(self):
+        return FORMATS[self.format][1]
+
+    def fits(self, size):
+        return not self.max_bytes or size <= self.max_bytes
+
+    def next_dpi(self, dpi, size):
+        """DPI для следующей попытки: площадь изображения пропорциональна DPI²"""
+        scale = (self.max_bytes / size) ** 0.5 * 0.95
+        return max(self.min_dpi, min(dpi - 1, int(dpi * scale)))
+
+    def encode(self, canvas):
+        """Кодирование отрисованного FigureCanvasAgg, возвращает байты"""
+        width, height = canvas.get_width_height(physical=True)
+        buffer = BytesIO()
+        if self.format == 'jpeg':
+            # RGBX читается из буфера без копии, JPEG-кодер просто пропускает 4-й байт
+            image = Image.frombuffer('RGBX', (width, height), canvas.buffer_rgba(), 'raw', 'RGBX', 0, 1)
+            image.save(buffer, format='JPEG', quality=self.quality, optimize=True)
+        elif self.format == 'webp':
+            image = Image.frombuffer('RGBA', (width, height), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+            image.save(buffer, format='WEBP', quality=self.quality, method=4)
+        elif self.format == 'png':
+            image = Image.frombuffer('RGBA', (width, height), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+            _quantize(image).save(buffer, format='PNG')
+        else:
+            image = Image.frombuffer('RGBA', (width, height), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+            image.save(buffer, format='PNG')
+        return buffer.getvalue()
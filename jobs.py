@@ -0,0 +1,157 @@
+"""Планировщик тяжелых задач (синтез речи, построение графиков).
+
+Ограничивает число одновременно выполняемых задач в целом и для
+каждого пользователя. Задачи сверх лимита ждут в ограниченной очереди
+(по порядку поступления), а при заполненной очереди сразу
+отклоняются, чтобы не копить запросы, которые все равно не успеют
+выполниться.
+"""
+import asyncio
+import logging
+from collections import defaultdict, deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Задача отклонена: очередь заполнена или у пользователя слишком много задач"""
+
+    def __init__(self, user_limit=False):
+        super().__init__('user limit' if user_limit else 'queue full')
+        self.user_limit = user_limit
+
+
+class JobScheduler:
+    """Очередь задач с общим и пользовательским ограничением параллельности.
+
+    max_running - сколько задач выполняется одновременно,
+    max_queue - сколько задач может ждать,
+    user_running - сколько задач одного пользователя выполняется одновременно,
+    user_jobs - сколько задач одного пользователя может быть в работе и в очереди.
+    """
+
+    def __init__(self, name, max_running=4, max_queue=50, user_running=1, user_jobs=2,
+                 position_interval=2.0):
+        self.name = name
+        self.max_running = max(1, max_running)
+        self.max_queue = max_queue
+        self.user_running = max(1, user_running)
+        self.user_jobs = max(1, user_jobs)
+        # Как часто можно обновлять позицию в очереди (ограничения Telegram на правки)
+        self.position_interval = position_interval
+        self.running = 0
+        self.rejected = 0
+        self._waiting = deque()  # (user_id, future)
+        self._user_running = defaultdict(int)
+        self._user_jobs = defaultdict(int)
+
+    @property
+    def waiting(self):
+        return len(self._waiting)
+
+    def _can_start(self, user_id):
+        return self.running < self.max_running and self._user_running.get(user_id, 0) < self.user_running
+
+    def _start(self, user_id):
+        self.running += 1
+        self._user_running[user_id] += 1
+
+    def _finish(self, user_id):
+        self.running -= 1
+        self._user_running[user_id] -= 1
+        if not self._user_running[user_id]:
+            del self._user_running[user_id]
+        self._dispatch()
+
+    def _dispatch(self):
+        """Запуск ожидающих задач, для которых освободилось место"""
+        if self.running >= self.max_running:
+            return
+        for item in list(self._waiting):
+            user_id, future = item
+            if not self._can_start(user_id):
+                continue
+            self._waiting.remove(item)
+            if future.done():
+                continue
+            self._start(user_id)
+            future.set_result(True)
+            if self.running >= self.max_running:
+                break
+
+    def _position(self, future):
+        for position, (_, waiting_future) in enumerate(self._waiting, 1):
+            if waiting_future is future:
+                return position
+        return 0
+
+    async def _wait_turn(self, user_id, on_position):
+        future = asyncio.get_running_loop().create_future()
+        item = (user_id, future)
+        self._waiting.append(item)
+        shown = None
+        try:
+            while not future.done():
+                position = self._position(future)
+                if on_position is not None and position != shown:
+                    shown = position
+                    await self._notify(on_position, position)
+                if future.done():
+                    break
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), self.position_interval)
+                except asyncio.TimeoutError:
+                    pass
+            if shown is not None:
+                await self._notify(on_position, 0)
+        except BaseException:
+            # Отмена во время ожидания: убираем из очереди или освобождаем выданное место
+            if item in self._waiting:
+                self._waiting.remove(item)
+            elif future.done() and not future.cancelled():
+                self._finish(user_id)
+            future.cancel()
+            raise
+
+    @staticmethod
+    async def _notify(on_position, position):
+        try:
+            await on_position(position)
+        except Exception as e:
+            logger.debug(f"Не удалось показать позицию в очереди: {e}")
+
+    async def submit(self, user_id, job, on_position=None):
+        """Выполнение задачи job() в порядке очереди.
+
+        on_position(position) вызывается, пока задача ждет: position -
+        номер в очереди, 0 - задача запущена. Если места нет, сразу
+        выбрасывается QueueFull.
+        """
+        if self._user_jobs.get(user_id, 0) >= self.user_jobs:
+            self.rejected += 1
+            metrics.JOBS_REJECTED.inc(self.name, 'user')
+            raise QueueFull(user_limit=True)
+        # Все ожидающие задачи ждут из-за лимитов, поэтому свободное место можно занять сразу
+        start_now = self._can_start(user_id)
+        if not start_now and len(self._waiting) >= self.max_queue:
+            self.rejected += 1
+            metrics.JOBS_REJECTED.inc(self.name, 'queue')
+            logger.warning(f"Очередь {self.name} заполнена ({len(self._waiting)}), задача отклонена")
+            raise QueueFull()
+
+        self._user_jobs[user_id] += 1
+        try:
+            if start_now:
+                self._start(user_id)
+            else:
+                await self._wait_turn(user_id, on_position)
+            try:
+                return await job()
+            finally:
+                self._finish(user_id)
+        finally:
+            self._user_jobs[user_id] -= 1
+            if not self._user_jobs[user_id]:
+                del self._user_jobs[user_id]
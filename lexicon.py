@@ -0,0 +1,461 @@
+"""Офлайн-словарь словоформ: лемма и часть речи для ru/en/es/fr/de.
+
+Исходные словари лежат в lexicon/<язык>.txt, по строке на лемму:
+
+    лемма ЧАСТЬ_РЕЧИ форма1 форма2 ...
+
+Для работы они компилируются в индекс lexicon/<язык>.lex: отсортированные
+формы и ссылки на леммы в одном файле, который открывается через mmap.
+Индекс не разбирается при загрузке (открытие занимает миллисекунды), а
+страницы файла общие для всех процессов, которые его открыли (воркеры
+пакетного анализа, реплики бота). Поиск формы - двоичный поиск по
+отсортированным ключам.
+
+В заголовке индекса записан отпечаток исходного словаря: индекс
+пересобирается автоматически, только если содержимое исходника изменилось
+(время изменения файла, которое меняет git pull, не учитывается).
+Полный словарь (например, выгрузку UniMorph) можно добавить при сборке:
+
+    python lexicon.py build --unimorph ru=rus.tsv
+
+Такой индекс автоматически не пересобирается: без внешних словарей он
+стал бы беднее. Индексы можно хранить отдельно от исходников
+(LEXICON_INDEX_DIR), например, если каталог с кодом только для чтения.
+
+Слова, которых нет в словаре, разбираются по окончаниям (guess_pos, stem).
+"""
+import argparse
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+import config
+
+logger = logging.getLogger(__name__)
+
+LANGUAGES = ('ru', 'en', 'es', 'fr', 'de')
+LANGUAGE_NAMES = {
+    'ru': 'русский', 'en': 'английский', 'es': 'испанский', 'fr': 'французский', 'de': 'немецкий',
+}
+
+# Части речи (коды в индексе - позиции в списке)
+POS_TAGS = ['X', 'NOUN', 'VERB', 'ADJ', 'ADV', 'PRON', 'DET', 'ADP', 'CONJ', 'PART', 'NUM', 'INTJ', 'AUX']
+# Служебные слова не попадают в частотный анализ
+FUNCTION_POS = frozenset(['PRON', 'DET', 'ADP', 'CONJ', 'PART', 'INTJ', 'AUX'])
+
+_MAGIC = b'LEX2'
+# Заголовок: сигнатура, число форм, число лемм, размеры блоков ключей и лемм,
+# флаги и отпечаток исходного словаря, из которого собран индекс
+_HEADER = struct.Struct('<4sIIIII16s')
+# Флаг индекса: добавлены внешние словари (UniMorph)
+FLAG_EXTERNAL = 1
+# Сколько самых частых слов текста смотреть при определении языка
+DETECT_SAMPLE = 200
+
+Entry = namedtuple('Entry', ['lemma', 'pos'])
+
+
+def _align(size):
+    return -size % 4
+
+
+def source_digest(path):
+    """Отпечаток содержимого исходного словаря"""
+    with open(path, 'rb') as source:
+        return hashlib.blake2b(source.read(), digest_size=16).digest()
+
+
+def build_index(entries, path, flags=0, digest=b''):
+    """Запись индекса: entries - словарь {форма: (лемма, часть речи)}.
+
+    flags и digest (отпечаток исходника) записываются в заголовок.
+    """
+    forms = sorted(entries, key=lambda form: form.encode('utf-8'))
+    lemma_ids = {}
+    for form in forms:
+        lemma_ids.setdefault(entries[form][0], len(lemma_ids))
+
+    keys = [form.encode('utf-8') for form in forms]
+    lemmas = [lemma.encode('utf-8') for lemma in lemma_ids]
+    key_offsets = np.cumsum([0] + [len(key) for key in keys], dtype=np.uint32)
+    lemma_offsets = np.cumsum([0] + [len(lemma) for lemma in lemmas], dtype=np.uint32)
+    key_blob = b''.join(keys)
+    lemma_blob = b''.join(lemmas)
+
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(_HEADER.pack(
+                _MAGIC, len(forms), len(lemmas), len(key_blob), len(lemma_blob), flags, digest
+            ))
+            out.write(key_offsets.tobytes())
+            out.write(key_blob + b'\0' * _align(len(key_blob)))
+            out.write(np.array([lemma_ids[entries[form][0]] for form in forms], dtype=np.uint32).tobytes())
+            out.write(lemma_offsets.tobytes())
+            out.write(lemma_blob + b'\0' * _align(len(lemma_blob)))
+            out.write(np.array([POS_TAGS.index(entries[form][1]) for form in forms], dtype=np.uint8).tobytes())
+        # Процессы, открывшие старый индекс, дочитывают его, новые видят новый
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_source(path, entries=None):
+    """Разбор исходного словаря; при повторах формы остается первая запись"""
+    entries = {} if entries is None else entries
+    with open(path, encoding='utf-8') as source:
+        for line_number, line in enumerate(source, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) < 2 or fields[1] not in POS_TAGS:
+                raise ValueError(f"{path}:{line_number}: ожидается 'лемма ЧАСТЬ_РЕЧИ формы...'")
+            lemma, pos = fields[0].lower(), fields[1]
+            for form in [lemma] + fields[2:]:
+                entries.setdefault(form.lower(), (lemma, pos))
+    return entries
+
+
+# Первый тег признаков UniMorph -> часть речи
+_UNIMORPH_POS = {
+    'N': 'NOUN', 'PROPN': 'NOUN', 'V': 'VERB', 'V.PTCP': 'VERB', 'V.CVB': 'VERB', 'V.MSDR': 'NOUN',
+    'ADJ': 'ADJ', 'ADV': 'ADV', 'PRO': 'PRON', 'DET': 'DET', 'ART': 'DET', 'ADP': 'ADP',
+    'CONJ': 'CONJ', 'PART': 'PART', 'NUM': 'NUM', 'INTJ': 'INTJ', 'AUX': 'AUX',
+}
+
+
+def read_unimorph(path, entries=None):
+    """Разбор выгрузки UniMorph (лемма, форма, признаки через табуляцию)"""
+    entries = {} if entries is None else entries
+    with open(path, encoding='utf-8') as source:
+        for line in source:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 3 or ' ' in fields[1]:
+                continue
+            pos = _UNIMORPH_POS.get(fields[2].split(';', 1)[0])
+            if pos is None:
+                continue
+            lemma = fields[0].lower()
+            entries.setdefault(fields[1].lower(), (lemma, pos))
+            entries.setdefault(lemma, (lemma, pos))
+    return entries
+
+
+class Lexicon:
+    """Словарь одного языка поверх индекса в памяти (mmap)"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as index_file:
+            self._mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header = _HEADER.unpack_from(self._mmap)
+        except struct.error:
+            header = (b'',) + (0,) * 6
+        magic, self.size, lemma_count, keys_size, lemmas_size, self.flags, self.source_digest = header
+        if magic != _MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path}: не индекс словаря или старый формат")
+
+        # Массивы - представления поверх mmap, без копирования
+        # (memoryview быстрее numpy при поштучном чтении в двоичном поиске)
+        view = memoryview(self._mmap)
+        offset = _HEADER.size
+        self._key_offsets = view[offset:offset + 4 * (self.size + 1)].cast('I')
+        offset += 4 * (self.size + 1)
+        self._keys_start = offset
+        offset += keys_size + _align(keys_size)
+        self._lemma_ids = view[offset:offset + 4 * self.size].cast('I')
+        offset += 4 * self.size
+        self._lemma_offsets = view[offset:offset + 4 * (lemma_count + 1)].cast('I')
+        offset += 4 * (lemma_count + 1)
+        self._lemmas_start = offset
+        offset += lemmas_size + _align(lemmas_size)
+        self._pos = view[offset:offset + self.size]
+
+    def _key(self, i):
+        start = self._keys_start
+        return self._mmap[start + self._key_offsets[i]:start + self._key_offsets[i + 1]]
+
+    def _lemma(self, lemma_id):
+        start = self._lemmas_start
+        return self._mmap[start + self._lemma_offsets[lemma_id]:
+                          start + self._lemma_offsets[lemma_id + 1]].decode('utf-8')
+
+    def lookup(self, form):
+        """Entry(лемма, часть речи) для формы в нижнем регистре или None"""
+        key = form.encode('utf-8')
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.size and self._key(low) == key:
+            return Entry(self._lemma(self._lemma_ids[low]), POS_TAGS[self._pos[low]])
+        return None
+
+    def __len__(self):
+        return self.size
+
+
+def lexicon_dir():
+    return config.LEXICON_DIR or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lexicon')
+
+
+def index_dir():
+    return config.LEXICON_INDEX_DIR or lexicon_dir()
+
+
+def _load(lang):
+    """Открытие индекса языка; пересборка, если его нет или изменился исходник"""
+    source_path = os.path.join(lexicon_dir(), f'{lang}.txt')
+    index_path = os.path.join(index_dir(), f'{lang}.lex')
+    lexicon = None
+    try:
+        lexicon = Lexicon(index_path)
+    except FileNotFoundError:
+        pass
+    except ValueError as e:
+        logger.warning(f"{e}, пересобираю")
+
+    if lexicon is not None:
+        if not os.path.exists(source_path) or lexicon.source_digest == source_digest(source_path):
+            return lexicon
+        if lexicon.flags & FLAG_EXTERNAL:
+            logger.warning(
+                f"Словарь {source_path} изменился, но индекс {index_path} собран с внешними "
+                f"словарями: пересоберите его командой python lexicon.py build --unimorph ..."
+            )
+            return lexicon
+
+    try:
+        build_index(read_source(source_path), index_path, digest=source_digest(source_path))
+    except OSError as e:
+        if lexicon is None:
+            raise
+        logger.warning(f"Не удалось пересобрать словарь {lang}, использую прежний индекс: {e}")
+        return lexicon
+    logger.info(f"Словарь {lang} собран: {index_path}")
+    return Lexicon(index_path)
+
+
+_lexicons = {}
+_lock = threading.Lock()
+
+
+def get_lexicon(lang):
+    """Словарь языка (индекс собирается из исходника, если его нет или исходник изменился)"""
+    lexicon = _lexicons.get(lang)
+    if lexicon is not None:
+        return lexicon
+    with _lock:
+        if lang not in _lexicons:
+            _lexicons[lang] = _load(lang)
+        return _lexicons[lang]
+
+
+# Разбор слов, которых нет в словаре: окончания проверяются по порядку
+_POS_SUFFIXES = {
+    'ru': [
+        ('NOUN', ('ние', 'ния', 'нию', 'нием', 'ниях', 'тие', 'тия', 'ость', 'ости', 'остью')),
+        ('VERB', ('ться', 'тся', 'ть', 'ти', 'чь', 'ешь', 'ете', 'ет', 'ют', 'ут', 'ят', 'ит',
+                  'ал', 'ала', 'ало', 'али', 'ил', 'ила', 'ило', 'или', 'ался', 'алась', 'ился', 'илась')),
+        ('ADJ', ('ый', 'ий', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ого', 'его', 'ому', 'ему',
+                 'ыми', 'ими', 'ых', 'их', 'ую', 'юю')),
+        ('ADV', ('ски', 'цки')),
+    ],
+    'en': [
+        ('ADV', ('ly',)),
+        ('VERB', ('ing', 'ed', 'ize', 'ise', 'ify')),
+        ('ADJ', ('ous', 'ful', 'able', 'ible', 'ive', 'ical', 'ic', 'less', 'ish', 'ary')),
+    ],
+    'es': [
+        ('ADV', ('mente',)),
+        ('NOUN', ('ción', 'ciones', 'dad', 'dades', 'miento', 'mientos')),
+        ('VERB', ('ar', 'er', 'ir', 'ando', 'iendo', 'aba', 'aban', 'aron', 'ieron', 'ó', 'ía', 'ían')),
+        ('ADJ', ('oso', 'osa', 'osos', 'osas', 'ivo', 'iva', 'able', 'ible', 'ico', 'ica')),
+    ],
+    'fr': [
+        ('ADV', ('ement', 'emment', 'amment')),
+        ('NOUN', ('tion', 'tions', 'ité', 'ités', 'eur', 'eurs')),
+        ('VERB', ('er', 'ir', 'ait', 'aient', 'ons', 'ez')),
+        ('ADJ', ('eux', 'euse', 'ique', 'iques', 'able', 'ible', 'if', 'ive')),
+    ],
+    'de': [
+        ('NOUN', ('ung', 'ungen', 'heit', 'keit', 'schaft', 'tion', 'chen', 'lein', 'nis', 'tum')),
+        ('VERB', ('ieren', 'iert')),
+        ('ADJ', ('ig', 'lich', 'isch', 'bar', 'sam', 'los', 'haft')),
+    ],
+}
+
+# Окончания для группировки форм одного слова (от длинных к коротким)
+_STEM_SUFFIXES = {
+    'ru': ('иями', 'ями', 'ами', 'ией', 'иях', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ться',
+           'ях', 'ах', 'ов', 'ев', 'ей', 'ой', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ым',
+           'им', 'ых', 'их', 'ую', 'юю', 'ам', 'ям', 'ом', 'ем', 'ию', 'ью', 'ия', 'ья', 'ть',
+           'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю', 'ь', 'й'),
+    'en': ('ing', 'ies', 'ed', 'es', 's'),
+    'es': ('amientos', 'imientos', 'amiento', 'imiento', 'aciones', 'ación', 'ando', 'iendo',
+           'ados', 'idos', 'adas', 'idas', 'ado', 'ido', 'ada', 'ida', 'ar', 'er', 'ir',
+           'as', 'es', 'os', 'a', 'o', 'e', 's'),
+    'fr': ('issements', 'issement', 'ations', 'ation', 'ements', 'ement', 'euses', 'euse',
+           'ées', 'és', 'ée', 'é', 'er', 'ir', 'es', 'e', 's', 'x'),
+    'de': ('ern', 'em', 'en', 'er', 'es', 'e', 's', 'n'),
+}
+MIN_STEM_LEN = 3
+
+
+def _by_length(suffixes):
+    """Окончания, сгруппированные по длине (от длинных к коротким) для проверки по множеству"""
+    groups = {}
+    for suffix in suffixes:
+        groups.setdefault(len(suffix), set()).add(suffix)
+    return sorted(groups.items(), reverse=True)
+
+
+_POS_RULES = {lang: [(pos, _by_length(suffixes)) for pos, suffixes in rules]
+              for lang, rules in _POS_SUFFIXES.items()}
+_STEM_RULES = {lang: _by_length(suffixes) for lang, suffixes in _STEM_SUFFIXES.items()}
+
+
+def guess_pos(form, lang):
+    """Часть речи слова не из словаря по окончанию (по умолчанию - существительное)"""
+    for pos, groups in _POS_RULES.get(lang, ()):
+        for length, suffixes in groups:
+            if len(form) - length >= 2 and form[-length:] in suffixes:
+                return pos
+    return 'NOUN'
+
+
+def stem(form, lang):
+    """Основа слова: отбрасывается самое длинное известное окончание"""
+    for length, suffixes in _STEM_RULES.get(lang, ()):
+        if len(form) - length >= MIN_STEM_LEN and form[-length:] in suffixes:
+            return form[:-length]
+    return form
+
+
+@lru_cache(maxsize=65536)
+def analyze_word(form, lang):
+    """Entry для формы: из словаря или по окончанию (лемма None - слова нет в словаре)"""
+    lexicon = get_lexicon(lang)
+    entry = lexicon.lookup(form)
+    if entry is None and lang == 'ru' and 'ё' in form:
+        entry = lexicon.lookup(form.replace('ё', 'е'))
+    if entry is not None:
+        return entry
+    return Entry(None, guess_pos(form, lang))
+
+
+def _is_cyrillic(word):
+    return 'Ѐ' <= word[0] <= 'ӿ'
+
+
+def detect_language(counts):
+    """Язык текста по самым частым словам: кириллица - русский,
+    для латиницы - язык, в словаре которого больше служебных слов текста"""
+    sample = counts.most_common(DETECT_SAMPLE)
+    cyrillic = sum(count for word, count in sample if _is_cyrillic(word))
+    if cyrillic * 2 >= sum(count for _, count in sample) and cyrillic:
+        return 'ru'
+    scores = Counter()
+    for lang in LANGUAGES[1:]:
+        lexicon = get_lexicon(lang)
+        for word, count in sample:
+            entry = lexicon.lookup(word)
+            if entry is not None and entry.pos in FUNCTION_POS:
+                scores[lang] += count
+    return scores.most_common(1)[0][0] if scores else 'en'
+
+
+LexicalStats = namedtuple('LexicalStats', ['language', 'lemmas', 'pos'])
+
+
+def lexical_stats(counts, content_counts, lang=None):
+    """Леммы и части речи текста.
+
+    counts - частоты всех форм (для частей речи), content_counts - частоты
+    форм для частотного анализа. Возвращает LexicalStats: язык, частоты
+    лемм без служебных слов и частоты частей речи.
+    Формы, которых нет в словаре, объединяются по основе и подписываются
+    самой частой формой; если основа совпадает с основой известной леммы
+    из текста, форма считается этой леммой.
+    """
+    lang = lang or detect_language(counts)
+    pos_counts = Counter()
+    for form, count in counts.items():
+        pos_counts[analyze_word(form, lang).pos] += count
+
+    lemmas = Counter()
+    unknown = {}  # основа -> Counter форм
+    for form, count in content_counts.items():
+        entry = analyze_word(form, lang)
+        if entry.pos in FUNCTION_POS:
+            continue
+        if entry.lemma is not None:
+            lemmas[entry.lemma] += count
+        else:
+            unknown.setdefault(stem(form, lang), Counter())[form] += count
+
+    known_stems = {stem(lemma, lang): lemma for lemma in lemmas}
+    for stem_key, forms in unknown.items():
+        lemma = known_stems.get(stem_key) or forms.most_common(1)[0][0]
+        lemmas[lemma] += sum(forms.values())
+
+    return LexicalStats(lang, lemmas, pos_counts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сборка индексов словаря")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="собрать индексы из lexicon/*.txt")
+    build_parser.add_argument('--lang', default=','.join(LANGUAGES), help="языки через запятую")
+    build_parser.add_argument('--unimorph', action='append', default=[], metavar='ЯЗЫК=ФАЙЛ',
+                              help="дополнительный словарь в формате UniMorph")
+    lookup_parser = subparsers.add_parser('lookup', help="разбор слов")
+    lookup_parser.add_argument('lang', choices=LANGUAGES)
+    lookup_parser.add_argument('words', nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'lookup':
+        for word in args.words:
+            entry = analyze_word(word.lower(), args.lang)
+            print(f"{word}\t{entry.lemma or '?'}\t{entry.pos}")
+        return 0
+
+    extra = {}
+    for item in args.unimorph:
+        lang, _, path = item.partition('=')
+        extra.setdefault(lang, []).append(path)
+    directory = lexicon_dir()
+    for lang in [lang for lang in args.lang.split(',') if lang]:
+        # Ручной словарь важнее: он читается первым
+        source_path = os.path.join(directory, f'{lang}.txt')
+        entries = read_source(source_path)
+        for path in extra.get(lang, []):
+            read_unimorph(path, entries)
+        index_path = os.path.join(index_dir(), f'{lang}.lex')
+        build_index(
+            entries, index_path, flags=FLAG_EXTERNAL if extra.get(lang) else 0,
+            digest=source_digest(source_path)
+        )
+        print(f"{lang}: {len(entries)} форм -> {index_path} ({os.path.getsize(index_path) // 1024} КБ)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
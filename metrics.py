@@ -0,0 +1,249 @@
+"""Метрики бота: счетчики и гистограммы задержек в формате Prometheus.
+
+Метрики собираются в памяти процесса и отдаются по HTTP:
+
+    curl http://127.0.0.1:9108/metrics
+
+Здесь же - выборочное структурированное логирование (sample_log):
+в лог попадает только доля событий, каждое - одной строкой key=value.
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, секунд
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def expose(self):
+        """Все метрики в текстовом формате Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def total(self):
+        """Сумма по всем значениям меток"""
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                for key, value in values]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}  # значения меток -> [счетчики корзин, сумма, количество]
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        """Замер времени блока кода"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return series[2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._series.items())
+        lines = []
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class CallbackGauge:
+    """Показатель, значение которого вычисляется при чтении метрик.
+
+    func возвращает словарь {значения меток: число}.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help, labels, func, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.func = func
+        registry.register(self)
+
+    def samples(self):
+        try:
+            values = sorted(self.func().items())
+        except Exception as e:
+            logger.warning(f"Ошибка чтения показателя {self.name}: {e}")
+            return []
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                for key, value in values]
+
+
+# Метрики бота
+
+CALLBACK_LATENCY = Histogram(
+    'bot_callback_duration_seconds', 'Время обработки нажатия кнопки', ['action']
+)
+STAGE_LATENCY = Histogram(
+    'bot_stage_duration_seconds',
+    'Время этапов: синтез речи, перекодирование в Opus, построение фигуры, кодирование PNG, загрузка в Telegram',
+    ['stage']
+)
+VIZ_REQUESTS = Counter('bot_viz_requests_total', 'Запросы инфографики по типам', ['viz_type'])
+CACHE_REQUESTS = Counter(
+    'bot_cache_requests_total', 'Обращения к кэшам (audio, file_id)', ['cache', 'result']
+)
+ERRORS = Counter('bot_errors_total', 'Ошибки по этапам', ['stage'])
+JOBS_REJECTED = Counter('bot_jobs_rejected_total', 'Задачи, отклоненные очередью', ['queue', 'reason'])
+UPDATES_DROPPED = Counter('bot_updates_dropped_total', 'Обновления, пропущенные из-за переполнения чата')
+TTS_REQUESTS = Counter(
+    'bot_tts_requests_total',
+    'Вызовы движков синтеза речи: ok, error, timeout, hedge, retry, skipped (выключатель разомкнут)',
+    ['backend', 'result']
+)
+TTS_BACKEND_LATENCY = Histogram(
+    'bot_tts_backend_duration_seconds', 'Время успешного вызова движка синтеза речи', ['backend']
+)
+COALESCED_REQUESTS = Counter(
+    'bot_coalesced_requests_total', 'Запросы, объединенные с уже выполняющимся таким же', ['operation']
+)
+
+
+@contextmanager
+def stage(name):
+    """Замер этапа обработки; при исключении считается ошибка этапа"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(name)
+        raise
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - started, name)
+
+
+def sample_log(event, rate, **fields):
+    """Запись события в лог с вероятностью rate (0..1) в виде key=value"""
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return
+    logger.info(' '.join([f'event={event}'] + [f'{key}={value}' for key, value in fields.items()]))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        payload = self.registry.expose().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_http_server(host, port):
+    """Запуск HTTP-сервера метрик в фоновом потоке, возвращает сервер"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Метрики: http://{host}:{server.server_port}/metrics")
+    return server
@@ -0,0 +1,92 @@
+"""Рендеринг графиков в пуле процессов.
+
+Построение фигур matplotlib и кодирование PNG выполняются в отдельных
+процессах, чтобы не блокировать цикл событий бота. Воркеры заранее
+импортируют matplotlib и создают шаблоны графиков (charts.py).
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _init_worker():
+    """Инициализация процесса-воркера: импорт matplotlib и создание шаблонов графиков"""
+    import charts
+    charts.warm_up()
+
+
+def _ping():
+    return True
+
+
+def render_chart(kind, data):
+    """Точка входа воркера: строит график, возвращает (PNG, время построения, время кодирования)"""
+    import charts
+    return charts.render_chart_timed(kind, data)
+
+
+class ChartRenderer:
+    """Пул процессов для построения графиков"""
+
+    def __init__(self, workers=2):
+        self.workers = max(1, workers)
+        self._executor = None
+        self._warmup = []
+
+    def start(self):
+        """Создание пула и прогрев всех воркеров"""
+        if self._executor is not None:
+            return
+        # spawn безопаснее fork для процесса с работающим циклом событий
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+        # Процессы создаются по требованию, поэтому запускаем их сразу
+        self._warmup = [self._executor.submit(_ping) for _ in range(self.workers)]
+        logger.info(f"Пул рендеринга запущен: {self.workers} процесс(ов)")
+
+    async def warm_up(self):
+        """Запуск пула и ожидание готовности всех воркеров"""
+        self.start()
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in self._warmup))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, kind, data):
+        """Асинхронный рендер графика, возвращает PNG в байтах"""
+        if self._executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            png, build_time, encode_time = await loop.run_in_executor(
+                executor, render_chart, kind, data
+            )
+        except BrokenProcessPool:
+            # Воркер упал (например, по памяти) - пересоздаем пул и пробуем еще раз.
+            # Пул пересоздает только первый из упавших рендеров, остальные
+            # повторяют попытку в уже новом пуле
+            if self._executor is executor:
+                logger.warning("Пул рендеринга поврежден, перезапускаю")
+                metrics.ERRORS.inc('render_pool')
+                self.shutdown()
+                self.start()
+            elif self._executor is None:
+                self.start()
+            png, build_time, encode_time = await loop.run_in_executor(
+                self._executor, render_chart, kind, data
+            )
+        metrics.STAGE_LATENCY.observe(build_time, 'figure_build')
+        metrics.STAGE_LATENCY.observe(encode_time, 'png_encode')
+        return png
@@ -0,0 +1,204 @@
+"""Данные графиков и подписи к ним по результатам анализа текста.
+
+Модуль не зависит от Telegram: те же отчеты используют обработчики
+бота и пакетный анализ корпуса (batch.py).
+"""
+from collections import namedtuple
+
+# Данные для рендера графика и текстовая подпись к нему
+Report = namedtuple('Report', ['data', 'caption'])
+
+# Максимум столбцов на графике структуры текста
+STRUCTURE_MAX_BARS = 50
+# С какого числа предложений показывать средние по группам вместо первых 15
+STRUCTURE_BINNED_SENTENCES = 1000
+# Сколько самых частых слов попадает в облако слов
+CLOUD_MAX_WORDS = 100
+# Группы частей речи на круговой диаграмме: подпись, теги, цвет
+POS_GROUPS = [
+    ('Существительные', ('NOUN',), '#66B2FF'),
+    ('Глаголы', ('VERB', 'AUX'), '#FF9999'),
+    ('Прилагательные', ('ADJ',), '#99FF99'),
+    ('Наречия', ('ADV',), '#FFCC99'),
+    ('Местоимения', ('PRON', 'DET'), '#C299FF'),
+    ('Служебные слова', ('ADP', 'CONJ', 'PART', 'INTJ'), '#FFD966'),
+    ('Числительные', ('NUM',), '#99E6E6'),
+]
+
+
+def frequency_report(analysis):
+    """Частотный анализ: топ-10 лемм без служебных слов. None, если слов недостаточно"""
+    top_words = analysis.top_lemmas(10)
+    if not top_words:
+        return None
+
+    freq_text = "📊 **Топ-5 самых частых слов:**\n"
+    for i, (word, count) in enumerate(top_words[:5], 1):
+        freq_text += f"{i}. **{word}** - {count} раз\n"
+    freq_text += (
+        f"\nВсего разных слов: {len(analysis.lexical.lemmas)} "
+        f"(формы одного слова считаются вместе, служебные слова не учитываются)"
+    )
+
+    return Report({
+        'words': [word[0] for word in top_words],
+        'counts': [word[1] for word in top_words],
+    }, freq_text)
+
+
+def statistics_report(analysis):
+    """Основная статистика текста"""
+    stats_text = (
+        f"📈 **Детальная статистика текста:**\n\n"
+        f"• 📝 **Символы:** {analysis.chars_total} (без пробелов: {analysis.chars_no_spaces})\n"
+        f"• 🔤 **Слова:** {analysis.word_count}\n"
+        f"• 📖 **Предложения:** {analysis.sentence_count}\n"
+        f"• 📑 **Абзацы:** {analysis.paragraph_count}\n"
+        f"• 📏 **Средняя длина слова:** {analysis.avg_word_len:.1f} симв.\n"
+        f"• 💬 **Слов в предложении:** {analysis.avg_sentence_len:.1f}"
+    )
+
+    return Report({
+        'chars_total': analysis.chars_total,
+        'chars_no_spaces': analysis.chars_no_spaces,
+        'word_count': analysis.word_count,
+        'sentence_count': analysis.sentence_count,
+        'paragraph_count': analysis.paragraph_count,
+        'avg_word_len': analysis.avg_word_len,
+        'avg_sentence_len': analysis.avg_sentence_len,
+        'word_length_hist': analysis.token_length_hist,
+    }, stats_text)
+
+
+def pie_report(analysis):
+    """Распределение слов по частям речи. None, если слов нет"""
+    # lexicon тянет за собой numpy: импорт только при построении отчета, не при запуске бота
+    from lexicon import LANGUAGE_NAMES
+
+    lexical = analysis.lexical
+    categories, sizes, colors = [], [], []
+    for label, tags, color in POS_GROUPS:
+        count = sum(lexical.pos[tag] for tag in tags)
+        if count:
+            categories.append(label)
+            sizes.append(count)
+            colors.append(color)
+
+    if not sizes:
+        return None
+
+    pie_text = "🎯 **Части речи:**\n\n"
+    for label, count in zip(categories, sizes):
+        pie_text += f"• {label}: {count}\n"
+    pie_text += (
+        f"• Всего слов: {sum(sizes)}\n"
+        f"• Язык текста: {LANGUAGE_NAMES.get(lexical.language, lexical.language)}"
+    )
+
+    return Report({
+        'sizes': sizes,
+        'categories': categories,
+        'colors': colors,
+        'title': 'Распределение слов по частям речи',
+    }, pie_text)
+
+
+def structure_report(analysis):
+    """Структура текста: длины абзацев и предложений"""
+    paragraphs = analysis.paragraph_lengths
+    sentences = analysis.sentence_lengths
+
+    data = {
+        'para_lengths': paragraphs.values(),
+        'para_title': 'Количество слов в абзацах',
+        'para_xlabel': 'Номер абзаца',
+        'sent_lengths': sentences.head,
+        'sent_title': 'Длина предложений (первые 15)',
+        'sent_xlabel': 'Номер предложения',
+    }
+    # В больших документах тысячи абзацев и предложений:
+    # вместо отдельных столбцов показываем средние по группам
+    if paragraphs.count > STRUCTURE_MAX_BARS:
+        values, group = paragraphs.binned(STRUCTURE_MAX_BARS)
+        data['para_lengths'] = values
+        data['para_title'] = f'Среднее количество слов в абзацах (группы по {group})'
+        data['para_xlabel'] = 'Номер группы абзацев'
+    if sentences.count > STRUCTURE_BINNED_SENTENCES:
+        values, group = sentences.binned(STRUCTURE_MAX_BARS)
+        data['sent_lengths'] = values
+        data['sent_title'] = f'Средняя длина предложений (группы по {group})'
+        data['sent_xlabel'] = 'Номер группы предложений'
+
+    structure_text = (
+        f"📋 **Структура текста:**\n\n"
+        f"• Абзацы: {paragraphs.count}\n"
+        f"• Предложения: {sentences.count}\n"
+        f"• Средняя длина абзаца: {analysis.avg_paragraph_words:.1f} слов\n"
+        f"• Средняя длина предложения: {analysis.avg_sentence_words:.1f} слов"
+    )
+
+    return Report(data, structure_text)
+
+
+def cloud_report(analysis):
+    """Облако слов по тем же частотам лемм, что и частотный анализ. None, если слов нет"""
+    top_words = analysis.top_lemmas(CLOUD_MAX_WORDS)
+    if not top_words:
+        return None
+
+    cloud_text = (
+        f"☁️ **Облако слов:**\n\n"
+        f"Чем чаще слово встречается в тексте, тем крупнее оно на картинке.\n"
+        f"• Самые частые: {', '.join(word for word, _ in top_words[:5])}\n"
+        f"• Всего разных слов: {len(analysis.lexical.lemmas)}"
+    )
+
+    return Report({'frequencies': dict(top_words)}, cloud_text)
+
+
+REPORTS = {
+    'freq': frequency_report,
+    'stats': statistics_report,
+    'pie': pie_report,
+    'structure': structure_report,
+    'cloud': cloud_report,
+}
+
+
+# Графики полного отчета (отправляются одним альбомом)
+FULL_REPORT = ['freq', 'stats', 'pie', 'structure']
+
+
+def build_report(viz_type, analysis):
+    """Отчет выбранного типа (None, если для него не хватает слов)"""
+    return REPORTS[viz_type](analysis)
+
+
+# Числовые метрики документа в порядке столбцов для CSV и агрегации
+METRIC_FIELDS = [
+    'chars_total', 'chars_no_spaces', 'words', 'sentences', 'paragraphs',
+    'avg_word_len', 'avg_sentence_len', 'avg_paragraph_words', 'avg_sentence_words',
+    'short_words', 'medium_words', 'long_words', 'unique_words',
+]
+
+
+def summarize(analysis, top_n=10):
+    """Все метрики документа в виде словаря (для JSON/CSV)"""
+    short_count, medium_count, long_count = analysis.length_buckets()
+    return {
+        'chars_total': analysis.chars_total,
+        'chars_no_spaces': analysis.chars_no_spaces,
+        'words': analysis.word_count,
+        'sentences': analysis.sentence_count,
+        'paragraphs': analysis.paragraph_count,
+        'avg_word_len': round(analysis.avg_word_len, 3),
+        'avg_sentence_len': round(analysis.avg_sentence_len, 3),
+        'avg_paragraph_words': round(analysis.avg_paragraph_words, 3),
+        'avg_sentence_words': round(analysis.avg_sentence_words, 3),
+        'short_words': short_count,
+        'medium_words': medium_count,
+        'long_words': long_count,
+        'unique_words': len(analysis.frequencies),
+        'language': analysis.language,
+        'top_words': analysis.top_lemmas(top_n),
+    }
@@ -0,0 +1,148 @@
+"""Объединение одинаковых одновременных запросов (single-flight).
+
+Кэши результатов помогают, только когда первый запрос уже выполнен.
+Если же 30 учеников одновременно отправят один и тот же текст, без
+объединения запустятся 30 одинаковых синтезов речи или построений
+графика. SingleFlight выполняет работу один раз, а повторные запросы с
+тем же ключом, пришедшие до ее завершения, ждут общий результат.
+
+Ключ занимается еще до постановки в очередь задач (claim): повторные
+запросы видят его, пока первый ждет своей очереди, и ждут результат
+без места в очереди (hold).
+"""
+import asyncio
+import contextvars
+import logging
+from contextlib import contextmanager
+from functools import partial
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ключи, занятые текущей задачей asyncio: (id группы, ключ) -> общий Future
+_claims = contextvars.ContextVar('singleflight_claims', default={})
+# Результат для ожидающих, если занявший ключ запрос так его и не вычислил
+_UNCLAIMED = object()
+
+
+class SingleFlight:
+    """Группа одновременно выполняемых задач с ключами.
+
+    Работа выполняется в отдельной задаче: если первый запрос отменят
+    (например, пользователь ушел), остальные все равно получат результат.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.coalesced = 0
+        self._calls = {}  # ключ -> asyncio.Task или Future занятого ключа
+        self._holds = {}  # ключ -> сколько запросов ждут результат вне очереди
+
+    @property
+    def in_flight(self):
+        return len(self._calls)
+
+    async def do(self, key, func):
+        """Результат func() для ключа key; одновременные вызовы выполняются один раз"""
+        claimed = _claims.get().get((id(self), key))
+        if claimed is not None and not claimed.done():
+            # Ключ занят этим запросом: вычисляем результат для всех, кто его ждет
+            task = asyncio.ensure_future(func())
+            task.add_done_callback(partial(_copy_result, claimed))
+            return await asyncio.shield(task)
+
+        counted = False
+        while True:
+            shared = self._calls.get(key)
+            if shared is None or _unclaimed(shared):
+                # Занявший ключ запрос не вычислил результат (отменен или обошелся
+                # без него), а ожидающие удерживают его запись: начинаем заново
+                shared = asyncio.ensure_future(func())
+                self._calls[key] = shared
+                shared.add_done_callback(partial(self._done, key))
+            elif not counted:
+                counted = True
+                self.coalesced += 1
+                metrics.COALESCED_REQUESTS.inc(self.name)
+            result = await asyncio.shield(shared)
+            if result is not _UNCLAIMED:
+                return result
+
+    @contextmanager
+    def claim(self, key):
+        """Занять ключ до постановки в очередь задач.
+
+        Повторные запросы с тем же ключом ждут результат, который
+        вычислит do() внутри блока. Возвращает False, если ключ уже занят.
+        """
+        if key in self._calls:
+            yield False
+            return
+        claimed = asyncio.get_running_loop().create_future()
+        self._calls[key] = claimed
+        token = _claims.set({**_claims.get(), (id(self), key): claimed})
+        try:
+            yield True
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            if not claimed.done():
+                claimed.set_exception(e)
+                # Ожидающих может не быть: не засоряем лог asyncio
+                claimed.exception()
+            raise
+        finally:
+            _claims.reset(token)
+            if not claimed.done():
+                claimed.set_result(_UNCLAIMED)
+            self._release(key, claimed)
+
+    @contextmanager
+    def hold(self, key):
+        """Ожидание уже выполняющейся задачи без места в очереди задач.
+
+        Возвращает True, если ключ занят; тогда результат остается
+        доступным do() до выхода из блока, даже если задача успеет
+        завершиться.
+        """
+        if key not in self._calls:
+            yield False
+            return
+        self._holds[key] = self._holds.get(key, 0) + 1
+        try:
+            yield True
+        finally:
+            self._holds[key] -= 1
+            if not self._holds[key]:
+                del self._holds[key]
+                shared = self._calls.get(key)
+                if shared is not None and shared.done():
+                    self._release(key, shared)
+
+    def _release(self, key, shared):
+        if self._calls.get(key) is shared and not self._holds.get(key):
+            del self._calls[key]
+
+    def _done(self, key, task):
+        self._release(key, task)
+        # Исключение получат ожидающие; если их не осталось, не засоряем лог asyncio
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Ошибка задачи {self.name}: {task.exception()}")
+
+
+def _unclaimed(future):
+    return (future.done() and not future.cancelled() and future.exception() is None
+            and future.result() is _UNCLAIMED)
+
+
+def _copy_result(future, task):
+    if future.done():
+        return
+    if task.cancelled():
+        future.set_result(_UNCLAIMED)
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+        future.exception()
+    else:
+        future.set_result(task.result())
@@ -0,0 +1,36 @@
+"""Замер времени запуска бота по этапам"""
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    """Длительности этапов запуска и отчет о них в лог"""
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases = []
+
+    def add(self, name, duration):
+        self.phases.append((name, duration))
+
+    @contextmanager
+    def phase(self, name):
+        """Контекстный менеджер для замера одного этапа"""
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - began)
+
+    def format(self, title):
+        lines = [title]
+        for name, duration in self.phases:
+            lines.append(f"  {name:<32} {duration * 1000:8.1f} мс")
+        lines.append(f"  {'с начала запуска':<32} {(time.perf_counter() - self.started) * 1000:8.1f} мс")
+        return '\n'.join(lines)
+
+    def log(self, title):
+        logger.info(self.format(title))
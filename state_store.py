@@ -0,0 +1,298 @@
+"""Постоянное хранилище состояния пользователей (режим, язык, тип графика).
+
+StatePersistence подключается к Application как persistence PTB:
+состояние переживает перезапуск и доступно всем репликам бота,
+работающим с одной базой. Запись не блокирует обработчики: PTB
+собирает изменившиеся user_data раз в flush_interval секунд, а
+хранилище пишет их одной транзакцией в отдельном потоке. Чтение
+идет через кэш в памяти: данные активного пользователя берутся из
+базы не чаще раза в cache_ttl секунд. Сессии, неактивные дольше
+session_ttl, сбрасываются и удаляются из базы.
+
+Хранилище подключаемое: достаточно реализовать StateBackend.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Как часто удалять из базы истекшие сессии, секунд
+PURGE_INTERVAL = 600
+
+
+class StateBackend:
+    """Интерфейс хранилища: синхронные методы, вызываются из одного потока"""
+
+    def load(self, user_id):
+        """(данные, время записи) или None"""
+        raise NotImplementedError
+
+    def save_many(self, rows):
+        """Запись пачки (user_id, JSON, время записи) одной транзакцией"""
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+    def purge(self, older_than):
+        """Удаление записей старше older_than, возвращает их количество"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteStateBackend(StateBackend):
+    """Состояние в файле SQLite, работает без сети"""
+
+    def __init__(self, path):
+        self.path = path
+        # Соединение используется только из потока StatePersistence
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # WAL: читатели других процессов не ждут окончания записи
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS user_state ('
+            'user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS user_state_updated ON user_state (updated_at)'
+        )
+        self.connection.commit()
+
+    def load(self, user_id):
+        row = self.connection.execute(
+            'SELECT data, updated_at FROM user_state WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def save_many(self, rows):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO user_state (user_id, data, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at '
+                'WHERE excluded.updated_at >= user_state.updated_at',
+                rows
+            )
+
+    def delete(self, user_id):
+        with self.connection:
+            self.connection.execute('DELETE FROM user_state WHERE user_id = ?', (user_id,))
+
+    def purge(self, older_than):
+        with self.connection:
+            return self.connection.execute(
+                'DELETE FROM user_state WHERE updated_at < ?', (older_than,)
+            ).rowcount
+
+    def close(self):
+        self.connection.close()
+
+
+class StatePersistence(BasePersistence):
+    """Persistence PTB для user_data поверх StateBackend"""
+
+    def __init__(self, backend, session_ttl=24 * 3600, cache_ttl=2.0, flush_interval=1.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=flush_interval
+        )
+        self.backend = backend
+        self.session_ttl = session_ttl
+        self.cache_ttl = cache_ttl
+        # Все обращения к базе идут из одного потока
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state')
+        self._lock = threading.Lock()
+        self._pending = {}    # user_id -> (JSON, время) - еще не записано
+        self._flushing = {}   # user_id -> (JSON, время) - записывается сейчас
+        self._written = {}    # user_id -> (JSON, время) - последняя запись
+        self._checked = {}    # user_id -> когда данные сверялись с базой
+        self._expired = set()  # пользователи, чьи сессии удалены при очистке
+        self._flush_task = None
+        self._last_purge = 0.0
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # user_data
+
+    async def get_user_data(self):
+        # Данные загружаются лениво, при первом обновлении от пользователя
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        """Сверка user_data с базой перед обработкой обновления"""
+        now = time.monotonic()
+        checked = self._checked.get(user_id)
+        if checked is not None and now - checked < self.cache_ttl:
+            return
+        self._checked[user_id] = now
+        with self._lock:
+            if self._unsaved(user_id):
+                return
+            known = self._written.get(user_id)
+            expired = user_id in self._expired
+            self._expired.discard(user_id)
+
+        row = await self._run(self.backend.load, user_id)
+        with self._lock:
+            # Пока шло чтение, могли появиться локальные изменения
+            if self._unsaved(user_id):
+                return
+        if row is None:
+            # Записи нет: если она была, ее удалили (сессия истекла на другой
+            # реплике); если не было, локальные данные просто еще не записаны
+            if known is not None or expired:
+                user_data.clear()
+            return
+        if time.time() - row[1] > self.session_ttl:
+            # Сессия истекла
+            user_data.clear()
+            return
+        data, updated_at = row
+        if known is None or updated_at > known[1]:
+            # Запись сделана другой репликой (или до перезапуска)
+            user_data.clear()
+            user_data.update(data)
+            with self._lock:
+                self._written[user_id] = (json.dumps(data, ensure_ascii=False, sort_keys=True), updated_at)
+
+    def _unsaved(self, user_id):
+        """Есть ли у пользователя изменения, еще не записанные в базу (вызывается под _lock).
+
+        Они новее базы, поэтому сверка с ней пропускается.
+        """
+        return user_id in self._pending or user_id in self._flushing
+
+    async def update_user_data(self, user_id, data):
+        """Постановка user_data в очередь записи"""
+        try:
+            payload = json.dumps(data, ensure_ascii=False, sort_keys=True)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Состояние пользователя {user_id} не сериализуется: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            written = self._written.get(user_id)
+            # Неизмененные данные переписываем изредка, только чтобы продлить сессию
+            if written is not None and written[0] == payload and now - written[1] < self.session_ttl / 10:
+                return
+            self._pending[user_id] = (payload, now)
+            self._expired.discard(user_id)
+        if self._flush_task is None or self._flush_task.done():
+            # PTB вызывает update_user_data по очереди для всех пользователей,
+            # задача запишет их одной транзакцией после окончания цикла
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def drop_user_data(self, user_id):
+        with self._lock:
+            self._pending.pop(user_id, None)
+            self._flushing.pop(user_id, None)
+            self._written.pop(user_id, None)
+            self._expired.discard(user_id)
+        self._checked.pop(user_id, None)
+        await self._run(self.backend.delete, user_id)
+
+    async def _flush(self):
+        await asyncio.sleep(0)
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                # До окончания транзакции данные остаются незаписанными для refresh_user_data
+                self._flushing = pending
+            if not pending:
+                break
+            rows = [(user_id, payload, ts) for user_id, (payload, ts) in pending.items()]
+            try:
+                await self._run(self.backend.save_many, rows)
+            except Exception as e:
+                logger.error(f"Ошибка записи состояния: {e}")
+                with self._lock:
+                    self._flushing = {}
+                    # Вернем в очередь, если за это время не появились более новые данные
+                    for user_id, value in pending.items():
+                        self._pending.setdefault(user_id, value)
+                return
+            with self._lock:
+                self._flushing = {}
+                self._written.update(pending)
+
+        now = time.time()
+        if now - self._last_purge > PURGE_INTERVAL:
+            self._last_purge = now
+            await self._purge(now)
+
+    async def _purge(self, now):
+        """Удаление истекших сессий из базы и из памяти"""
+        older_than = now - self.session_ttl
+        removed = await self._run(self.backend.purge, older_than)
+        with self._lock:
+            for user_id in [u for u, (_, ts) in self._written.items() if ts < older_than]:
+                del self._written[user_id]
+                self._checked.pop(user_id, None)
+                self._expired.add(user_id)
+        if removed:
+            logger.info(f"Удалено истекших сессий: {removed}")
+
+    async def flush(self):
+        """Запись всего накопленного и закрытие хранилища (при остановке)"""
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._flush()
+        await self._run(self.backend.close)
+        self._executor.shutdown(wait=True)
+
+    # Остальные данные PTB не сохраняются
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+
+def create_persistence(backend, path, session_ttl, cache_ttl, flush_interval):
+    """Persistence по имени хранилища ('sqlite'), None - состояние только в памяти"""
+    if backend == 'sqlite':
+        return StatePersistence(SQLiteStateBackend(path), session_ttl, cache_ttl, flush_interval)
+    if backend != 'memory':
+        logger.warning(f"Неизвестное хранилище состояния {backend!r}, состояние хранится в памяти")
+    return None
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from singleflight import SingleFlight  # noqa: E402
+
+
+class ClaimTest(unittest.IsolatedAsyncioTestCase):
+    async def test_waiters_recompute_after_claimer_is_cancelled(self):
+        """claim -> hold -> отмена занявшего ключ: ожидающие получают результат"""
+        flight = SingleFlight('test')
+        calls = []
+        claimed = asyncio.Event()
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'result'
+
+        async def claimer():
+            with flight.claim('key') as owner:
+                self.assertTrue(owner)
+                claimed.set()
+                await asyncio.sleep(10)
+
+        async def waiter():
+            with flight.hold('key') as held:
+                self.assertTrue(held)
+                return await flight.do('key', work)
+
+        claim_task = asyncio.create_task(claimer())
+        await claimed.wait()
+        waiters = [asyncio.create_task(waiter()) for _ in range(3)]
+        await asyncio.sleep(0)
+        claim_task.cancel()
+        results = await asyncio.gather(*waiters)
+
+        self.assertEqual(results, ['result'] * 3)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.in_flight, 0)
+
+    async def test_waiters_recompute_when_claimer_skips_work(self):
+        """Занявший ключ запрос обошелся без do() (например, ответ из кэша)"""
+        flight = SingleFlight('test')
+        release = asyncio.Event()
+
+        async def claimer():
+            with flight.claim('key'):
+                await release.wait()
+
+        async def waiter():
+            with flight.hold('key'):
+                return await flight.do('key', lambda: asyncio.sleep(0, result='fresh'))
+
+        claim_task = asyncio.create_task(claimer())
+        await asyncio.sleep(0)
+        waiter_task = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+        release.set()
+        await claim_task
+
+        self.assertEqual(await waiter_task, 'fresh')
+        self.assertEqual(flight.in_flight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
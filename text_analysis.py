@@ -0,0 +1,348 @@
+"""Анализ текста за один проход.
+
+TextAnalysis разбирает текст один раз и хранит всё, что нужно
+графикам и подписям: гистограммы длин слов, длины предложений и
+абзацев, частоты слов. Текст можно подавать частями (feed), поэтому
+большие документы анализируются потоково: память зависит от размера
+словаря, а не от размера файла. Результаты для сообщений кэшируются
+по хэшу текста.
+
+Леммы и части речи (lexical) считаются по словарю lexicon при первом
+обращении - по частотам форм, без повторного прохода по тексту.
+"""
+import codecs
+import hashlib
+import re
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+import lexicon
+
+# Токены, разделенные пробельными символами (как text.split())
+_TOKEN = re.compile(r'\S+')
+# Слова из букв внутри токена (любой алфавит, в том числе ё, é, ñ, ß)
+_WORD = re.compile(r'[^\W\d_]+')
+# Знаки конца предложения
+_SENTENCE_END = re.compile(r'[.!?]+')
+
+# Минимальная длина слова для частотного анализа
+MIN_FREQ_WORD_LEN = 3
+# Границы групп слов по длине: 1-3, 4-6, 7+
+LENGTH_BUCKET_EDGES = [4, 7]
+# Незавершенный токен длиннее этого обрабатывается принудительно
+MAX_CARRY_CHARS = 1 << 20
+# Размер части файла при потоковом чтении
+READ_CHUNK_BYTES = 64 * 1024
+
+_CACHE_SIZE = 256
+_cache = OrderedDict()
+
+
+class LengthSeries:
+    """Ряд длин (предложений или абзацев) с ограниченной памятью.
+
+    Пока значений не больше max_points, они хранятся точно. Дальше
+    соседние точки попарно объединяются в корзины, а ширина корзины
+    удваивается, так что в памяти всегда не больше max_points сумм.
+    """
+
+    def __init__(self, max_points=1024, head_size=15):
+        self.max_points = max_points
+        self.head_size = head_size
+        self.head = []
+        self.count = 0
+        self.total = 0
+        self.bin_width = 1
+        self._sums = []
+        self._counts = []
+
+    def append(self, value):
+        if len(self.head) < self.head_size:
+            self.head.append(value)
+        self.count += 1
+        self.total += value
+        if self._counts and self._counts[-1] < self.bin_width:
+            self._sums[-1] += value
+            self._counts[-1] += 1
+            return
+        self._sums.append(value)
+        self._counts.append(1)
+        if len(self._sums) > self.max_points:
+            self._merge()
+
+    def _merge(self):
+        sums = np.array(self._sums, dtype=np.int64)
+        counts = np.array(self._counts, dtype=np.int64)
+        if len(sums) % 2:
+            sums = np.append(sums, 0)
+            counts = np.append(counts, 0)
+        self._sums = sums.reshape(-1, 2).sum(axis=1).tolist()
+        self._counts = counts.reshape(-1, 2).sum(axis=1).tolist()
+        if self._counts[-1] == 0:
+            self._sums.pop()
+            self._counts.pop()
+        self.bin_width *= 2
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def values(self):
+        """Все значения, если ряд еще точный, иначе средние по корзинам"""
+        sums = np.array(self._sums, dtype=np.float64)
+        counts = np.array(self._counts, dtype=np.float64)
+        if self.bin_width == 1:
+            return sums.astype(np.int64)
+        return sums / np.maximum(counts, 1)
+
+    def binned(self, max_bins):
+        """Ряд, сжатый до max_bins точек (средние по группам).
+
+        Возвращает (значения, сколько исходных точек в одной группе).
+        """
+        values = self.values()
+        group = self.bin_width
+        if len(values) > max_bins:
+            factor = -(-len(values) // max_bins)
+            counts = np.array(self._counts, dtype=np.float64)
+            sums = values * counts
+            pad = -len(values) % factor
+            sums = np.append(sums, np.zeros(pad)).reshape(-1, factor).sum(axis=1)
+            counts = np.append(counts, np.zeros(pad)).reshape(-1, factor).sum(axis=1)
+            values = sums / np.maximum(counts, 1)
+            group *= factor
+        return values, group
+
+
+class TextAnalysis:
+    """Результат однопроходного анализа текста.
+
+    Текст подается целиком в конструктор или частями через feed(),
+    после последней части нужно вызвать finish().
+    """
+
+    def __init__(self, text=None):
+        self.chars_total = 0
+        self.chars_no_spaces = 0
+        self.paragraph_count = 1
+        self.word_count = 0
+        self.token_length_sum = 0
+        # Гистограмма длин токенов: индекс - длина, значение - количество
+        self.token_length_hist = np.zeros(1, dtype=np.int64)
+        # Количество буквенных слов в группах по длине (1-3, 4-6, 7+)
+        self.length_bucket_counts = np.zeros(3, dtype=np.int64)
+        self.frequencies = Counter()
+        # Слова короче MIN_FREQ_WORD_LEN: в топ не входят, но нужны для частей речи
+        self.short_words = Counter()
+        self.sentence_lengths = LengthSeries()
+        self.paragraph_lengths = LengthSeries()
+
+        self._carry = ''
+        self._sentence_words = 0
+        self._paragraph_words = 0
+        self._lexical = None
+        if text is not None:
+            self.feed(text)
+            self.finish()
+
+    def feed(self, chunk):
+        """Обработка очередной части текста"""
+        self.chars_total += len(chunk)
+        buffer = self._carry + chunk
+
+        # Последний токен может продолжиться в следующей части,
+        # поэтому он вместе с пробелами перед ним переносится дальше
+        end = len(buffer)
+        if buffer and not buffer[-1].isspace() and len(buffer) < MAX_CARRY_CHARS:
+            end = buffer.rfind(' ') + 1
+            end = max(end, buffer.rfind('\n') + 1, buffer.rfind('\t') + 1)
+            while end and buffer[end - 1].isspace():
+                end -= 1
+        self._carry = self._process(buffer, end)
+
+    def finish(self):
+        """Завершение анализа: обработка остатка текста"""
+        if self._carry:
+            self._carry = self._process(self._carry, len(self._carry))
+        self.chars_no_spaces += len(self._carry) - self._carry.count(' ')
+        self.paragraph_count += self._carry.count('\n\n')
+        self._carry = ''
+        if self._sentence_words:
+            self.sentence_lengths.append(self._sentence_words)
+            self._sentence_words = 0
+        if self._paragraph_words:
+            self.paragraph_lengths.append(self._paragraph_words)
+            self._paragraph_words = 0
+        return self
+
+    def _process(self, buffer, end):
+        """Разбор токенов buffer[:end], возвращает необработанный хвост"""
+        position = 0
+        token_lengths = []
+        word_lengths = []
+        frequencies = self.frequencies
+        short_words = self.short_words
+        sentence_words = self._sentence_words
+        paragraph_words = self._paragraph_words
+
+        for match in _TOKEN.finditer(buffer, 0, end):
+            token = match.group()
+            gap = buffer[position:match.start()]
+            position = match.end()
+
+            # Пробельный промежуток перед токеном: пробелы и границы абзацев
+            if gap:
+                self.chars_no_spaces += len(gap) - gap.count(' ')
+                breaks = gap.count('\n\n')
+                if breaks:
+                    self.paragraph_count += breaks
+                    if paragraph_words:
+                        self.paragraph_lengths.append(paragraph_words)
+                        paragraph_words = 0
+
+            self.chars_no_spaces += len(token)
+            token_lengths.append(len(token))
+            paragraph_words += 1
+            for word in _WORD.findall(token.lower()):
+                word_lengths.append(len(word))
+                if len(word) >= MIN_FREQ_WORD_LEN:
+                    frequencies[word] += 1
+                else:
+                    short_words[word] += 1
+
+            # Токен может содержать несколько концов предложений ("да.нет!")
+            parts = _SENTENCE_END.split(token)
+            if parts[0]:
+                sentence_words += 1
+            for part in parts[1:]:
+                if sentence_words:
+                    self.sentence_lengths.append(sentence_words)
+                sentence_words = 1 if part else 0
+
+        self._sentence_words = sentence_words
+        self._paragraph_words = paragraph_words
+        self._lexical = None
+
+        # Гистограммы обновляются векторно, по одной на часть текста
+        if token_lengths:
+            lengths = np.array(token_lengths, dtype=np.int64)
+            self.word_count += len(lengths)
+            self.token_length_sum += int(lengths.sum())
+            hist = np.bincount(lengths)
+            if len(hist) > len(self.token_length_hist):
+                hist[:len(self.token_length_hist)] += self.token_length_hist
+                self.token_length_hist = hist
+            else:
+                self.token_length_hist[:len(hist)] += hist
+        if word_lengths:
+            buckets = np.digitize(np.array(word_lengths), LENGTH_BUCKET_EDGES)
+            self.length_bucket_counts += np.bincount(buckets, minlength=3)
+
+        return buffer[position:]
+
+    @property
+    def sentence_count(self):
+        return self.sentence_lengths.count
+
+    @property
+    def letter_word_count(self):
+        """Количество буквенных слов (без чисел и знаков)"""
+        return int(self.length_bucket_counts.sum())
+
+    @property
+    def avg_word_len(self):
+        return self.token_length_sum / self.word_count if self.word_count else 0
+
+    @property
+    def avg_sentence_len(self):
+        return self.word_count / self.sentence_count if self.sentence_count else 0
+
+    @property
+    def avg_paragraph_words(self):
+        return self.paragraph_lengths.mean
+
+    @property
+    def avg_sentence_words(self):
+        return self.sentence_lengths.mean
+
+    def length_buckets(self):
+        """Количество коротких (1-3), средних (4-6) и длинных (7+) слов"""
+        return [int(c) for c in self.length_bucket_counts]
+
+    def top_words(self, n=10):
+        return self.frequencies.most_common(n)
+
+    @property
+    def lexical(self):
+        """LexicalStats: язык, частоты лемм без служебных слов, частоты частей речи"""
+        if self._lexical is None:
+            self._lexical = lexicon.lexical_stats(self.frequencies + self.short_words, self.frequencies)
+        return self._lexical
+
+    @property
+    def language(self):
+        return self.lexical.language
+
+    def top_lemmas(self, n=10):
+        return self.lexical.lemmas.most_common(n)
+
+
+def analyze(text):
+    """Анализ текста с кэшированием по хэшу сообщения"""
+    key = hashlib.sha1(text.encode('utf-8')).digest()
+    analysis = _cache.get(key)
+    if analysis is not None:
+        _cache.move_to_end(key)
+        return analysis
+    analysis = TextAnalysis(text)
+    _cache[key] = analysis
+    if len(_cache) > _CACHE_SIZE:
+        _cache.popitem(last=False)
+    return analysis
+
+
+def _detect_encoding(sample):
+    """UTF-8, если первые байты корректны, иначе cp1251 (частый вариант для .txt)"""
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1251'
+
+
+def _universal_newlines(chunks):
+    """Замена переводов строк CRLF и CR на LF, как в сообщениях Telegram.
+
+    CR в конце части ждет следующую: это может быть начало CRLF.
+    """
+    carry = ''
+    for chunk in chunks:
+        chunk = carry + chunk
+        carry = ''
+        if chunk.endswith('\r'):
+            chunk, carry = chunk[:-1], '\r'
+        yield chunk.replace('\r\n', '\n').replace('\r', '\n')
+    if carry:
+        yield '\n'
+
+
+def _decode_file(text_file, chunk_bytes):
+    """Части текста файла, открытого в двоичном режиме"""
+    raw = text_file.read(chunk_bytes)
+    if raw.startswith(codecs.BOM_UTF8):
+        raw = raw[len(codecs.BOM_UTF8):]
+    decoder = codecs.getincrementaldecoder(_detect_encoding(raw))(errors='replace')
+    while raw:
+        yield decoder.decode(raw)
+        raw = text_file.read(chunk_bytes)
+    yield decoder.decode(b'', final=True)
+
+
+def analyze_file(path, chunk_bytes=READ_CHUNK_BYTES):
+    """Потоковый анализ текстового файла частями по chunk_bytes"""
+    analysis = TextAnalysis()
+    with open(path, 'rb') as text_file:
+        for chunk in _universal_newlines(_decode_file(text_file, chunk_bytes)):
+            analysis.feed(chunk)
+    return analysis.finish()
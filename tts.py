@@ -0,0 +1,128 @@
+"""Синтез речи и перекодирование в голосовое сообщение.
+
+Аудио не касается диска: gTTS пишет MP3 в буфер в памяти, а ffmpeg
+перекодирует его в OGG/Opus через каналы stdin/stdout. Локальный
+синтезатор eSpeak NG (резервный, без сети) отдает WAV, который ffmpeg
+перекодирует в MP3 того же формата, что у gTTS.
+"""
+import re
+import shutil
+import subprocess
+from io import BytesIO
+
+
+class TranscodeError(Exception):
+    """ffmpeg или eSpeak NG завершились с ошибкой"""
+
+
+def synthesize(text, lang, timeout=None):
+    """Синхронный синтез речи, возвращает MP3 в байтах.
+
+    Выполняет HTTP-запрос к Google, поэтому вызывается вне цикла событий.
+    timeout ограничивает каждый HTTP-запрос, чтобы поток не висел вечно.
+    """
+    # gTTS тянет за собой requests, импортируем при первом синтезе
+    from gtts import gTTS
+
+    buffer = BytesIO()
+    gTTS(text=text, lang=lang, slow=False, timeout=timeout).write_to_fp(buffer)
+    return buffer.getvalue()
+
+
+def find_ffmpeg(path='ffmpeg'):
+    """Полный путь к ffmpeg или None, если его нет"""
+    return shutil.which(path)
+
+
+def _run_pipe(command, data, timeout):
+    """Запуск команды с данными на stdin, возвращает stdout"""
+    try:
+        result = subprocess.run(command, input=data, capture_output=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise TranscodeError(str(e)) from e
+    if result.returncode or not result.stdout:
+        raise TranscodeError(result.stderr.decode('utf-8', 'replace').strip() or f'код {result.returncode}')
+    return result.stdout
+
+
+def to_opus(mp3, ffmpeg='ffmpeg', bitrate_kbps=32, timeout=60):
+    """Перекодирование MP3 в OGG/Opus (формат голосовых сообщений Telegram).
+
+    Синхронно, вызывается вне цикла событий.
+    """
+    return _run_pipe([
+        ffmpeg, '-hide_banner', '-loglevel', 'error',
+        '-f', 'mp3', '-i', 'pipe:0', '-vn',
+        '-c:a', 'libopus', '-b:a', f'{bitrate_kbps}k', '-application', 'voip',
+        '-f', 'ogg', 'pipe:1',
+    ], mp3, timeout)
+
+
+def to_mp3(wav, ffmpeg='ffmpeg', timeout=60):
+    """Перекодирование WAV в MP3 24 кГц моно, как у gTTS.
+
+    Одинаковый формат позволяет склеивать части длинного текста,
+    синтезированные разными движками.
+    """
+    return _run_pipe([
+        ffmpeg, '-hide_banner', '-loglevel', 'error',
+        '-f', 'wav', '-i', 'pipe:0', '-vn',
+        '-ar', '24000', '-ac', '1', '-c:a', 'libmp3lame', '-b:a', '32k',
+        '-f', 'mp3', 'pipe:1',
+    ], wav, timeout)
+
+
+def synthesize_espeak(text, lang, espeak='espeak-ng', timeout=60):
+    """Локальный синтез речи через eSpeak NG, возвращает WAV в байтах"""
+    return _run_pipe(
+        [espeak, '-v', lang, '-b', '1', '--stdin', '--stdout'], text.encode('utf-8'), timeout
+    )
+
+
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…])\s+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _split_long_sentence(sentence, max_chars):
+    """Разбивка предложения длиннее max_chars по пробелам"""
+    parts = []
+    current = ''
+    for word in _WHITESPACE.split(sentence):
+        while len(word) > max_chars:
+            if current:
+                parts.append(current)
+                current = ''
+            parts.append(word[:max_chars])
+            word = word[max_chars:]
+        if current and len(current) + 1 + len(word) > max_chars:
+            parts.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_into_chunks(text, max_chars=500, first_chunk_chars=None):
+    """Разбивка текста на части по границам предложений.
+
+    Первая часть может быть короче остальных, чтобы быстрее
+    отправить пользователю начало озвучки.
+    """
+    chunks = []
+    current = ''
+    limit = first_chunk_chars or max_chars
+    for sentence in _SENTENCE_BOUNDARY.split(text.strip()):
+        if not sentence:
+            continue
+        pieces = [sentence] if len(sentence) <= limit else _split_long_sentence(sentence, limit)
+        for piece in pieces:
+            if current and len(current) + 1 + len(piece) > limit:
+                chunks.append(current)
+                current = ''
+                limit = max_chars
+            current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,319 @@
+"""Движки синтеза речи: сроки, дублирование медленных запросов, выключатель.
+
+gTTS ходит в сеть и иногда отвечает секундами или не отвечает вовсе.
+Каждый вызов движка ограничен сроком. Если ответа нет дольше обычного
+(p95 недавних вызовов), тот же запрос отправляется еще раз и берется
+первый ответ. После нескольких сбоев подряд выключатель размыкается,
+и запросы сразу идут в следующий движок (локальный eSpeak NG), пока
+основной не восстановится.
+
+Все движки возвращают MP3 24 кГц моно.
+"""
+import asyncio
+import logging
+import math
+import shutil
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import metrics
+import tts
+
+logger = logging.getLogger(__name__)
+
+# Время вызова пересчитывается на 100 символов: gTTS синтезирует текст
+# частями по 100 символов, и длинный текст отвечает пропорционально дольше
+LATENCY_UNIT_CHARS = 100
+# Пока вызовов меньше, запрос дублируется через половину срока
+HEDGE_MIN_SAMPLES = 20
+
+Speech = namedtuple('Speech', ['audio', 'backend', 'fallback'])
+
+
+class TTSUnavailable(Exception):
+    """Ни один движок не смог синтезировать речь"""
+
+
+def join_speech(parts):
+    """Склейка частей длинного текста (MP3 состоит из независимых фреймов)"""
+    return Speech(
+        b''.join(part.audio for part in parts),
+        ','.join(sorted({part.backend for part in parts})),
+        any(part.fallback for part in parts)
+    )
+
+
+class Backend:
+    """Движок синтеза речи.
+
+    synthesize(text, lang, timeout) вызывается в отдельном потоке
+    и возвращает MP3 в байтах.
+    """
+
+    name = ''
+    # Можно ли дублировать медленные запросы (для сетевых движков)
+    hedge = False
+
+    @property
+    def available(self):
+        return True
+
+    def synthesize(self, text, lang, timeout):
+        raise NotImplementedError
+
+
+class GTTSBackend(Backend):
+    """Google Translate TTS"""
+
+    name = 'gtts'
+    hedge = True
+
+    def synthesize(self, text, lang, timeout):
+        return tts.synthesize(text, lang, timeout)
+
+
+class LocalBackend(Backend):
+    """eSpeak NG и ffmpeg: звучит хуже, зато без сети"""
+
+    name = 'local'
+
+    def __init__(self, espeak='espeak-ng', ffmpeg='ffmpeg'):
+        self.espeak = shutil.which(espeak)
+        self.ffmpeg = tts.find_ffmpeg(ffmpeg)
+
+    @property
+    def available(self):
+        return self.espeak is not None and self.ffmpeg is not None
+
+    def synthesize(self, text, lang, timeout):
+        started = time.monotonic()
+        wav = tts.synthesize_espeak(text, lang, self.espeak, timeout)
+        return tts.to_mp3(wav, self.ffmpeg, max(1.0, timeout - (time.monotonic() - started)))
+
+
+BACKENDS = {
+    'gtts': GTTSBackend,
+    'local': lambda: LocalBackend(config.TTS_LOCAL_ENGINE, config.FFMPEG_PATH),
+}
+
+
+class LatencyWindow:
+    """Время последних вызовов для оценки перцентилей"""
+
+    def __init__(self, size=500):
+        self._values = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, seconds):
+        self._values.append(seconds)
+
+    def percentile(self, p):
+        """Перцентиль (ближайший ранг) или None, если вызовов еще не было"""
+        values = sorted(self._values)
+        if not values:
+            return None
+        return values[max(1, math.ceil(p / 100 * len(values))) - 1]
+
+
+class CircuitBreaker:
+    """Выключатель: размыкается после failures сбоев подряд.
+
+    Через reset_seconds пропускает один пробный вызов: успех замыкает
+    выключатель, сбой размыкает его снова.
+    """
+
+    def __init__(self, failures, reset_seconds, clock=time.monotonic):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._failed = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if self._clock() - self._opened_at >= self.reset_seconds:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def success(self):
+        self._failed = 0
+        self._opened_at = None
+        self._probing = False
+
+    def failure(self):
+        """Учет сбоя; True, если выключатель только что разомкнулся"""
+        self._failed += 1
+        if self._opened_at is None and self._failed < self.failures:
+            return False
+        opened = self._opened_at is None
+        self._opened_at = self._clock()
+        self._probing = False
+        return opened
+
+    def abandon(self):
+        """Пробный вызов отменен, не дождавшись результата"""
+        self._probing = False
+
+
+class ResilientTTS:
+    """Синтез речи первым доступным движком из списка.
+
+    threads - сколько вызовов синтеза может идти одновременно; у движков
+    с дублированием потоков в attempts раз больше.
+    """
+
+    def __init__(self, backends, timeout, attempts=2, breaker_failures=5, breaker_reset=30,
+                 threads=16):
+        self.backends = list(backends)
+        self.timeout = timeout
+        self.attempts = attempts
+        self.breakers = {b.name: CircuitBreaker(breaker_failures, breaker_reset) for b in self.backends}
+        self.latency = {b.name: LatencyWindow() for b in self.backends}
+        # У каждого движка свой пул потоков: зависшие запросы основного движка
+        # не задерживают резервный и не занимают общий пул asyncio
+        self._executors = {
+            b.name: ThreadPoolExecutor(
+                max_workers=threads * (max(1, attempts) if b.hedge else 1), thread_name_prefix=f'tts-{b.name}'
+            )
+            for b in self.backends
+        }
+
+    async def synthesize(self, text, lang):
+        """Синтез речи, возвращает Speech; TTSUnavailable, если все движки отказали"""
+        errors = []
+        for index, backend in enumerate(self.backends):
+            breaker = self.breakers[backend.name]
+            if not breaker.allow():
+                metrics.TTS_REQUESTS.inc(backend.name, 'skipped')
+                continue
+            try:
+                audio = await self._call(backend, text, lang)
+            except asyncio.CancelledError:
+                breaker.abandon()
+                raise
+            except Exception as e:
+                errors.append(f"{backend.name}: {e!r}")
+                if breaker.failure():
+                    logger.warning(
+                        f"Движок {backend.name} отключен на {breaker.reset_seconds} с после сбоев: {e!r}"
+                    )
+                continue
+            breaker.success()
+            return Speech(audio, backend.name, index > 0)
+        raise TTSUnavailable('; '.join(errors) or 'все движки отключены')
+
+    def hedge_delay(self, backend, text):
+        """Через сколько секунд дублировать запрос: p95 недавних вызовов для такой длины текста"""
+        window = self.latency[backend.name]
+        if len(window) < HEDGE_MIN_SAMPLES:
+            return self.timeout / 2
+        return window.percentile(95) * math.ceil(len(text) / LATENCY_UNIT_CHARS)
+
+    async def _call(self, backend, text, lang):
+        """Вызов движка со сроком; медленный или неудачный запрос повторяется"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + self.timeout
+        attempts = self.attempts if backend.hedge else 1
+        hedge_at = started + self.hedge_delay(backend, text)
+        pending = {self._attempt(backend, text, lang, self.timeout)}
+        launched = 1
+        error = None
+        try:
+            while pending:
+                wake = deadline if launched >= attempts else min(deadline, hedge_at)
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, wake - loop.time()), return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                now = loop.time()
+                if now >= deadline:
+                    metrics.TTS_REQUESTS.inc(backend.name, 'timeout')
+                    raise TimeoutError(f"нет ответа за {self.timeout} с")
+                # Упавший запрос повторяем сразу, медленный - дублируем после p95
+                if launched < attempts and (not pending or now >= hedge_at):
+                    metrics.TTS_REQUESTS.inc(backend.name, 'hedge' if pending else 'retry')
+                    pending.add(self._attempt(backend, text, lang, deadline - now))
+                    launched += 1
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _attempt(self, backend, text, lang, timeout):
+        units = math.ceil(len(text) / LATENCY_UNIT_CHARS) or 1
+        window = self.latency[backend.name]
+
+        def run():
+            # Время учитывается и для проигравших дублей: поток доработает до конца
+            started = time.perf_counter()
+            try:
+                audio = backend.synthesize(text, lang, max(1.0, timeout))
+            except Exception:
+                metrics.TTS_REQUESTS.inc(backend.name, 'error')
+                raise
+            elapsed = time.perf_counter() - started
+            window.add(elapsed / units)
+            metrics.TTS_BACKEND_LATENCY.observe(elapsed, backend.name)
+            metrics.TTS_REQUESTS.inc(backend.name, 'ok')
+            return audio
+
+        executor = self._executors[backend.name]
+        return asyncio.ensure_future(asyncio.get_running_loop().run_in_executor(executor, run))
+
+    def stats(self):
+        """Перцентили времени на 100 символов (с) и состояние выключателя по движкам"""
+        return {
+            backend.name: {
+                'calls': len(self.latency[backend.name]),
+                'p50': self.latency[backend.name].percentile(50),
+                'p95': self.latency[backend.name].percentile(95),
+                'p99': self.latency[backend.name].percentile(99),
+                'breaker': self.breakers[backend.name].state,
+            }
+            for backend in self.backends
+        }
+
+    def close(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_tts():
+    """Движки из TTS_BACKENDS (по порядку), недоступные пропускаются"""
+    backends = []
+    for name in config.TTS_BACKENDS.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in BACKENDS:
+            raise ValueError(f"Неизвестный движок синтеза речи: {name}")
+        backend = BACKENDS[name]()
+        if not backend.available:
+            logger.warning(f"Движок синтеза речи {name} недоступен, пропускаю")
+            continue
+        backends.append(backend)
+    return ResilientTTS(
+        backends, config.TTS_TIMEOUT_SECONDS, config.TTS_HEDGE_ATTEMPTS,
+        config.TTS_BREAKER_FAILURES, config.TTS_BREAKER_RESET_SECONDS,
+        threads=config.TTS_MAX_JOBS * config.TTS_CHUNK_WORKERS
+    )
@@ -0,0 +1,113 @@
+"""Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+Обновления разных чатов обрабатываются одновременно, а обновления
+одного чата - строго по очереди, в порядке поступления. Так медленный
+синтез речи в одном чате не задерживает остальных, а два сообщения
+одного пользователя не меняют context.user_data['mode'] наперегонки.
+"""
+import asyncio
+import inspect
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _ChatQueue:
+    __slots__ = ('lock', 'pending')
+
+    def __init__(self):
+        # asyncio.Lock пропускает ожидающих в порядке очереди
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обработчик обновлений: параллельно между чатами, последовательно внутри чата.
+
+    max_chat_pending - сколько обновлений одного чата может ждать
+    обработки; остальные отбрасываются, чтобы поток сообщений из одного
+    чата не занял память.
+
+    Место из max_concurrent_updates занимается только после того, как
+    подошла очередь обновления в его чате: обновления, ждущие свой чат,
+    не мешают другим чатам. Семафор базового класса удерживается и во
+    время ожидания, поэтому его предел выше: он достигается, только если
+    все max_concurrent_updates мест уже заняты разными чатами.
+    """
+
+    __slots__ = ('max_chat_pending', 'dropped', 'running', '_limit', '_slots', '_chats')
+
+    def __init__(self, max_concurrent_updates, max_chat_pending=20):
+        # Базовый класс создает свой семафор по max_concurrent_updates,
+        # поэтому настоящий предел задается после его инициализации
+        self._limit = None
+        super().__init__(max_concurrent_updates * max(1, max_chat_pending))
+        self._limit = max_concurrent_updates
+        self.max_chat_pending = max_chat_pending
+        self.dropped = 0
+        self.running = 0
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._chats = {}
+
+    @property
+    def max_concurrent_updates(self):
+        return self._limit or self._max_concurrent_updates
+
+    @property
+    def current_concurrent_updates(self):
+        return self.running
+
+    @staticmethod
+    def chat_key(update):
+        """Ключ очереди: чат, а если его нет - пользователь"""
+        if isinstance(update, Update):
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+            if update.effective_user is not None:
+                return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.chat_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        queue = self._chats.get(key)
+        if queue is None:
+            queue = self._chats[key] = _ChatQueue()
+        if queue.pending >= self.max_chat_pending:
+            self.dropped += 1
+            metrics.UPDATES_DROPPED.inc()
+            logger.warning(f"Слишком много необработанных обновлений в чате {key}, обновление пропущено")
+            if inspect.iscoroutine(coroutine):
+                coroutine.close()
+            return
+
+        queue.pending += 1
+        try:
+            async with queue.lock:
+                await self._run(coroutine)
+        finally:
+            queue.pending -= 1
+            if not queue.pending:
+                del self._chats[key]
+
+    async def _run(self, coroutine):
+        async with self._slots:
+            self.running += 1
+            try:
+                await coroutine
+            finally:
+                self.running -= 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass